@@ -13,23 +13,28 @@
 
 import os
 import sys
+import threading
 from typing import Any, Callable
 import bpy
 import datetime
 import math
-import requests
+import time
+import uuid
 from subprocess import Popen
 
+import requests
+
 from bpy.props import *
 from bpy.types import Context, DynamicPaintModifier, DynamicPaintSurface, FluidModifier, Modifier, Object, Operator, PropertyGroup, Scene, UILayout
 
-from . import require, mail
+from .server import discovery
+from . import bake, cache_scan, completion, flow_io, history, image_sequence, require, mail, manifest, render_stats, scheduler, static_frames, targets, telemetry, workers
 
 bl_info = {
     "name": "Butler",
     "author": "doodlezucc",
     "description": "",
-    "blender": (2, 80, 0),
+    "blender": (3, 2, 0),
     "version": (0, 0, 1),
     "location": "",
     "warning": "",
@@ -38,6 +43,12 @@ bl_info = {
 classes = list()
 
 daemon = None
+# whether the daemon is running or about to be started
+daemon_enabled = False
+daemon_lock = threading.Lock()
+# port of the daemon this instance is attached to
+daemon_port = None
+telemetry_client = None
 initialized_bake_objects = False
 
 def registered(cls):
@@ -58,6 +69,23 @@ class ButlerRenderRange:
     CUSTOM = "CUSTOM"
 
 
+class ButlerBakeMode:
+    LOCAL = "LOCAL"
+    BACKGROUND = "BACKGROUND"
+
+
+class ButlerDependency:
+    AUTO = "AUTO"
+    PREVIOUS = "PREVIOUS"
+    CUSTOM = "CUSTOM"
+
+
+class ButlerRenderMode:
+    LOCAL = "LOCAL"
+    PARALLEL = "PARALLEL"
+    QUEUE = "QUEUE"
+
+
 @registered
 class Bakeable(PropertyGroup):
     bl_idname = "butler.bakeable"
@@ -72,37 +100,79 @@ def await_depsgraph_update(done: Callable[[], Any]):
 
     event.append(handler)
 
-def await_interval(check: Callable[[], bool], done: Callable[[], Any], interval=1.0):
-    def single_check():
-        if not check():
-            print("bump")
-            return interval
-
-        done()
-        return None
-
-    bpy.app.timers.register(single_check)
-
-def await_file_write(filepath, done: Callable[[], Any], interval=1.0):
-    cached_mtime = datetime.datetime.now().timestamp()
-
-    def check():
-        try:
-            return os.stat(filepath).st_mtime >= cached_mtime
-        except:
-            return False
-    
-    return await_interval(check, done, interval)
-
 cache_mods = [
     "CLOTH",
     "SOFT_BODY",
 ]
 
-bake_objects = set()
+run_history = None
+# how often the ETA of a running flow is refreshed, in seconds
+PROGRESS_INTERVAL = 5.0
+
+def get_history():
+    global run_history
+    if run_history is None:
+        run_history = history.RunHistory()
+    return run_history
+
+notifier = None
+# flows running at least this long (in seconds) send a mail when they're done
+MAIL_AFTER = 5 * 60
+
+def get_notifier():
+    '''Returns the mail notifier, or None if mails aren't set up (see mail.py).'''
+    global notifier
+    if notifier is None:
+        config = mail.MailConfig.load()
+        if config is not None:
+            notifier = mail.Notifier(config)
+            notifier.start()
+    return notifier
+
+def stop_notifier(timeout=2.0):
+    global notifier
+    if notifier is not None:
+        notifier.stop(timeout)
+        notifier = None
+
+class FlowAbort:
+    '''Handed to the actions of a running flow. Calling it with a reason stops the flow, and
+    whatever actions left running in the background is stopped with what they passed to `on_abort`.'''
+
+    def __init__(self, stop: Callable[[str], Any]):
+        self.stop = stop
+        self.handlers = []
+        self.aborted = False
+
+    def __call__(self, reason: str):
+        if self.aborted:
+            return
+        self.aborted = True
+        running_flows.discard(self)
+        self.stop(reason)
+        for handler in self.handlers:
+            handler()
+        self.handlers.clear()
+
+    def on_abort(self, handler: Callable[[], Any]):
+        if self.aborted:
+            handler()
+        else:
+            self.handlers.append(handler)
+
+# flows that are still running, aborted when the addon is unregistered
+running_flows = set()
+
+def operator_context():
+    '''Long running operators run modal with their progress in the UI, and blocking without one.'''
+    return "EXEC_DEFAULT" if bpy.app.background else "INVOKE_DEFAULT"
+
+target_index = targets.TargetIndex()
+# object name -> fingerprint of its modifier stack when `bakeable` was last checked
+bakeable_fingerprints = {}
 
 def on_target_update(butler_action, ctx: Context):
-    update_bake_objects(ctx.scene)
+    index_action(butler_action, ctx.scene)
     return None
 
 def on_modifier_update(butler_action, ctx: Context):
@@ -114,15 +184,71 @@ def on_modifier_update(butler_action, ctx: Context):
             butler_action.bake_paint_surface = surfaces[0].name
     return None
 
+def index_action(action, scene: Scene):
+    '''Updates the target index for a single action.'''
+    obj = scene.objects.get(action.target) if action.target else None
+    pointer = obj.as_pointer() if obj is not None else None
+    bake = action.action_type == ButlerActionType.BAKE
+
+    previous = target_index.remove(action.ensure_uid())
+    if previous is not None and previous not in target_index.bake_objects:
+        bakeable_fingerprints.pop(previous, None)
+
+    if target_index.set(action.uid, action.target, bake, pointer) and obj is not None:
+        # newly tracked objects might not see a depsgraph update for a while
+        update_bakeables(obj)
+
+def unindex_action(action):
+    name = target_index.remove(action.uid)
+    if name is not None and name not in target_index.bake_objects:
+        bakeable_fingerprints.pop(name, None)
+
 def update_bake_objects(scene: Scene):
-    global bake_objects
-    bake_objects = set()
+    '''Rebuilds the target index from scratch (after loading a file or undoing).'''
+    target_index.clear()
+    bakeable_fingerprints.clear()
+    seen = set()
 
     butler = scene.butler
     for flow in butler.flows:
         for action in flow.actions:
-            if action.action_type == ButlerActionType.BAKE and action.target != "":
-                bake_objects.add(action.target)
+            if action.uid in seen:
+                # duplicated along with its flow or scene
+                action.uid = ""
+            index_action(action, scene)
+            seen.add(action.uid)
+
+def import_flows(scene: Scene, text: str):
+    '''Imports a flow export (see flow_io) into the scene, keeping the target index in sync.
+    Returns warnings, raises ValueError if `text` isn't a flow export.'''
+    # replaced flows lose their actions without an update callback telling the index
+    for flow in scene.butler.flows:
+        for action in flow.actions:
+            unindex_action(action)
+    try:
+        return flow_io.import_flows(scene.butler, text)
+    finally:
+        update_bake_objects(scene)
+
+def rename_target(scene: Scene, old: str, new: str):
+    print(f"Butler: {old} was renamed to {new}")
+    # a copy, on_target_update re-indexes every action as its target changes
+    uids = set(target_index.actions(old))
+    if not uids:
+        return
+    for flow in scene.butler.flows:
+        for action in flow.actions:
+            if action.uid in uids:
+                action.target = new
+                uids.discard(action.uid)
+                if not uids:
+                    return
+
+def forget_missing_targets(scene: Scene):
+    '''Deleted objects keep their actions (an undo might bring them back), but lose their pointer.'''
+    for name in list(target_index.by_name):
+        if scene.objects.get(name) is None:
+            target_index.forget_pointer(name)
 
 def is_bakeable(mod: Modifier):
     if mod.type == "FLUID":
@@ -132,13 +258,35 @@ def is_bakeable(mod: Modifier):
     
     return mod.type in cache_mods
 
+def modifier_fingerprint(obj: Object):
+    '''Everything about the modifier stack that decides which modifiers are bakeable.'''
+    fingerprint = []
+    for mod in obj.modifiers:
+        if mod.type == "FLUID":
+            state = mod.fluid_type
+        elif mod.type == "DYNAMIC_PAINT":
+            state = (mod.ui_type, bool(mod.canvas_settings))
+        else:
+            state = None
+        fingerprint.append((mod.name, mod.type, state))
+    return tuple(fingerprint)
+
 def update_bakeables(obj: Object):
-    obj.bakeable.clear()
+    '''Rewrites `obj.bakeable`, but only if the modifier stack changed in a way that matters.'''
+    fingerprint = modifier_fingerprint(obj)
+    if bakeable_fingerprints.get(obj.name) == fingerprint:
+        return
+    bakeable_fingerprints[obj.name] = fingerprint
 
-    for mod in obj.modifiers:
-        if is_bakeable(mod):
-            bak = obj.bakeable.add()
-            bak.name = mod.name
+    names = [mod.name for mod in obj.modifiers if is_bakeable(mod)]
+    if [bak.name for bak in obj.bakeable] == names:
+        return
+
+    # writing to the collection triggers another depsgraph update
+    obj.bakeable.clear()
+    for name in names:
+        bak = obj.bakeable.add()
+        bak.name = name
 
 
 def mod_icon(modtype):
@@ -159,13 +307,14 @@ class ButlerAction(PropertyGroup):
     bl_idname = "butler.action"
 
     enabled: BoolProperty(name="Enable", default=True)
+    uid: StringProperty(options={'HIDDEN'})
 
     action_type: EnumProperty(name="Action Type", items=[
         (ButlerActionType.OBJECT_OPERATOR, "Object Operator", "Call an operator on a specific object", "SEQUENCE_COLOR_02", 0),
         (ButlerActionType.PYTHON_OPERATOR, "Python Operator", "Execute a line of Python code", "SEQUENCE_COLOR_04", 1),
         (ButlerActionType.RENDER, "Render", "Render the scene", "SEQUENCE_COLOR_06", 2),
         (ButlerActionType.BAKE, "Bake Physics", "Bake a physics modifier", "SEQUENCE_COLOR_05", 3),
-    ])
+    ], update=on_target_update)
 
     target: StringProperty(name="Object", update=on_target_update)
     operator: StringProperty(name="Operator")
@@ -185,10 +334,34 @@ class ButlerAction(PropertyGroup):
         ]
     render_range: EnumProperty(name="Frame Range", items=beautify_render_ranges)
 
+    rerender: BoolProperty(name="Rerender", default=True,
+                           description="Render every frame even if it's already on disk. When off, frames rendered "
+                                       "with the same settings since the .blend was last saved are kept")
+    reuse_static_frames: BoolProperty(name="Reuse Static Frames", description="Render frames in which nothing changes only once and link their output for the others")
+    render_mode: EnumProperty(name="Render Mode", items=[
+        (ButlerRenderMode.LOCAL, "Local", "Render inside this Blender session"),
+        (ButlerRenderMode.PARALLEL, "Parallel", "Render chunks of the frame range in background Blender processes"),
+        (ButlerRenderMode.QUEUE, "Work Queue", "Queue chunks of the frame range on the Butler server for render workers on this or other machines"),
+    ])
+    render_workers: IntProperty(name="Workers", description="Number of background Blender processes (in Work Queue mode, the number of chunks to split into)", default=max(1, (os.cpu_count() or 1) // 8), min=1)
+    render_chunk_size: IntProperty(name="Chunk Size", description="Frames per chunk (0 splits the range evenly across all workers)", default=0, min=0)
+    render_retries: IntProperty(name="Retries", description="How often a failed chunk is rendered again", default=2, min=0)
+
     bake_modifier: StringProperty(name="Modifier", update=on_modifier_update)
     bake_paint_surface: StringProperty(name="Surface")
     rebake: BoolProperty(name="Rebake", description="Bake this modifier even if it's already cached")
     bake_fluid_mesh: BoolProperty(name="Bake Fluid Mesh", description="Bake fluid mesh", default=True)
+    bake_mode: EnumProperty(name="Bake Mode", items=[
+        (ButlerBakeMode.LOCAL, "Local", "Bake inside this Blender session"),
+        (ButlerBakeMode.BACKGROUND, "Background", "Bake in a background Blender process, independent bakes can run in parallel"),
+    ])
+
+    dependency_mode: EnumProperty(name="Run After", items=[
+        (ButlerDependency.AUTO, "Auto", "Wait for the actions this one needs (renders wait for bakes, operators for everything before them)"),
+        (ButlerDependency.PREVIOUS, "Previous Action", "Wait for the previous action to finish"),
+        (ButlerDependency.CUSTOM, "Custom", "Wait for the listed actions"),
+    ])
+    depends_on: StringProperty(name="Actions", description="Comma separated numbers of the actions to wait for, e.g. \"1, 3\"")
 
     def draw(self, layout: UILayout, ctx: Context):
         flow = settings(ctx).get_active_flow()
@@ -201,6 +374,7 @@ class ButlerAction(PropertyGroup):
         col.enabled = self.enabled
 
         top = col.row()
+        top.label(text=f"{action_index + 1}.")
         top.prop(self, "action_type", text="")
         top.operator(ButlerRemoveAction.bl_idname, text="", icon="X").index = action_index
 
@@ -214,9 +388,19 @@ class ButlerAction(PropertyGroup):
             col.prop(self, "render_range")
 
             if self.render_range == ButlerRenderRange.CUSTOM:
-                col = col.column(align=True)
-                col.prop(self, "frame_start")
-                col.prop(self, "frame_end")
+                frames = col.column(align=True)
+                frames.prop(self, "frame_start")
+                frames.prop(self, "frame_end")
+
+            col.prop(self, "rerender")
+            if not ctx.scene.render.is_movie_format:
+                col.prop(self, "reuse_static_frames")
+            col.prop(self, "render_mode")
+            if self.render_mode in (ButlerRenderMode.PARALLEL, ButlerRenderMode.QUEUE):
+                pool = col.column(align=True)
+                pool.prop(self, "render_workers")
+                pool.prop(self, "render_chunk_size")
+                pool.prop(self, "render_retries")
         elif self.action_type == ButlerActionType.BAKE:
             targets = col.column(align=True)
             targets.prop_search(self, "target", ctx.scene, "objects", text="")
@@ -241,6 +425,22 @@ class ButlerAction(PropertyGroup):
             if self.can_bake_fluid_mesh(ctx):
                 checks.prop(self, "bake_fluid_mesh")
 
+            col.prop(self, "bake_mode")
+            if self.bake_mode == ButlerBakeMode.BACKGROUND and mod is not None and not self.can_bake_in_background(ctx):
+                col.label(text="Needs a saved file and a disk cache", icon="ERROR")
+
+            coverage = self.cache_coverage(ctx)
+            if coverage is not None:
+                col.label(text=str(coverage), icon="CHECKMARK" if coverage.complete else "DISK_DRIVE")
+            if self.bake_fluid_mesh and self.can_bake_fluid_mesh(ctx):
+                mesh_coverage = cache_scan.fluid_coverage(mod.domain_settings, "mesh")
+                col.label(text="Mesh: " + str(mesh_coverage), icon="CHECKMARK" if mesh_coverage.complete else "DISK_DRIVE")
+
+        if action_index > 0 and flow.concurrency > 1:
+            col.prop(self, "dependency_mode")
+            if self.dependency_mode == ButlerDependency.CUSTOM:
+                col.prop(self, "depends_on")
+
         r = row.column(align=True)
 
         def move_button(icon, mod):
@@ -258,6 +458,11 @@ class ButlerAction(PropertyGroup):
                ("OFF" if self.enabled else "ON"))
         move_button("TRIA_DOWN", 1)
     
+    def ensure_uid(self):
+        if not self.uid:
+            self.uid = uuid.uuid4().hex
+        return self.uid
+
     def obj_ref(self, ctx: Context):
         return ctx.scene.objects.get(self.target, None)
     
@@ -275,13 +480,194 @@ class ButlerAction(PropertyGroup):
             return dom.domain_type == "LIQUID" and dom.use_mesh and dom.cache_type == "MODULAR" and dom.cache_resumable
         return False
     
+    def can_bake_in_background(self, ctx: Context):
+        '''Whether the baked cache can be handed over from a background process.'''
+        mod = self.mod_ref(ctx)
+        if mod is None:
+            return False
+        if mod.type == "FLUID":
+            return True
+
+        if mod.type == "DYNAMIC_PAINT":
+            surface = mod.canvas_settings.canvas_surfaces.get(self.bake_paint_surface) if mod.canvas_settings else None
+            if surface is None:
+                return False
+            if surface.surface_format == "IMAGE":
+                return True
+            cache = surface.point_cache
+        else:
+            cache = mod.point_cache
+
+        # memory caches can't leave the process, external caches can't be baked
+        return bool(bpy.data.filepath) and cache.use_disk_cache and not cache.use_external
+
+    def bakes_in_background(self, ctx: Context):
+        return self.bake_mode == ButlerBakeMode.BACKGROUND and self.can_bake_in_background(ctx)
+
+    def cache_coverage(self, ctx: Context):
+        '''Which frames of the targeted cache are on disk, None if that can't be told.'''
+        obj = self.obj_ref(ctx)
+        mod = self.mod_ref(ctx)
+        if mod is None:
+            return None
+
+        if mod.type == "FLUID":
+            if mod.fluid_type != "DOMAIN":
+                return None
+            return cache_scan.fluid_coverage(mod.domain_settings)
+
+        if mod.type == "DYNAMIC_PAINT":
+            surface = mod.canvas_settings.canvas_surfaces.get(self.bake_paint_surface) if mod.canvas_settings else None
+            if surface is None or surface.surface_format == "IMAGE":
+                return None
+            cache = surface.point_cache
+        else:
+            cache = getattr(mod, "point_cache", None)
+            if cache is None:
+                return None
+
+        return cache_scan.point_cache_coverage(obj, cache)
+
     def can_bake_paint(self, ctx: Context):
         mod = self.mod_ref(ctx)
         if mod is not None and mod.type == "DYNAMIC_PAINT" and mod.canvas_settings:
             return True
         return False
 
-    def run(self, ctx: Context, callback):
+    def parse_dependencies(self, index: int):
+        '''Returns the indices of the earlier actions listed in `depends_on`.'''
+        deps = set()
+        for part in self.depends_on.split(","):
+            part = part.strip()
+            if not part:
+                continue
+            try:
+                number = int(part)
+            except ValueError:
+                print(f"Ignoring invalid action number {part}")
+                continue
+            if 1 <= number <= index:
+                deps.add(number - 1)
+            else:
+                print(f"Action {index + 1} can only wait for earlier actions, ignoring {number}")
+        return deps
+
+    def frame_count(self, ctx: Context):
+        '''Number of frames this action renders or bakes.'''
+        if self.action_type == ButlerActionType.RENDER:
+            s = ctx.scene
+            return self.get_frame_range(True, s) - self.get_frame_range(False, s) + 1
+
+        if self.action_type == ButlerActionType.BAKE:
+            mod = self.mod_ref(ctx)
+            if mod is None:
+                return 0
+            if mod.type == "FLUID":
+                dom = mod.domain_settings
+                return dom.cache_frame_end - dom.cache_frame_start + 1
+            if mod.type == "DYNAMIC_PAINT":
+                surface = mod.canvas_settings.canvas_surfaces.get(self.bake_paint_surface) if mod.canvas_settings else None
+                return surface.frame_end - surface.frame_start + 1 if surface else 0
+            return mod.point_cache.frame_end - mod.point_cache.frame_start + 1
+
+        return 0
+
+    def pending_frames(self, ctx: Context):
+        '''Number of frames this action still has to render or bake, 1 for operators.'''
+        if self.action_type == ButlerActionType.RENDER:
+            scene = ctx.scene
+            if self.rerender or scene.render.is_movie_format:
+                return self.frame_count(ctx)
+            start = self.get_frame_range(False, scene)
+            end = self.get_frame_range(True, scene)
+            return sum(e - s + 1 for s, e in manifest.RenderManifest(scene, start, end).missing_ranges())
+
+        if self.action_type == ButlerActionType.BAKE:
+            coverage = None if self.rebake else self.cache_coverage(ctx)
+            if coverage is not None:
+                return coverage.total - coverage.count
+            return self.frame_count(ctx)
+
+        return 1
+
+    def incomplete(self, ctx: Context):
+        '''Number of frames still missing after the action ran, 0 if its output can't be checked.'''
+        if not self.enabled:
+            return 0
+        if self.action_type == ButlerActionType.RENDER:
+            scene = ctx.scene
+            if scene.render.is_movie_format:
+                return 0
+            start = self.get_frame_range(False, scene)
+            end = self.get_frame_range(True, scene)
+            return sum(e - s + 1 for s, e in manifest.RenderManifest(scene, start, end).missing_ranges())
+        if self.action_type == ButlerActionType.BAKE:
+            coverage = self.cache_coverage(ctx)
+            return 0 if coverage is None else coverage.total - coverage.count
+        return 0
+
+    def history_kind(self, ctx: Context):
+        '''What kind of work this is, runs of the same kind take about as long per frame.'''
+        if self.action_type == ButlerActionType.RENDER:
+            return f"RENDER:{ctx.scene.render.engine}:{self.render_mode}"
+        if self.action_type == ButlerActionType.BAKE:
+            mod = self.mod_ref(ctx)
+            mode = ButlerBakeMode.BACKGROUND if self.bakes_in_background(ctx) else ButlerBakeMode.LOCAL
+            return f"BAKE:{mod.type if mod is not None else None}:{mode}"
+        return self.action_type
+
+    def workload(self, ctx: Context):
+        '''Returns (frames, work per frame, parameters) to record and predict durations with.'''
+        frames = self.pending_frames(ctx)
+
+        if self.action_type == ButlerActionType.RENDER:
+            r = ctx.scene.render
+            megapixels = r.resolution_x * r.resolution_y * (r.resolution_percentage / 100) ** 2 / 1e6
+            if r.engine == "CYCLES":
+                samples = ctx.scene.cycles.samples
+            elif hasattr(ctx.scene, "eevee"):
+                samples = ctx.scene.eevee.taa_render_samples
+            else:
+                samples = 1
+            params = {"resolution": [r.resolution_x, r.resolution_y, r.resolution_percentage], "samples": samples}
+            if self.render_mode != ButlerRenderMode.LOCAL:
+                params["mode"] = self.render_mode
+                params["workers"] = self.render_workers
+            return frames, max(megapixels * samples, 0.001), params
+
+        if self.action_type == ButlerActionType.BAKE:
+            mod = self.mod_ref(ctx)
+            params = {}
+            if mod is not None and mod.type == "FLUID" and mod.fluid_type == "DOMAIN":
+                dom = mod.domain_settings
+                params = {"resolution": dom.resolution_max, "mesh": self.bake_fluid_mesh}
+            return frames, 1.0, params
+
+        return frames, 1.0, {}
+
+    def estimate_cost(self, ctx: Context) -> float:
+        '''Expected duration in seconds, based on earlier runs.'''
+        if not self.enabled:
+            return 0
+        frames, scale, params = self.workload(ctx)
+        if not frames:
+            return 0.01
+        return get_history().predict(self.ensure_uid(), self.history_kind(ctx), frames, scale, params)
+
+    def resource(self, ctx: Context):
+        '''Actions using the same resource can't run at the same time.
+        Renders and bakes inside this session all step through the scene's frames.'''
+        if not self.enabled or self.action_type in (ButlerActionType.OBJECT_OPERATOR, ButlerActionType.PYTHON_OPERATOR):
+            return None
+        if self.action_type == ButlerActionType.RENDER and self.render_mode != ButlerRenderMode.LOCAL \
+                and not ctx.scene.render.is_movie_format:
+            return None
+        if self.action_type == ButlerActionType.BAKE and self.bakes_in_background(ctx):
+            return None
+        return "session"
+
+    def run(self, ctx: Context, callback, abort: FlowAbort = None):
+        '''Calls `callback` once the action is done, or `abort` with a reason if the user cancelled it.'''
         if not self.enabled:
             return callback()
         print("Running " + self.action_type)
@@ -293,9 +679,9 @@ class ButlerAction(PropertyGroup):
             self.run_python_operator()
             callback()
         elif self.action_type == ButlerActionType.RENDER:
-            self.run_render(ctx, callback)
+            self.run_render(ctx, callback, abort)
         elif self.action_type == ButlerActionType.BAKE:
-            self.run_bake(ctx, callback)
+            self.run_bake(ctx, callback, abort)
 
     def run_object_operator(self, ctx: Context):
         if self.target == None:
@@ -315,18 +701,90 @@ class ButlerAction(PropertyGroup):
         elif self.render_range == ButlerRenderRange.CUSTOM:
             return self.frame_end if end else self.frame_start
 
-    def run_render(self, c: Context, callback):
+    def run_render(self, c: Context, callback, abort=None):
+        scene = c.scene
+        start = self.get_frame_range(False, scene)
+        end = self.get_frame_range(True, scene)
+
+        if scene.render.is_movie_format:
+            if self.render_mode != ButlerRenderMode.LOCAL:
+                print("Movie files can't be rendered in chunks, rendering locally instead")
+            return self.run_render_local(c, [(start, end)], callback, abort)
+
+        frames = manifest.RenderManifest(scene, start, end)
+        ranges = [(start, end)] if self.rerender else frames.missing_ranges()
+
+        if not ranges:
+            print("Skipped because every frame has already been rendered.")
+            return callback()
+
+        copies = self.find_static_frames(c, ranges) if self.reuse_static_frames else {}
+        if copies:
+            pending = [f for s, e in ranges for f in range(s, e + 1) if f not in copies]
+            ranges = manifest.to_ranges(pending)
+
+        print("Rendering frames " + ", ".join(f"{s} - {e}" for s, e in ranges))
+        static_frames.unlink_shared(scene, [f for s, e in ranges for f in range(s, e + 1)])
+        frames.begin()
+
+        def post_render():
+            if copies:
+                print(f"Linked {static_frames.fill(scene, copies)} static frames")
+            frames.record()
+            callback()
+
+        if self.render_mode == ButlerRenderMode.QUEUE:
+            return self.run_render_queue(c, ranges, post_render, abort)
+        if self.render_mode == ButlerRenderMode.PARALLEL:
+            return self.run_render_parallel(c, ranges, post_render, abort)
+        return self.run_render_local(c, ranges, post_render, abort)
+
+    def find_static_frames(self, ctx: Context, ranges):
+        '''Returns {frame: frame whose output it can reuse} for the frames that look like the one before.'''
+        reason = static_frames.unsupported(ctx.scene)
+        if reason is not None:
+            print(f"Not looking for static frames, {reason}")
+            return {}
+
+        started = time.monotonic()
+        copies = static_frames.find_copies(ctx, [f for s, e in ranges for f in range(s, e + 1)])
+        print(f"Found {len(copies)} static frames in {time.monotonic() - started:.1f}s")
+        return copies
+
+    def frame_reporter(self, scene: Scene, ranges):
+        '''Returns frame stats for rendering `ranges` and a function posting them to the daemon.'''
+        stats = render_stats.FrameStats(sum(e - s + 1 for s, e in ranges))
+        task = f"{BUTLER_TASK}-render-{self.ensure_uid()}"
+        update_butler_task(title=f"Render: {scene.name}", description=stats.summary(), progress=0, task=task)
+
+        def report(stats: render_stats.FrameStats):
+            if not daemon_enabled:
+                # would only print a warning on every frame
+                return
+            update_butler_task(description=stats.summary(), progress=stats.progress(), task=task)
+
+        return stats, report
+
+    def run_render_local(self, c: Context, ranges, callback, abort=None):
+        '''Renders each of the frame ranges inside this Blender session, one after another.'''
         ctx = c.copy()
         scene = ctx["scene"]
         a_start = scene.frame_start
         a_end = scene.frame_end
 
-        scene.frame_start = self.get_frame_range(False, scene)
-        scene.frame_end = self.get_frame_range(True, scene)
-
-        bpy.ops.render.render("INVOKE_DEFAULT", animation=True, use_viewport=True)
-
-        filepath = scene.render.frame_path(frame=scene.frame_end)
+        monitor = render_stats.RenderMonitor(*self.frame_reporter(scene, ranges))
+        monitor.start()
+
+        if bpy.app.background:
+            # no render window to wait for, rendering blocks until the frames are written
+            try:
+                for scene.frame_start, scene.frame_end in ranges:
+                    bpy.ops.render.render(animation=True, scene=scene.name)
+            finally:
+                monitor.stop()
+                scene.frame_start = a_start
+                scene.frame_end = a_end
+            return callback()
 
         def find_render_window():
             for win in ctx["window_manager"].windows:
@@ -334,22 +792,110 @@ class ButlerAction(PropertyGroup):
                     return win
             return None
 
+        def render_next(index):
+            if index >= len(ranges):
+                monitor.stop()
+                scene.frame_start = self.get_frame_range(False, scene)
+                scene.frame_end = self.get_frame_range(True, scene)
+                bpy.ops.render.play_rendered_anim()
+
+                scene.frame_start = a_start
+                scene.frame_end = a_end
+                return callback()
+
+            scene.frame_start, scene.frame_end = ranges[index]
+
+            bpy.ops.render.render("INVOKE_DEFAULT", animation=True, use_viewport=True)
+
+            filepath = scene.render.frame_path(frame=scene.frame_end)
+
+            def post_render():
+                print("yay")
+                cancelled.cancel()
+                rwin = find_render_window()
+                if rwin is not None:
+                    with bpy.context.temp_override(window=rwin, area=rwin.screen.areas[0]):
+                        bpy.ops.render.view_cancel()
+                render_next(index + 1)
+
+            def on_cancel():
+                # the frames so far are incomplete, so neither recorded nor followed by the rest of the flow
+                finished.cancel()
+                monitor.stop()
+                scene.frame_start = a_start
+                scene.frame_end = a_end
+                if abort is not None:
+                    abort("the render was cancelled")
+
+            finished = completion.wait_for_file(filepath, post_render, events=completion.RENDER_EVENTS)
+            cancelled = completion.wait(on_cancel, events=completion.CANCEL_EVENTS)
+
+        render_next(0)
+
+    def run_render_parallel(self, ctx: Context, ranges, callback, abort: FlowAbort = None):
+        '''Renders the frame ranges in chunks on a pool of background Blender processes.'''
+        chunks = workers.split_ranges(ranges, self.render_workers, self.render_chunk_size)
+        pool = workers.RenderPool(ctx.scene, chunks, workers=self.render_workers, retries=self.render_retries)
+        stats, report = self.frame_reporter(ctx.scene, ranges)
+
+        def on_frame(frame, seconds):
+            if seconds is None:
+                stats.skip()
+            else:
+                stats.add(frame, seconds)
+            report(stats)
+
+        pool.on_frame = on_frame
+        pool.start()
+
         def post_render():
-            print("yay")
-            rwin = find_render_window()
-            if rwin is not None:
-                ctx["window"] = rwin
-                ctx["area"] = rwin.screen.areas[0]
-                bpy.ops.render.view_cancel(ctx)
-            bpy.ops.render.play_rendered_anim()
-
-            scene.frame_start = a_start
-            scene.frame_end = a_end
+            if pool.failed:
+                print("Failed to render frames " + ", ".join(str(c) for c in pool.failed))
             callback()
 
-        await_file_write(filepath, post_render)
+        waiter = completion.wait(post_render, pool.poll)
+        pool.notify = waiter.notify
+
+        def stop():
+            if not waiter.finished:
+                waiter.cancel()
+                pool.cancel()
+
+        if abort is not None:
+            abort.on_abort(stop)
+
+    def run_render_queue(self, ctx: Context, ranges, callback, abort: FlowAbort = None):
+        '''Queues the frame ranges in chunks on the Butler server and waits for render workers to finish them.
+        The server shows the progress as the same task a render in this session would.'''
+        if daemon_port is None:
+            print("The Butler server isn't running, rendering in background processes instead")
+            return self.run_render_parallel(ctx, ranges, callback, abort)
+
+        chunks = workers.split_ranges(ranges, self.render_workers, self.render_chunk_size)
+        render = workers.QueuedRender(ctx.scene, chunks, f"http://localhost:{daemon_port}",
+                                      title=f"Render: {ctx.scene.name}", task=f"{BUTLER_TASK}-render-{self.ensure_uid()}",
+                                      retries=self.render_retries)
+        if not render.start():
+            print("Rendering in background processes instead")
+            return self.run_render_parallel(ctx, ranges, callback, abort)
+
+        def post_render():
+            if render.failed:
+                print("Failed to render frames " + ", ".join(render.failed))
+            callback()
+
+        waiter = completion.wait(post_render, render.poll, interval=5.0)
+        render.notify = waiter.notify
+
+        def stop():
+            if not waiter.finished:
+                waiter.cancel()
+                render.cancel()
 
-    def run_bake(self, ctx: Context, callback):
+        if abort is not None:
+            abort.on_abort(stop)
+
+    def run_bake(self, ctx: Context, callback, abort: FlowAbort = None):
         '''Bakes the selected physics modifier.'''
         try:
             obj = ctx.scene.objects[self.target]
@@ -357,106 +903,193 @@ class ButlerAction(PropertyGroup):
         except:
             return callback()
         
-        override = bpy.context.copy()
-        override['active_object'] = obj
-        override['object'] = obj
+        # context members the bake operators need, see temp_override
+        override = {"active_object": obj, "object": obj}
+
+        background = self.bakes_in_background(ctx)
+        surface = None
         
         if mod.type == "FLUID":
-            return self.run_bake_fluid(mod, override, ctx, callback)
+            return self.run_bake_fluid(mod, override, ctx, callback, background, abort)
         elif mod.type == "DYNAMIC_PAINT":
             surface = mod.canvas_settings.canvas_surfaces[self.bake_paint_surface]
             if surface.surface_format == "IMAGE":
-                return self.run_bake_dynamic_paint(surface, override, callback)
+                return self.run_bake_dynamic_paint(surface, override, callback, background, abort)
             else:
                 cache = surface.point_cache
         else:
             cache = mod.point_cache
 
-        if self.rebake or not cache.is_baked:
-            override['point_cache'] = cache
-            bpy.ops.ptcache.free_bake(override)
-            bpy.ops.ptcache.bake(override, "INVOKE_DEFAULT", bake=True)
+        override['point_cache'] = cache
+        coverage = cache_scan.point_cache_coverage(obj, cache)
 
-            await_interval(lambda: cache.is_baked, callback)
-        else:
-            callback()
+        if not self.rebake:
+            if coverage is None:
+                if cache.is_baked:
+                    return callback()
+            elif coverage.complete:
+                if not cache.is_baked:
+                    # baked by another process, only needs to be marked as baked
+                    with bpy.context.temp_override(**override):
+                        bpy.ops.ptcache.bake_from_cache()
+                return callback()
+
+        # a cache with frames up to some point continues from there, one with holes starts over
+        resume = not self.rebake and coverage is not None and coverage.resumable
+        if resume:
+            print(f"Resuming bake from frame {coverage.last_contiguous + 1}")
+
+        if background:
+            return self.run_bake_background(bake.BakeProcess(obj, mod, surface, free=not resume), override, callback, abort)
+
+        with bpy.context.temp_override(**override):
+            if not resume:
+                bpy.ops.ptcache.free_bake()
+            bpy.ops.ptcache.bake(operator_context(), bake=True)
+
+        completion.wait(callback, lambda: cache.is_baked, paths=[cache_scan.point_cache_dir(cache)])
     
-    def run_bake_fluid(self, mod: FluidModifier, override, ctx, callback):
+    def run_bake_fluid(self, mod: FluidModifier, override, ctx, callback, background=False, abort: FlowAbort = None):
         '''Bakes a fluid domain.'''
         do_mesh = self.bake_fluid_mesh and self.can_bake_fluid_mesh(ctx)
         dom = mod.domain_settings
+        cache_dir = bpy.path.abspath(dom.cache_directory)
+
+        # judged by the files on disk, the pause frames are stale after a bake in another process
+        data_coverage = cache_scan.fluid_coverage(dom, "data")
+        data_done = not self.rebake and data_coverage.complete
+        mesh_done = not self.rebake and cache_scan.fluid_coverage(dom, "mesh").complete
+        # resumable caches continue after the last baked frame, anything with holes starts over
+        free = self.rebake or not (data_done or data_coverage.empty or (dom.cache_resumable and data_coverage.resumable))
+        if not data_done and not free and not data_coverage.empty:
+            print(f"Resuming fluid bake from frame {data_coverage.last_contiguous + 1}")
+
+        if background:
+            process = bake.BakeProcess(override['object'], mod, free=free, data=not data_done,
+                                       mesh=do_mesh and not (data_done and mesh_done))
+            return self.run_bake_background(process, override, callback, abort)
 
         def on_data_baked():
             print("data baked")
-            if do_mesh:
+            if do_mesh and not (data_done and mesh_done):
                 print("baking mesh")
-                bpy.ops.fluid.bake_mesh(override, "INVOKE_DEFAULT")
-                await_interval(lambda: dom.cache_frame_pause_mesh >= dom.cache_frame_end, callback)
+                with bpy.context.temp_override(**override):
+                    bpy.ops.fluid.bake_mesh(operator_context())
+                completion.wait(callback, lambda: dom.cache_frame_pause_mesh >= dom.cache_frame_end,
+                                paths=[os.path.join(cache_dir, "mesh", "")])
             else:
                 callback()
 
         def on_data_freed():
             print("now free")
-            bpy.ops.fluid.bake_data(override, "INVOKE_DEFAULT")
-            await_interval(lambda: dom.cache_frame_pause_data >= dom.cache_frame_end, on_data_baked)
+            with bpy.context.temp_override(**override):
+                bpy.ops.fluid.bake_data(operator_context())
+            completion.wait(on_data_baked, lambda: dom.cache_frame_pause_data >= dom.cache_frame_end,
+                            paths=[os.path.join(cache_dir, "data", "")])
 
-        if self.rebake:
+        if free:
             print("freeing")
-            bpy.ops.fluid.free_all(override, "INVOKE_DEFAULT")
-            return await_interval(lambda: dom.cache_frame_pause_data <= dom.cache_frame_start, on_data_freed, interval=0.2)
+            with bpy.context.temp_override(**override):
+                bpy.ops.fluid.free_all(operator_context())
+            return completion.wait(on_data_freed, lambda: dom.cache_frame_pause_data <= dom.cache_frame_start,
+                                   paths=[cache_dir], interval=0.2)
         else:
-            if dom.cache_frame_pause_data >= dom.cache_frame_end:
+            if data_done:
                 return on_data_baked()
             return on_data_freed()
     
-    def run_bake_dynamic_paint(self, surface: DynamicPaintSurface, override, callback):
+    def run_bake_dynamic_paint(self, surface: DynamicPaintSurface, override, callback, background=False,
+                               abort: FlowAbort = None):
         '''Bakes a dynamic paint surface in "Image Sequence" mode.'''
-        names = list()
-        if surface.use_output_a: names.append(surface.output_name_a)
-        if surface.use_output_b: names.append(surface.output_name_b)
-
-        if not len(names):
+        sequence = image_sequence.from_surface(surface, bpy.path.abspath)
+        if not sequence.names:
             print("Skipped because no outputs could have been generated.")
             return callback()
-        
-        format = surface.image_fileformat
-
-        def lastframepath(name):
-            lastframe = name + str(surface.frame_end).rjust(4, "0")
-            lastframe = bpy.path.ensure_ext(lastframe, ".png" if format == "PNG" else ".exr")
-            return os.path.join(bpy.path.abspath(surface.image_output_path), lastframe)
-        
-        paths = [lastframepath(name) for name in names]
 
-        if not self.rebake:
-            if any([os.path.exists(path) for path in paths]):
-                print("Skipped because output image sequence already exists.")
+        if self.rebake:
+            last = surface.frame_end
+        else:
+            invalid = sequence.invalid_ranges()
+            if not invalid:
+                print("Skipped because output image sequence is complete.")
                 return callback()
-        
-        filepath = paths[-1]
+            # painting accumulates over time, so the bake can't start later than the
+            # surface does, but it can stop after the last broken frame
+            last = invalid[-1][1]
+            print("Rebaking because of missing or broken frames " + ", ".join(f"{a}-{b}" for a, b in invalid))
+
+        if background:
+            obj = override['object']
+            process = bake.BakeProcess(obj, obj.modifiers[self.bake_modifier], surface, free=self.rebake, frame_end=last)
+            return self.run_bake_background(process, override, callback, abort)
+
+        frame_end = surface.frame_end
+        surface.frame_end = last
+
+        def post_bake():
+            surface.frame_end = frame_end
+            invalid = sequence.invalid_ranges()
+            if invalid:
+                print("Dynamic paint bake left broken frames " + ", ".join(f"{a}-{b}" for a, b in invalid))
+            callback()
+
+        filepath = sequence.frame_path(sequence.names[-1], last)
         print("Waiting for ", filepath)
 
-        bpy.ops.dpaint.bake(override, "INVOKE_DEFAULT")
-        return await_file_write(filepath, callback)
+        with bpy.context.temp_override(**override):
+            bpy.ops.dpaint.bake(operator_context())
+        return completion.wait_for_file(filepath, post_bake)
 
-BUTLER_URL = "http://localhost:2048/update/blender-butler"
+    def run_bake_background(self, process: bake.BakeProcess, override, callback, abort: FlowAbort = None):
+        '''Bakes in a background Blender process and continues once it has exited.'''
+        process.start()
 
-def update_butler_task(title=None, description=None, progress=None):
-    if daemon:
-        params = {}
-        if title is not None: params["title"] = title
-        if description is not None: params["description"] = description
-        if progress is not None: params["progress"] = progress
+        def post_bake():
+            process.finish(override)
+            callback()
 
-        return requests.get(BUTLER_URL, params=params)
+        waiter = completion.wait(post_bake, process.poll)
+        process.notify = waiter.notify
+
+        def stop():
+            if not waiter.finished:
+                # the half written cache stays as it is, the next run resumes or frees it
+                waiter.cancel()
+                process.cancel()
+
+        if abort is not None:
+            abort.on_abort(stop)
+
+def format_duration(seconds: float):
+    min = math.floor(seconds / 60)
+    sec = math.floor(seconds % 60)
+    time = f"{sec} seconds"
+
+    if min > 0:
+        time = f"{min} minutes, {time}"
+    return time
+
+BUTLER_URL = "http://localhost:2048/update"
+BUTLER_TASK = "blender-butler"
+
+def update_butler_task(title=None, description=None, progress=None, task=BUTLER_TASK):
+    if daemon_enabled and telemetry_client is not None:
+        # only queues the update, it's sent from a background thread
+        telemetry_client.update(task, title=title, description=description, progress=progress)
+        return
+    if bpy.app.background:
+        # on a render node, the log is where progress shows up
+        if title or description:
+            print(" - ".join(text for text in (title, description) if text))
+        return
     print("Daemon disabled, task update not sent")
-    return None
 
 @registered
 class ButlerFlow(PropertyGroup):
     bl_idname = "butler.flow"
     name: StringProperty(default="Flow")
     actions: CollectionProperty(type=ButlerAction)
+    concurrency: IntProperty(name="Concurrent Actions", description="How many independent actions may run at the same time", default=1, min=1)
 
     def draw(self, layout: UILayout, ctx: Context):
         if not self.actions:
@@ -464,13 +1097,18 @@ class ButlerFlow(PropertyGroup):
             row.alignment = "CENTER"
             row.label(text="No actions added.")
 
+        layout.prop(self, "concurrency")
+
         for action in self.actions:
             action.draw(layout, ctx)
 
         layout.operator(ButlerAddAction.bl_idname)
 
-    def run(self, ctx: Context):
+    def run(self, ctx: Context, on_done: Callable[[], Any] = None):
+        '''Runs the actions, calls `on_done` once every one of them has finished.'''
         if len(self.actions) == 0:
+            if on_done is not None:
+                on_done()
             return
         
         update_butler_task(title=f"Blender: {self.name}", progress=0)
@@ -481,37 +1119,105 @@ class ButlerFlow(PropertyGroup):
             end_time = datetime.datetime.now().timestamp()
             seconds = end_time - start_time
 
-            seconds_for_mail = 5 * 60
+            content = f"All actions of your selected Butler flow have finished in {format_duration(seconds)}!"
+            update_butler_task(description=content, progress=1)
 
-            if True or seconds > seconds_for_mail:
-                min = math.floor(seconds / 60)
-                sec = math.floor(seconds % 60)
-                time = f"{sec} seconds"
+            if seconds > MAIL_AFTER and get_notifier() is not None:
+                # only queued, the mail goes out from a background thread
+                notifier.notify(f"{self.name} finished", content)
 
-                if min > 0:
-                    time = f"{min} minutes, {time}"
+            running_flows.discard(abort)
+            if on_done is not None:
+                on_done()
 
-                content = f"All actions of your selected Butler flow have finished in {time}!"
-                update_butler_task(description=content, progress=1)
-                # mail.send_email("Tasks done!", content)
+        store = get_history()
 
-        self.run_recursive(ctx, 0, callback)
-    
-    def post_update(self, index):
-        count = len(self.actions)
-        update_butler_task(description=f"Task {index + 1}/{count}", progress=index/count)
+        def run_action(done, action: ButlerAction):
+            if not action.enabled:
+                return action.run(ctx, done)
 
-    def run_recursive(self, ctx, index, done: Callable[[], Any]):
-        if index >= len(self.actions):
-            print("Done!")
-            return done()
-        
-        self.post_update(index)
+            kind = action.history_kind(ctx)
+            frames, scale, params = action.workload(ctx)
+            started = time.monotonic()
 
-        def callback():
-            self.run_recursive(ctx, index + 1, done)
+            def finished():
+                # actions that had nothing left to do say nothing about their duration
+                if frames:
+                    store.record(action.uid, kind, time.monotonic() - started, frames, scale, params)
+                done()
+
+            action.run(ctx, finished, abort)
+
+        jobs = [
+            scheduler.Job(i, lambda done, action=action: run_action(done, action), deps,
+                          cost=action.estimate_cost(ctx), resource=action.resource(ctx))
+            for i, (action, deps) in enumerate(zip(self.actions, self.dependencies()))
+        ]
+        s = scheduler.Scheduler(jobs, limit=self.concurrency, on_progress=self.post_update, done=callback)
+
+        def stop(reason: str):
+            print(f"Stopped {self.name}, {reason}")
+            update_butler_task(description=f"Stopped, {reason}")
+            s.abort()
+
+        abort = FlowAbort(stop)
+        running_flows.add(abort)
+
+        def report():
+            if s.complete or s.aborted:
+                return None
+            self.post_update(s)
+            return PROGRESS_INTERVAL
+
+        s.start()
+        if not s.complete and not s.aborted and not bpy.app.background:
+            bpy.app.timers.register(report, first_interval=PROGRESS_INTERVAL)
+
+    def dependencies(self):
+        '''Returns the indices of the actions each action has to wait for.'''
+        deps = []
+        barrier = None
+        since_barrier = []
+        bakes = []
+
+        for i, action in enumerate(self.actions):
+            mode = action.dependency_mode if self.concurrency > 1 else ButlerDependency.PREVIOUS
+            before = {barrier} if barrier is not None else set()
+
+            if i == 0:
+                d = set()
+            elif mode == ButlerDependency.PREVIOUS:
+                d = {i - 1}
+            elif mode == ButlerDependency.CUSTOM:
+                d = action.parse_dependencies(i)
+            elif action.action_type in (ButlerActionType.OBJECT_OPERATOR, ButlerActionType.PYTHON_OPERATOR):
+                # operators can change anything, so they wait for everything before them
+                d = before | set(since_barrier)
+            elif action.action_type == ButlerActionType.RENDER:
+                d = before | set(bakes)
+            else:
+                d = before | {j for j in bakes if self.actions[j].target == action.target}
+            deps.append(d)
+
+            if action.action_type in (ButlerActionType.OBJECT_OPERATOR, ButlerActionType.PYTHON_OPERATOR):
+                barrier = i
+                since_barrier = []
+                bakes = []
+            else:
+                since_barrier.append(i)
+                if action.action_type == ButlerActionType.BAKE:
+                    bakes.append(i)
+
+        return deps
 
-        self.actions[index].run(ctx, callback)
+    def post_update(self, s: scheduler.Scheduler):
+        count = len(self.actions)
+        description = f"Task {s.finished}/{count}"
+        if len(s.running) > 1:
+            description += f" ({len(s.running)} running)"
+        if s.running:
+            description += f", about {format_duration(s.remaining())} left"
+        update_butler_task(description=description, progress=s.progress())
 
 
 @registered
@@ -602,6 +1308,7 @@ class ResetButler(bpy.types.Operator):
 
     def execute(self, ctx: bpy.types.Context):
         settings(ctx).reset()
+        update_bake_objects(ctx.scene)
         return {'FINISHED'}
 
 @registered
@@ -626,6 +1333,8 @@ class ButlerRemoveFlow(bpy.types.Operator):
 
     def execute(self, ctx: Context):
         butler = settings(ctx)
+        for action in butler.flows[self.index].actions:
+            unindex_action(action)
         if len(butler.flows) > 1:
             butler.active_flow -= 1
         butler.flows.remove(self.index)
@@ -649,7 +1358,9 @@ class ButlerRemoveAction(bpy.types.Operator):
     index: IntProperty()
 
     def execute(self, ctx: Context):
-        settings(ctx).get_active_flow().actions.remove(self.index)
+        actions = settings(ctx).get_active_flow().actions
+        unindex_action(actions[self.index])
+        actions.remove(self.index)
         return {'FINISHED'}
 
 
@@ -676,28 +1387,150 @@ def settings(context: Context) -> ButlerSettings:
     return context.scene.butler
 
 
-def on_depsgraph_update(scene: Scene):
+def on_depsgraph_update(scene: Scene, depsgraph=None):
     global initialized_bake_objects
     if not initialized_bake_objects:
         update_bake_objects(scene)
         initialized_bake_objects = True
-    
-    for id in bake_objects:
-        update_bakeables(scene.objects[id])
+
+    if depsgraph is None:
+        updated = set(target_index.bake_objects)
+    else:
+        # only look at tracked objects this update actually touched
+        updated = set()
+        for update in depsgraph.updates:
+            if isinstance(update.id, Object):
+                obj = update.id.original
+                name = obj.name
+                if name not in target_index.by_name:
+                    old = target_index.renamed_from(obj.as_pointer(), name)
+                    if old is not None and scene.objects.get(old) is None:
+                        rename_target(scene, old, name)
+                if name in target_index.bake_objects:
+                    updated.add(name)
+
+        if depsgraph.id_type_updated("SCENE") or depsgraph.id_type_updated("COLLECTION"):
+            forget_missing_targets(scene)
+
+    for id in updated:
+        obj = scene.objects.get(id)
+        if obj is not None:
+            update_bakeables(obj)
+
+@bpy.app.handlers.persistent
+def on_load_post(*args):
+    # the target index gets rebuilt by the next depsgraph update
+    global initialized_bake_objects
+    initialized_bake_objects = False
+
+def remove_handler(handlers, fn):
+    '''Removes a handler by name (without throwing an error), the addon might have been reloaded.'''
+    for handler in list(handlers):
+        if handler.__name__ == fn.__name__:
+            handlers.remove(handler)
 
 def start_server():
-    global daemon
-    print("Starting Butler server")
-    require.require(["aiohttp"])
-    dir = os.path.dirname(__file__)
-    path = os.path.join(dir, "server/server.py")
-    daemon = Popen([sys.executable, path], stdout=sys.stdout, stderr=sys.stderr)
+    '''Attaches to the daemon running on this host, or starts one. Runs in a background thread, so
+    Blender doesn't wait for it (or for installing its dependencies). Task updates sent in the
+    meantime are queued by the telemetry client.'''
+    global daemon_enabled
+    daemon_enabled = True
+    start_telemetry()
+    threading.Thread(target=launch_server, name="butler-daemon-start", daemon=True).start()
+
+def find_daemon():
+    '''Returns the lockfile entry ({"pid", "port", "socket"}) of a healthy daemon on this host, or None.'''
+    lock = discovery.read_lockfile()
+    if lock is None:
+        return None
+    try:
+        info = requests.get(f"http://localhost:{lock['port']}/info", timeout=1.0).json()
+    except (requests.RequestException, ValueError):
+        return None
+    return lock if info.get("service") == discovery.SERVICE else None
+
+def wait_for_daemon(timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        lock = find_daemon()
+        if lock is not None:
+            return lock
+        time.sleep(0.2)
+    return None
+
+def post_to_daemon(port, route):
+    try:
+        response = requests.post(f"http://localhost:{port}/{route}", json={"pid": os.getpid()}, timeout=1.0)
+        response.raise_for_status()
+        return response.json()
+    except (requests.RequestException, ValueError) as e:
+        print(f"Couldn't {route} to the Butler server ({e.__class__.__name__})")
+        return None
+
+def launch_server():
+    global daemon, daemon_enabled, daemon_port
+    lock = find_daemon()
+
+    if lock is None:
+        if not require.require(["aiohttp"]):
+            print("Butler server can't run without its dependencies")
+            daemon_enabled = False
+            return
+
+        with daemon_lock:
+            # the addon might have been disabled while installing
+            if not daemon_enabled:
+                return
+            print("Starting Butler server")
+            dir = os.path.dirname(__file__)
+            path = os.path.join(dir, "server/server.py")
+            # a shared daemon stops by itself once every Blender instance has detached
+            daemon = Popen([sys.executable, path, "--shared"], stdout=sys.stdout, stderr=sys.stderr)
+
+        # if another instance was quicker, ours exits and we attach to theirs
+        lock = wait_for_daemon()
+        if lock is None:
+            print("Butler server didn't come up")
+            return
+    else:
+        print(f"Using the Butler server on port {lock['port']}")
+
+    port = lock["port"]
+    with daemon_lock:
+        if not daemon_enabled or post_to_daemon(port, "attach") is None:
+            return
+        daemon_port = port
+        if telemetry_client is not None:
+            telemetry_client.url = f"http://localhost:{port}/update"
+            telemetry_client.socket_path = lock["socket"]
 
 def kill_server():
-    global daemon
-    if daemon is not None:
-        print("Killing Butler server")
-        daemon.terminate()
+    global daemon, daemon_enabled, daemon_port
+    stop_telemetry()
+    with daemon_lock:
+        daemon_enabled = False
+        detached = False
+        if daemon_port is not None:
+            # other Blender instances might still be using it
+            detached = post_to_daemon(daemon_port, "detach") is not None
+            daemon_port = None
+
+        if daemon is not None and not detached:
+            print("Killing Butler server")
+            daemon.terminate()
+        daemon = None
+
+def start_telemetry():
+    global telemetry_client
+    if telemetry_client is None:
+        telemetry_client = telemetry.TelemetryClient(BUTLER_URL)
+        telemetry_client.start()
+
+def stop_telemetry():
+    global telemetry_client
+    if telemetry_client is not None:
+        telemetry_client.stop()
+        telemetry_client = None
 
 
 # store keymaps here to access after registration
@@ -705,7 +1538,10 @@ addon_keymaps = []
 
 
 def register():
-    start_server()
+    if not bpy.app.background:
+        # background processes (render nodes, bake and render workers) don't report to the daemon,
+        # cli.py attaches to it when asked to
+        start_server()
 
     for cls in classes:
         bpy.utils.register_class(cls)
@@ -713,6 +1549,9 @@ def register():
     bpy.types.Scene.butler = PointerProperty(type=ButlerSettings)
     bpy.types.Object.bakeable = CollectionProperty(type=Bakeable)
     bpy.app.handlers.depsgraph_update_post.append(on_depsgraph_update)
+    bpy.app.handlers.load_post.append(on_load_post)
+    bpy.app.handlers.undo_post.append(on_load_post)
+    bpy.app.handlers.redo_post.append(on_load_post)
 
     # handle the keymap
     wm = bpy.context.window_manager
@@ -727,17 +1566,17 @@ def register():
 
 
 def unregister():
+    # background renders and bakes would keep going with nobody waiting for them
+    for abort in list(running_flows):
+        abort("the addon was unregistered")
     kill_server()
+    stop_notifier()
     
-    # Remove depsgraph update handler (without throwing an error)
-    my_handler = None
-    for handler in bpy.app.handlers.depsgraph_update_post:
-        if handler.__name__ == on_depsgraph_update.__name__:
-            my_handler = handler
-            break
-    
-    if my_handler is not None:
-        bpy.app.handlers.depsgraph_update_post.remove(my_handler)
+    # Remove handlers (without throwing an error)
+    remove_handler(bpy.app.handlers.depsgraph_update_post, on_depsgraph_update)
+    remove_handler(bpy.app.handlers.load_post, on_load_post)
+    remove_handler(bpy.app.handlers.undo_post, on_load_post)
+    remove_handler(bpy.app.handlers.redo_post, on_load_post)
 
     # Note: when unregistering, it's usually good practice to do it in reverse order you registered.
     # Can avoid strange issues like keymap still referring to operators already unregistered...
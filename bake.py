@@ -0,0 +1,132 @@
+# Bakes physics modifiers in background Blender processes ("blender -b"), so the
+# interactive session stays responsive and independent bakes can run in parallel.
+# Caches are written to the same directories the interactive session reads from.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import bpy
+
+from . import workers
+
+JOB_SCRIPT = os.path.join(os.path.dirname(__file__), "bake_job.py")
+
+
+def blendcache_name() -> str:
+    return "blendcache_" + os.path.splitext(bpy.path.basename(bpy.data.filepath))[0]
+
+
+class BakeProcess:
+    '''Saves a snapshot of the .blend and bakes one modifier of one object in it.'''
+
+    def __init__(self, obj, mod, surface=None, free=False, data=True, mesh=False, frame_end=None):
+        self.obj = obj
+        self.mod = mod
+        self.surface = surface
+        self.free = free
+        self.data = data
+        self.mesh = mesh
+        self.frame_end = frame_end
+        self.process = None
+        self.directory = None
+        self.blendfile = None
+        self.linked_cache = None
+        self.log = None
+        # called from a worker thread once the process exits
+        self.notify = lambda: None
+
+    def uses_point_cache(self):
+        if self.mod.type == "FLUID":
+            return False
+        if self.mod.type == "DYNAMIC_PAINT":
+            return self.surface is not None and self.surface.surface_format != "IMAGE"
+        return True
+
+    def point_cache(self):
+        return self.surface.point_cache if self.mod.type == "DYNAMIC_PAINT" else self.mod.point_cache
+
+    def link_point_cache(self):
+        '''Makes the snapshot's blendcache directory point at the original one.'''
+        original = bpy.path.abspath("//" + blendcache_name())
+        os.makedirs(original, exist_ok=True)
+
+        link = os.path.join(self.directory, blendcache_name())
+        try:
+            os.symlink(original, link, target_is_directory=True)
+        except (OSError, NotImplementedError):
+            # no symlinks (e.g. Windows without privileges), files get moved afterwards
+            self.linked_cache = (link, original)
+
+    def command(self):
+        args = ["--object", self.obj.name, "--modifier", self.mod.name]
+
+        if self.mod.type == "FLUID":
+            args += ["--cache-dir", bpy.path.abspath(self.mod.domain_settings.cache_directory)]
+            if self.data: args.append("--data")
+            if self.mesh: args.append("--mesh")
+        elif self.mod.type == "DYNAMIC_PAINT":
+            args += ["--surface", self.surface.name]
+            if self.surface.surface_format == "IMAGE":
+                args += ["--output-dir", bpy.path.abspath(self.surface.image_output_path)]
+                if self.frame_end is not None:
+                    args += ["--frame-end", str(self.frame_end)]
+
+        if self.free:
+            args.append("--free")
+
+        return [
+            bpy.app.binary_path, "-b", self.blendfile,
+            "--python-exit-code", "1",
+            "--python", JOB_SCRIPT,
+            "--", *args,
+        ]
+
+    def start(self):
+        self.directory = tempfile.mkdtemp(prefix="butler_bake_")
+        self.blendfile = workers.save_snapshot(self.directory)
+
+        if self.uses_point_cache():
+            self.link_point_cache()
+
+        self.log = os.path.join(self.directory, "bake.log")
+        print(f"Baking {self.obj.name} > {self.mod.name} in the background, see {self.log}")
+        with open(self.log, "w") as log:
+            self.process = subprocess.Popen(self.command(), stdout=log, stderr=subprocess.STDOUT)
+
+        process = self.process
+        def wait():
+            process.wait()
+            self.notify()
+        threading.Thread(target=wait, daemon=True).start()
+
+    def poll(self) -> bool:
+        return self.process is not None and self.process.poll() is not None
+
+    def finish(self, override) -> bool:
+        '''Hands the baked cache over to this session. Returns whether the bake succeeded.'''
+        success = self.process.returncode == 0
+
+        if self.linked_cache is not None:
+            link, original = self.linked_cache
+            if os.path.isdir(link):
+                for name in os.listdir(link):
+                    shutil.move(os.path.join(link, name), os.path.join(original, name))
+
+        if success:
+            if self.uses_point_cache():
+                with bpy.context.temp_override(**{**override, "point_cache": self.point_cache()}):
+                    bpy.ops.ptcache.bake_from_cache()
+            # let the modifier read the new cache from disk
+            self.obj.update_tag()
+            shutil.rmtree(self.directory, ignore_errors=True)
+        else:
+            print(f"Background bake of {self.obj.name} > {self.mod.name} failed, see {self.log}")
+
+        return success
+
+    def cancel(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
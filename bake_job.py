@@ -0,0 +1,81 @@
+# Runs inside a background Blender process started by bake.py:
+#
+#   blender -b snapshot.blend --python bake_job.py -- --object Cube --modifier Cloth
+#
+# Bakes a single physics modifier and writes its cache to the paths of the
+# original .blend, so the interactive session can pick it up afterwards.
+
+import argparse
+import sys
+
+import bpy
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="bake_job.py")
+    parser.add_argument("--object", required=True)
+    parser.add_argument("--modifier", required=True)
+    parser.add_argument("--surface", help="Dynamic paint canvas surface")
+    parser.add_argument("--cache-dir", help="Absolute fluid cache directory")
+    parser.add_argument("--output-dir", help="Absolute dynamic paint image output directory")
+    parser.add_argument("--frame-end", type=int, help="Last dynamic paint frame to bake")
+    parser.add_argument("--free", action="store_true", help="Free the existing cache first")
+    parser.add_argument("--data", action="store_true", help="Bake fluid data")
+    parser.add_argument("--mesh", action="store_true", help="Bake fluid mesh")
+    return parser.parse_args(argv)
+
+
+def bake_point_cache(cache, free):
+    with bpy.context.temp_override(point_cache=cache):
+        if free:
+            bpy.ops.ptcache.free_bake()
+        bpy.ops.ptcache.bake(bake=True)
+
+
+def bake_fluid(mod, args):
+    dom = mod.domain_settings
+    if args.cache_dir:
+        dom.cache_directory = args.cache_dir
+
+    if args.free:
+        bpy.ops.fluid.free_all()
+    if args.data:
+        bpy.ops.fluid.bake_data()
+    if args.mesh:
+        bpy.ops.fluid.bake_mesh()
+
+
+def bake_dynamic_paint(mod, args):
+    surface = mod.canvas_settings.canvas_surfaces[args.surface]
+    if surface.surface_format != "IMAGE":
+        return bake_point_cache(surface.point_cache, args.free)
+
+    if args.output_dir:
+        surface.image_output_path = args.output_dir
+    if args.frame_end is not None:
+        surface.frame_end = args.frame_end
+
+    mod.canvas_settings.canvas_surfaces.active_index = mod.canvas_settings.canvas_surfaces.find(surface.name)
+    bpy.ops.dpaint.bake()
+
+
+def main():
+    args = parse_args()
+
+    obj = bpy.data.objects[args.object]
+    mod = obj.modifiers[args.modifier]
+
+    print(f"Baking {args.object} > {args.modifier}")
+    with bpy.context.temp_override(active_object=obj, object=obj):
+        if mod.type == "FLUID":
+            bake_fluid(mod, args)
+        elif mod.type == "DYNAMIC_PAINT":
+            bake_dynamic_paint(mod, args)
+        else:
+            bake_point_cache(mod.point_cache, args.free)
+    print("Bake finished")
+
+
+main()
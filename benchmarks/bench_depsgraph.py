@@ -0,0 +1,83 @@
+# Cost of the depsgraph handler, which runs after every edit in Blender, and of
+# keeping the `bakeable` lists up to date, for scenes with N objects of M modifiers.
+
+from common import addon_class, bpy, load_addon, measure, result
+
+SCENES = ((100, 2), (1000, 4), (10000, 4))
+MODIFIER_TYPES = ("SUBSURF", "CLOTH", "FLUID", "DYNAMIC_PAINT", "SOFT_BODY", "ARRAY")
+BAKE_SHARE = 10  # every nth object is the target of a bake action
+
+
+def make_modifier(i: int, kind: str):
+    name = f"{kind.title()}.{i:03d}"
+    if kind == "FLUID":
+        return bpy.types.FluidModifier(name, kind, fluid_type="DOMAIN")
+    if kind == "DYNAMIC_PAINT":
+        return bpy.types.DynamicPaintModifier(name, kind, ui_type="CANVAS", canvas_settings=object())
+    return bpy.types.Modifier(name, kind)
+
+
+def make_scene(addon, objects: int, modifiers: int):
+    settings_cls = addon_class(addon, "ButlerSettings", bpy.types.PropertyGroup)
+    scene = bpy.types.Scene(objects=[
+        bpy.types.Object(f"Object.{n:05d}", [make_modifier(i, MODIFIER_TYPES[(n + i) % len(MODIFIER_TYPES)])
+                                            for i in range(modifiers)])
+        for n in range(objects)
+    ])
+    scene.butler = settings_cls()
+    bpy.context.scene = scene
+
+    flow = scene.butler.get_active_flow()
+    for n in range(0, objects, BAKE_SHARE):
+        action = flow.actions.add()
+        action.action_type = addon.ButlerActionType.BAKE
+        action.target = f"Object.{n:05d}"
+
+    addon.initialized_bake_objects = False
+    addon.on_depsgraph_update(scene)
+    return scene
+
+
+def run(quick=False):
+    addon = load_addon()
+    results = []
+
+    for objects, modifiers in SCENES[:2] if quick else SCENES:
+        params = {"objects": objects, "modifiers": modifiers, "bake_objects": -(-objects // BAKE_SHARE)}
+        scene = make_scene(addon, objects, modifiers)
+        tracked = scene.objects[0]
+        untracked = scene.objects[1]
+
+        # an edit of a single object, the most common case
+        depsgraph = bpy.types.Depsgraph([tracked])
+        stats = measure(lambda: addon.on_depsgraph_update(scene, depsgraph), repeat=200)
+        results.append(result("depsgraph.single_tracked_object", params, stats))
+
+        depsgraph = bpy.types.Depsgraph([untracked])
+        stats = measure(lambda: addon.on_depsgraph_update(scene, depsgraph), repeat=200)
+        results.append(result("depsgraph.single_untracked_object", params, stats))
+
+        # a frame change or playback touches every object
+        depsgraph = bpy.types.Depsgraph(list(scene.objects), id_types=["SCENE"])
+        stats = measure(lambda: addon.on_depsgraph_update(scene, depsgraph), repeat=10)
+        results.append(result("depsgraph.all_objects", params, stats))
+
+        # rebuilding the index, as after loading a file or undoing
+        stats = measure(lambda: addon.update_bake_objects(scene), repeat=5)
+        results.append(result("depsgraph.rebuild_index", params, stats))
+
+        stats = measure(lambda: addon.update_bakeables(tracked), repeat=200)
+        results.append(result("update_bakeables.unchanged", params, stats))
+
+        def change_stack():
+            # alternately adds and removes a bakeable modifier, so every run sees a change
+            if len(tracked.modifiers) > modifiers:
+                tracked.modifiers.remove(len(tracked.modifiers) - 1)
+            else:
+                tracked.modifiers.append(make_modifier(modifiers, "CLOTH"))
+            return tracked
+
+        stats = measure(addon.update_bakeables, repeat=50, setup=change_stack)
+        results.append(result("update_bakeables.changed", params, stats))
+
+    return results
@@ -0,0 +1,61 @@
+# Overhead of running a flow: building the dependency graph, estimating costs and
+# scheduling. Actions are Python operators doing nothing, so all of the time is
+# the addon's own bookkeeping.
+
+import os
+import tempfile
+
+from common import addon_class, bpy, load_addon, measure, quiet, result
+
+SIZES = (10, 100, 1000, 10000)
+
+
+def make_scene(addon, actions: int, concurrency: int):
+    settings_cls = addon_class(addon, "ButlerSettings", bpy.types.PropertyGroup)
+    scene = bpy.types.Scene()
+    scene.butler = settings_cls()
+    bpy.context.scene = scene
+
+    flow = scene.butler.get_active_flow()
+    flow.concurrency = concurrency
+    for _ in range(actions):
+        action = flow.actions.add()
+        action.action_type = addon.ButlerActionType.PYTHON_OPERATOR
+        action.single_operator = "pass"
+        action.dependency_mode = addon.ButlerDependency.AUTO
+    return flow
+
+
+def run(quick=False):
+    addon = load_addon()
+    results = []
+    sizes = SIZES[:3] if quick else SIZES
+
+    with tempfile.TemporaryDirectory() as directory:
+        history_path = os.path.join(directory, "history.jsonl")
+
+        for concurrency in (1, 4):
+            for size in sizes:
+                repeat = 3 if size >= 10000 else 5
+
+                def setup():
+                    # a fresh history per run, otherwise later runs read a growing file
+                    if os.path.exists(history_path):
+                        os.remove(history_path)
+                    addon.run_history = addon.history.RunHistory(history_path)
+                    return make_scene(addon, size, concurrency)
+
+                def execute(flow):
+                    with quiet():
+                        flow.run(bpy.context)
+
+                stats = measure(execute, repeat=repeat, setup=setup)
+                results.append(result("flow.run", {"actions": size, "concurrency": concurrency}, stats,
+                                      per_action=stats["median"] / size))
+
+            for size in sizes:
+                flow = make_scene(addon, size, concurrency)
+                stats = measure(flow.dependencies, repeat=5)
+                results.append(result("flow.dependencies", {"actions": size, "concurrency": concurrency}, stats))
+
+    return results
@@ -0,0 +1,168 @@
+# Throughput and broadcast latency of the daemon. The server runs in its own
+# process, like it does next to Blender, and is driven over HTTP, websockets and
+# its Unix domain socket.
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import ROOT, result, summarize
+
+SERVER = os.path.join(ROOT, "server", "server.py")
+sys.path.insert(0, os.path.dirname(SERVER))
+import framing  # noqa: E402
+
+CLIENT_COUNTS = (1, 10, 100)
+TICK = 0.05
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(port: int, tick: float, home: str):
+    # a home of its own keeps the lockfile and socket away from a real daemon
+    socket_path = os.path.join(home, "daemon.sock") if hasattr(socket, "AF_UNIX") else None
+    command = [sys.executable, SERVER, "--port", str(port), "--no-persist", "--tick", str(tick)]
+    command += ["--socket", socket_path] if socket_path else ["--no-socket"]
+    process = subprocess.Popen(command, env={**os.environ, "HOME": home, "USERPROFILE": home},
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            if socket_path is None or os.path.exists(socket_path):
+                return process, socket_path
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The daemon didn't start listening")
+
+
+async def connect(session, url: str, count: int):
+    clients = []
+    for _ in range(count):
+        ws = await session.ws_connect(url)
+        await ws.receive()  # initial snapshot
+        clients.append(ws)
+    return clients
+
+
+async def wait_for(ws, marker: str):
+    async for msg in ws:
+        if marker in msg.data:
+            return time.perf_counter()
+
+
+async def throughput(session, base: str, seconds: float, batch: int):
+    '''Posts batches of updates back to back, returns (requests, updates) per second.'''
+    requests = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        updates = [{"id": f"task-{i}", "progress": (requests % 100) / 100, "description": f"step {requests}"}
+                   for i in range(batch)]
+        async with session.post(base + "/update", data=json.dumps(updates)) as response:
+            await response.read()
+        requests += 1
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, requests * batch / elapsed
+
+
+async def socket_throughput(path: str, seconds: float, batch: int):
+    '''Like `throughput`, over the Unix domain socket with framed messages.'''
+    reader, writer = await asyncio.open_unix_connection(path)
+    requests = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        updates = [{"id": f"task-{i}", "progress": (requests % 100) / 100, "description": f"step {requests}"}
+                   for i in range(batch)]
+        writer.write(framing.pack(updates))
+        await framing.read_async(reader)
+        requests += 1
+    elapsed = time.perf_counter() - start
+    writer.close()
+    return requests / elapsed, requests * batch / elapsed
+
+
+async def broadcast_latency(session, base: str, clients, rounds: int):
+    '''Time from posting an update until every client has received it.'''
+    latencies = []
+    for n in range(rounds):
+        marker = f"latency-{n}-{time.perf_counter_ns()}"
+        waiters = [asyncio.ensure_future(wait_for(ws, marker)) for ws in clients]
+        sent = time.perf_counter()
+        async with session.post(base + "/update", data=json.dumps([{"id": "latency", "description": marker}])) as r:
+            await r.read()
+        received = await asyncio.gather(*waiters)
+        latencies.append(max(received) - sent)
+    return latencies
+
+
+async def drain(clients):
+    # keeps idle clients reading, so the server doesn't evict them as too slow
+    async def read(ws):
+        async for _ in ws:
+            pass
+    return [asyncio.ensure_future(read(ws)) for ws in clients]
+
+
+async def measure_server(port: int, socket_path, clients: int, quick: bool):
+    import aiohttp
+
+    base = f"http://127.0.0.1:{port}"
+    async with aiohttp.ClientSession() as session:
+        sockets = await connect(session, f"ws://127.0.0.1:{port}/ws", clients)
+
+        latencies = await broadcast_latency(session, base, sockets, 10 if quick else 50)
+
+        readers = await drain(sockets)
+        seconds = 1 if quick else 3
+        rates = {
+            ("http", 1): await throughput(session, base, seconds, batch=1),
+            ("http", 50): await throughput(session, base, seconds, batch=50),
+        }
+        if socket_path is not None:
+            rates["unix", 1] = await socket_throughput(socket_path, seconds, batch=1)
+            rates["unix", 50] = await socket_throughput(socket_path, seconds, batch=50)
+
+        for reader in readers:
+            reader.cancel()
+        for ws in sockets:
+            await ws.close()
+
+    return latencies, rates
+
+
+def run(quick=False):
+    try:
+        import aiohttp  # noqa: F401
+    except ImportError:
+        print("aiohttp isn't installed, skipping the server benchmarks", file=sys.stderr)
+        return []
+
+    results = []
+    for clients in CLIENT_COUNTS[:2] if quick else CLIENT_COUNTS:
+        port = free_port()
+        with tempfile.TemporaryDirectory() as home:
+            process, socket_path = start_server(port, TICK, home)
+            try:
+                latencies, rates = asyncio.run(measure_server(port, socket_path, clients, quick))
+            finally:
+                process.terminate()
+                process.wait()
+
+        params = {"clients": clients, "tick": TICK}
+        results.append(result("server.broadcast_latency", params, summarize(latencies)))
+        for (transport, batch), (requests, updates) in rates.items():
+            results.append({"benchmark": "server.update_throughput",
+                            "params": {**params, "transport": transport, "batch": batch},
+                            "requests_per_second": requests, "updates_per_second": updates})
+
+    return results
@@ -0,0 +1,72 @@
+# Shared helpers of the benchmarks: loading the addon on top of the fake bpy and timing.
+
+import contextlib
+import importlib.util
+import io
+import os
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE = "blender_butler"
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import fake_bpy  # noqa: E402
+
+bpy = fake_bpy.install()
+
+
+def load_addon():
+    '''Imports the addon as a package, the way Blender does it.'''
+    if PACKAGE in sys.modules:
+        return sys.modules[PACKAGE]
+
+    spec = importlib.util.spec_from_file_location(PACKAGE, os.path.join(ROOT, "__init__.py"),
+                                                  submodule_search_locations=[ROOT])
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def addon_class(addon, name, base):
+    '''Looks up a registered class, some names are shadowed at module level.'''
+    return next(cls for cls in addon.classes if cls.__name__ == name and issubclass(cls, base))
+
+
+@contextlib.contextmanager
+def quiet():
+    '''Swallows the addon's progress prints, which would otherwise dominate the timings.'''
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+def measure(fn, repeat=5, setup=None):
+    '''Runs `fn` `repeat` times (calling `setup` before each run, untimed) and returns timing stats.'''
+    times = []
+    for _ in range(repeat):
+        state = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            fn(state)
+        else:
+            fn()
+        times.append(time.perf_counter() - start)
+    return summarize(times)
+
+
+def summarize(times):
+    ordered = sorted(times)
+    return {
+        "runs": len(times),
+        "min": ordered[0],
+        "median": statistics.median(ordered),
+        "mean": statistics.fmean(ordered),
+        "p95": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+        "max": ordered[-1],
+    }
+
+
+def result(benchmark, params, stats, **extra):
+    return {"benchmark": benchmark, "params": params, "seconds": stats, **extra}
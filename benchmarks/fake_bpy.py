@@ -0,0 +1,357 @@
+# A small stand-in for Blender's `bpy` module, just enough to import the addon and
+# drive its flows and handlers from plain CPython. Property annotations on
+# PropertyGroups become plain attributes with their defaults, update callbacks
+# included, and collections behave like bpy_prop_collection.
+
+import itertools
+import os
+import sys
+import types as pytypes
+
+_pointers = itertools.count(1)
+
+
+# bpy.props
+
+class Property:
+    def __init__(self, kind, args, kwargs):
+        self.kind = kind
+        self.args = args
+        self.kwargs = kwargs
+
+    def default(self):
+        if self.kind == "collection":
+            return Collection(self.kwargs["type"])
+        if self.kind == "pointer":
+            return self.kwargs["type"]()
+        if "default" in self.kwargs:
+            return self.kwargs["default"]
+        if self.kind == "enum":
+            items = self.kwargs.get("items")
+            # dynamic items are only known inside Blender
+            return items[0][0] if items and not callable(items) else ""
+        return {"bool": False, "int": 0, "float": 0.0, "string": ""}.get(self.kind)
+
+
+def _property(kind):
+    def make(*args, **kwargs):
+        return Property(kind, args, kwargs)
+    return make
+
+
+props = pytypes.ModuleType("bpy.props")
+for _kind, _name in [("bool", "BoolProperty"), ("int", "IntProperty"), ("float", "FloatProperty"),
+                     ("string", "StringProperty"), ("enum", "EnumProperty"),
+                     ("collection", "CollectionProperty"), ("pointer", "PointerProperty")]:
+    setattr(props, _name, _property(_kind))
+props.__all__ = [n for n in dir(props) if n.endswith("Property")]
+
+
+# bpy.types
+
+class Collection:
+    '''Mimics bpy_prop_collection: indexable by position and by name.'''
+
+    def __init__(self, type=None):
+        self.type = type
+        self.items = []
+
+    def add(self):
+        item = self.type()
+        self.items.append(item)
+        return item
+
+    def append(self, item):
+        self.items.append(item)
+        return item
+
+    def remove(self, index):
+        del self.items[index]
+
+    def clear(self):
+        self.items.clear()
+
+    def move(self, a, b):
+        self.items.insert(b, self.items.pop(a))
+
+    def get(self, name, default=None):
+        for item in self.items:
+            if getattr(item, "name", None) == name:
+                return item
+        return default
+
+    def find(self, name):
+        for i, item in enumerate(self.items):
+            if getattr(item, "name", None) == name:
+                return i
+        return -1
+
+    def values(self):
+        return list(self.items)
+
+    def keys(self):
+        return [getattr(item, "name", "") for item in self.items]
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            item = self.get(key)
+            if item is None:
+                raise KeyError(key)
+            return item
+        return self.items[key]
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __bool__(self):
+        return bool(self.items)
+
+
+class IDCollection(Collection):
+    '''Collection of data-blocks with a name lookup table, like Blender's name map for IDs.'''
+
+    def __init__(self, type=None):
+        super().__init__(type)
+        self.by_name = {}
+
+    def append(self, item):
+        self.by_name[item.name] = item
+        return super().append(item)
+
+    def remove(self, index):
+        self.by_name = {}
+        super().remove(index)
+
+    def clear(self):
+        self.by_name = {}
+        super().clear()
+
+    def get(self, name, default=None):
+        item = self.by_name.get(name)
+        if item is not None and item.name == name:
+            return item
+        # renamed or removed since the table was built
+        self.by_name = {item.name: item for item in self.items}
+        return self.by_name.get(name, default)
+
+
+class bpy_struct:
+    pass
+
+
+class PropertyGroup(bpy_struct):
+    _properties = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        found = {}
+        for base in reversed(cls.__mro__):
+            for name, value in vars(base).get("__annotations__", {}).items():
+                if isinstance(value, Property):
+                    found[name] = value
+        cls._properties = found
+
+    def __init__(self):
+        for name, prop in self._properties.items():
+            object.__setattr__(self, name, prop.default())
+        if "name" not in self._properties:
+            object.__setattr__(self, "name", "")
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        prop = self._properties.get(name)
+        if prop is not None and "update" in prop.kwargs:
+            prop.kwargs["update"](self, context)
+
+    def as_pointer(self):
+        pointer = self.__dict__.get("_pointer")
+        if pointer is None:
+            pointer = next(_pointers)
+            object.__setattr__(self, "_pointer", pointer)
+        return pointer
+
+
+class ID(bpy_struct):
+    def __init__(self, name=""):
+        self.name = name
+        self._pointer = next(_pointers)
+
+    @property
+    def original(self):
+        return self
+
+    def as_pointer(self):
+        return self._pointer
+
+    def update_tag(self):
+        pass
+
+
+class Modifier(bpy_struct):
+    def __init__(self, name, type, **settings):
+        self.name = name
+        self.type = type
+        self.__dict__.update(settings)
+
+
+class FluidModifier(Modifier):
+    pass
+
+
+class DynamicPaintModifier(Modifier):
+    pass
+
+
+class Object(ID):
+    def __init__(self, name, modifiers=()):
+        super().__init__(name)
+        self.modifiers = Collection()
+        for mod in modifiers:
+            self.modifiers.append(mod)
+        self.bakeable = Collection(Bakeable)
+
+
+class Bakeable(PropertyGroup):
+    pass
+
+
+class Scene(ID):
+    def __init__(self, name="Scene", objects=()):
+        super().__init__(name)
+        self.objects = IDCollection()
+        for obj in objects:
+            self.objects.append(obj)
+        self.frame_start = 1
+        self.frame_end = 250
+        self.frame_current = 1
+
+
+class DepsgraphUpdate:
+    def __init__(self, id):
+        self.id = id
+
+
+class Depsgraph:
+    def __init__(self, updates=(), id_types=()):
+        self.updates = [DepsgraphUpdate(id) for id in updates]
+        self.id_types = set(id_types)
+
+    def id_type_updated(self, id_type):
+        return id_type in self.id_types
+
+
+class Context:
+    def __init__(self, scene=None):
+        self.scene = scene
+        self.window_manager = None
+
+    def copy(self):
+        return {"scene": self.scene, "window_manager": self.window_manager}
+
+
+class _Registrable:
+    pass
+
+
+types = pytypes.ModuleType("bpy.types")
+for _cls in (bpy_struct, PropertyGroup, ID, Object, Scene, Modifier, FluidModifier, DynamicPaintModifier, Context,
+             Depsgraph):
+    setattr(types, _cls.__name__, _cls)
+for _name in ("Operator", "Panel", "UIList", "UILayout", "DynamicPaintSurface"):
+    setattr(types, _name, type(_name, (_Registrable,), {}))
+
+
+# bpy.app, bpy.path, bpy.data, bpy.context, bpy.ops, bpy.utils
+
+class _Timers:
+    def __init__(self):
+        self.registered = []
+
+    def register(self, fn, first_interval=0, persistent=False):
+        self.registered.append(fn)
+
+    def is_registered(self, fn):
+        return fn in self.registered
+
+    def unregister(self, fn):
+        self.registered.remove(fn)
+
+
+app = pytypes.ModuleType("bpy.app")
+app.binary_path = "blender"
+app.background = True
+app.timers = _Timers()
+app.handlers = pytypes.SimpleNamespace(
+    persistent=lambda fn: fn,
+    **{event: [] for event in ("depsgraph_update_post", "load_post", "undo_post", "redo_post", "render_init",
+                               "render_pre", "render_post", "render_write", "render_complete", "render_cancel",
+                               "frame_change_post")}
+)
+
+
+class _Data:
+    filepath = ""
+
+    def __init__(self):
+        self.objects = IDCollection()
+        self.scenes = IDCollection()
+
+
+data = _Data()
+
+
+def _abspath(path, start=None, library=None):
+    if path.startswith("//"):
+        return os.path.join(os.path.dirname(data.filepath), path[2:])
+    return path
+
+
+path = pytypes.ModuleType("bpy.path")
+path.abspath = _abspath
+path.basename = lambda p: os.path.basename(p[2:] if p.startswith("//") else p)
+path.ensure_ext = lambda p, ext, case_sensitive=False: p if p.lower().endswith(ext) else p + ext
+
+
+class _Operators:
+    '''Any bpy.ops.<module>.<name>(...) call is recorded and returns {'FINISHED'}.'''
+
+    def __init__(self, prefix=""):
+        self._prefix = prefix
+        self.calls = []
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        if not self._prefix:
+            module = _Operators(name)
+            module.calls = self.calls
+            setattr(self, name, module)
+            return module
+
+        def operator(*args, **kwargs):
+            self.calls.append((f"{self._prefix}.{name}", args, kwargs))
+            return {"FINISHED"}
+        return operator
+
+
+ops = _Operators()
+context = Context()
+
+utils = pytypes.ModuleType("bpy.utils")
+utils.register_class = lambda cls: None
+utils.unregister_class = lambda cls: None
+
+
+def install():
+    '''Makes `import bpy` (and bpy.props, bpy.types) resolve to this module.'''
+    module = sys.modules[__name__]
+    sys.modules["bpy"] = module
+    sys.modules["bpy.props"] = props
+    sys.modules["bpy.types"] = types
+    sys.modules["bpy.app"] = app
+    sys.modules["bpy.path"] = path
+    sys.modules["bpy.utils"] = utils
+    return module
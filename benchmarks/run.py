@@ -0,0 +1,66 @@
+# Runs the benchmarks on plain CPython, with a stand-in for Blender's bpy module:
+#
+#   python benchmarks/run.py                      # everything, JSON to stdout
+#   python benchmarks/run.py --only flow,server --quick -o results.json
+#
+# The addon needs `requests` importable, the server benchmarks need `aiohttp`
+# (pip install -r benchmarks/requirements.txt).
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import bench_depsgraph  # noqa: E402
+import bench_flow  # noqa: E402
+import bench_server  # noqa: E402
+
+SUITES = {
+    "flow": bench_flow.run,
+    "depsgraph": bench_depsgraph.run,
+    "server": bench_server.run,
+}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Blender Butler benchmarks")
+    parser.add_argument("--only", help="Comma separated suites to run: " + ", ".join(SUITES))
+    parser.add_argument("--quick", action="store_true", help="Smaller sizes and fewer rounds")
+    parser.add_argument("-o", "--output", help="Write the results to this file instead of stdout")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    names = args.only.split(",") if args.only else list(SUITES)
+    unknown = [n for n in names if n not in SUITES]
+    if unknown:
+        sys.exit("Unknown suites: " + ", ".join(unknown))
+
+    results = []
+    for name in names:
+        print(f"Running {name} benchmarks", file=sys.stderr)
+        results.extend(SUITES[name](quick=args.quick))
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Finds out which frames of a physics cache exist on disk, so a bake that got
+# interrupted can be resumed instead of starting over. Directory listings are
+# memoized by the directory's mtime, which only changes when files come or go.
+
+import os
+import re
+from typing import Dict, FrozenSet, Optional, Tuple
+
+import bpy
+
+from .manifest import to_ranges
+
+FLUID_KINDS = ("data", "mesh", "noise", "particles")
+FLUID_FRAME = re.compile(r"_(\d{4})\.\w+(\.gz)?$")
+
+_listings: Dict[str, Tuple[int, Tuple[str, ...]]] = {}
+
+
+def list_directory(directory: str) -> Tuple[str, ...]:
+    '''Returns the file names in `directory`, rescanning only if it changed since last time.'''
+    try:
+        mtime = os.stat(directory).st_mtime_ns
+    except OSError:
+        _listings.pop(directory, None)
+        return ()
+
+    cached = _listings.get(directory)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with os.scandir(directory) as it:
+        names = tuple(entry.name for entry in it if entry.is_file())
+    _listings[directory] = (mtime, names)
+    return names
+
+
+def scan_frames(directory: str, pattern: re.Pattern) -> FrozenSet[int]:
+    '''Frame numbers of the files in `directory` matching `pattern` (first group is the frame).'''
+    frames = set()
+    for name in list_directory(directory):
+        match = pattern.search(name)
+        if match:
+            frames.add(int(match.group(1)))
+    return frozenset(frames)
+
+
+class Coverage:
+    '''Which frames of `start` - `end` are cached.'''
+
+    def __init__(self, frames: FrozenSet[int], start: int, end: int):
+        self.start = start
+        self.end = end
+        self.frames = frozenset(f for f in frames if start <= f <= end)
+
+    @property
+    def total(self):
+        return max(0, self.end - self.start + 1)
+
+    @property
+    def count(self):
+        return len(self.frames)
+
+    @property
+    def complete(self):
+        return self.count >= self.total
+
+    @property
+    def empty(self):
+        return not self.frames
+
+    @property
+    def last_contiguous(self):
+        '''Last frame of the uninterrupted run of cached frames from the start, or start - 1.'''
+        frame = self.start
+        while frame in self.frames:
+            frame += 1
+        return frame - 1
+
+    @property
+    def resumable(self):
+        '''Whether baking can continue after the cached frames without leaving holes.'''
+        return not self.empty and self.last_contiguous == max(self.frames)
+
+    def missing_ranges(self):
+        return to_ranges([f for f in range(self.start, self.end + 1) if f not in self.frames])
+
+    def __str__(self):
+        if self.complete:
+            return f"Cached {self.count}/{self.total} frames"
+        if self.empty:
+            return f"Not cached (0/{self.total} frames)"
+        missing = ", ".join(f"{s}-{e}" if s != e else str(s) for s, e in self.missing_ranges()[:3])
+        return f"Cached {self.count}/{self.total} frames, missing {missing}"
+
+
+def point_cache_dir(cache) -> str:
+    '''Returns the directory a point cache writes its disk cache to.'''
+    if cache.use_external:
+        return bpy.path.abspath(cache.filepath)
+    name = os.path.splitext(bpy.path.basename(bpy.data.filepath))[0]
+    return bpy.path.abspath("//blendcache_" + name)
+
+
+def point_cache_prefix(obj, cache) -> str:
+    # unnamed caches are stored under the hex encoded object name
+    return cache.name or "".join(f"{b:02X}" for b in obj.name.encode())
+
+
+def point_cache_coverage(obj, cache) -> Optional[Coverage]:
+    '''Coverage of a disk point cache, None for caches that only live in memory.'''
+    if not cache.use_disk_cache or (not bpy.data.filepath and not cache.use_external):
+        return None
+
+    index = f"{cache.index:02d}" if cache.index >= 0 else r"\d{2}"
+    pattern = re.compile(rf"^{re.escape(point_cache_prefix(obj, cache))}_(\d{{6}})_{index}\.bphys$")
+    frames = scan_frames(point_cache_dir(cache), pattern)
+    return Coverage(frames, cache.frame_start, cache.frame_end)
+
+
+def fluid_coverage(dom, kind="data") -> Coverage:
+    '''Coverage of one part (data, mesh, noise, particles) of a fluid domain's cache.'''
+    directory = os.path.join(bpy.path.abspath(dom.cache_directory), kind)
+    frames = scan_frames(directory, FLUID_FRAME)
+    return Coverage(frames, dom.cache_frame_start, dom.cache_frame_end)
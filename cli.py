@@ -0,0 +1,180 @@
+# Runs a Butler flow in background Blender, e.g. on a render node without a UI:
+#
+#   blender -b shot.blend --python cli.py -- --flow "Final render"
+#   blender -b shot.blend --python cli.py -- --import flows.json --flow "Final render" --save
+#   blender -b shot.blend --python cli.py -- --export flows.json
+#
+# Operators run with EXEC_DEFAULT, so renders and bakes inside this process block
+# until they're done; background bakes and parallel renders are waited for.
+# Exit codes: 0 when every action finished with all of its frames, 1 when an
+# action failed or left frames missing, 2 for usage errors, 3 on timeout.
+
+import argparse
+import importlib
+import os
+import sys
+import time
+import traceback
+
+import bpy
+
+EXIT_OK = 0
+EXIT_FAILED = 1
+EXIT_USAGE = 2
+EXIT_TIMEOUT = 3
+
+
+def parse_args():
+    argv = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else []
+
+    parser = argparse.ArgumentParser(prog="blender -b file.blend --python cli.py --",
+                                     description="Run a Blender Butler flow without the UI")
+    parser.add_argument("--flow", help="Name of the flow to run")
+    parser.add_argument("--scene", help="Scene whose flows to use (default: the file's active scene)")
+    parser.add_argument("--list", action="store_true", help="List the flows and their actions")
+    parser.add_argument("--import", dest="import_path", metavar="PATH", help="Import flows from a JSON export first")
+    parser.add_argument("--export", metavar="PATH", help="Export the flows (only --flow, if given) as JSON, - for stdout")
+    parser.add_argument("--save", action="store_true", help="Save the .blend afterwards (e.g. to keep imported flows)")
+    parser.add_argument("--timeout", type=float, help="Give up after this many seconds")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Report progress to the Butler daemon (needed for the Work Queue render mode)")
+    return parser.parse_args(argv)
+
+
+def load_addon():
+    '''Returns the addon package, registered. It's already loaded if it's enabled in the preferences.'''
+    directory = os.path.dirname(os.path.abspath(__file__))
+    name = os.path.basename(directory)
+    addon = sys.modules.get(name)
+    if addon is None:
+        sys.path.insert(0, os.path.dirname(directory))
+        addon = importlib.import_module(name)
+    if not hasattr(bpy.types.Scene, "butler"):
+        addon.register()
+    return addon
+
+
+def start_daemon(addon, timeout=20.0):
+    addon.start_server()
+    deadline = time.monotonic() + timeout
+    while addon.daemon_port is None and addon.daemon_enabled and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return addon.daemon_port is not None
+
+
+def describe(flow):
+    lines = [f"{flow.name} (concurrency {flow.concurrency})"]
+    for i, action in enumerate(flow.actions):
+        state = "" if action.enabled else " (disabled)"
+        lines.append(f"  {i + 1}. {action.action_type}{state}")
+    return "\n".join(lines)
+
+
+def run_flow(addon, flow, timeout):
+    '''Runs the flow to completion. Returns an exit code.'''
+    ctx = bpy.context
+    done = []
+    started = time.monotonic()
+    try:
+        flow.run(ctx, on_done=lambda: done.append(True))
+        finished = addon.completion.run_until(lambda: bool(done), timeout)
+    except Exception:
+        traceback.print_exc()
+        return EXIT_FAILED
+
+    if not finished:
+        if timeout is not None and time.monotonic() - started >= timeout:
+            print(f"Flow {flow.name} didn't finish within {addon.format_duration(timeout)}")
+            return EXIT_TIMEOUT
+        print(f"Flow {flow.name} stopped before all of its actions finished")
+        return EXIT_FAILED
+
+    missing = [(i, action.incomplete(ctx)) for i, action in enumerate(flow.actions)]
+    missing = [(i, n) for i, n in missing if n]
+    for i, n in missing:
+        print(f"Action {i + 1} ({flow.actions[i].action_type}) is missing {n} frames")
+    print(f"Flow {flow.name} finished in {addon.format_duration(time.monotonic() - started)}")
+    return EXIT_FAILED if missing else EXIT_OK
+
+
+def main():
+    args = parse_args()
+    addon = load_addon()
+
+    if args.scene is not None:
+        scene = bpy.data.scenes.get(args.scene)
+        if scene is None:
+            print(f"No scene named {args.scene}")
+            return EXIT_USAGE
+        # flows and their actions work on the context's scene
+        with bpy.context.temp_override(scene=scene):
+            return run(args, addon)
+    return run(args, addon)
+
+
+def run(args, addon):
+    butler = addon.settings(bpy.context)
+
+    if args.import_path:
+        try:
+            with open(args.import_path) as f:
+                warnings = addon.import_flows(bpy.context.scene, f.read())
+        except (OSError, ValueError) as e:
+            print(f"Couldn't import {args.import_path} ({e})")
+            return EXIT_USAGE
+        for warning in warnings:
+            print(f"Import: {warning}")
+
+    flow = None
+    if args.flow is not None:
+        flow = next((f for f in butler.flows if f.name == args.flow), None)
+        if flow is None:
+            print(f"No flow named {args.flow}, there are: " + ", ".join(f.name for f in butler.flows))
+            return EXIT_USAGE
+
+    if args.list:
+        for f in butler.flows:
+            print(describe(f))
+
+    if args.export:
+        text = addon.flow_io.export_flows([flow] if flow is not None else butler.flows)
+        if args.export == "-":
+            print(text)
+        else:
+            with open(args.export, "w") as f:
+                f.write(text)
+            print(f"Exported flows to {args.export}")
+
+    code = EXIT_OK
+    if flow is not None:
+        if args.daemon and not start_daemon(addon):
+            print("Butler daemon unavailable, continuing without it")
+        code = run_flow(addon, flow, args.timeout)
+    elif not (args.list or args.export or args.import_path):
+        print("Nothing to do, pass --flow, --list, --import or --export")
+        return EXIT_USAGE
+
+    if args.save:
+        bpy.ops.wm.save_mainfile()
+    return code
+
+
+def shutdown():
+    addon = sys.modules.get(os.path.basename(os.path.dirname(os.path.abspath(__file__))))
+    if addon is None:
+        return
+    # lets pending notification mails go out
+    addon.stop_notifier(timeout=30.0)
+    addon.kill_server()
+
+
+if __name__ == "__main__":
+    try:
+        code = main()
+    except Exception:
+        traceback.print_exc()
+        code = EXIT_FAILED
+    finally:
+        shutdown()
+    sys.stdout.flush()
+    sys.exit(code)
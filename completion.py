@@ -0,0 +1,317 @@
+# Notifies the flow as soon as a long running action (render, bake) is done.
+# Instead of checking once a second, waiters are woken up by Blender handlers
+# (render_complete, render_cancel) and by file system events (inotify on Linux).
+# Polling with an increasing interval is only used as a fallback.
+#
+# Timers never fire in background Blender ("blender -b"), so there whoever runs
+# the flow (see cli.py) drives the waiters with `run_until`.
+
+import ctypes
+import ctypes.util
+import datetime
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import traceback
+from typing import Any, Callable, Iterable, Optional
+
+import bpy
+
+RENDER_EVENTS = ("render_complete",)
+CANCEL_EVENTS = ("render_cancel",)
+
+# how often callbacks posted from other threads are picked up on the main thread
+DISPATCH_INTERVAL = 0.05
+
+_posted = queue.SimpleQueue()
+_dispatching = False
+_waiters = set()
+_subscribers = {}
+_handlers = {}
+
+
+def post(fn: Callable[[], Any]):
+    '''Runs `fn` on Blender's main thread. Safe to call from any thread.'''
+    _posted.put(fn)
+
+
+def _dispatch():
+    global _dispatching
+    while True:
+        try:
+            fn = _posted.get_nowait()
+        except queue.Empty:
+            break
+        # a failing callback mustn't take the timer (and every callback after it) down with it
+        try:
+            fn()
+        except Exception:
+            traceback.print_exc()
+
+    if _waiters:
+        return DISPATCH_INTERVAL
+    _dispatching = False
+    return None
+
+
+def _ensure_dispatch():
+    global _dispatching
+    if not _dispatching and not bpy.app.background:
+        _dispatching = True
+        bpy.app.timers.register(_dispatch, first_interval=DISPATCH_INTERVAL)
+
+
+def _subscribe(event: str, waiter):
+    subscribers = _subscribers.setdefault(event, set())
+    subscribers.add(waiter)
+
+    if event not in _handlers:
+        def handler(*args):
+            # render handlers run on the render thread, waiters are only touched on the main thread
+            for w in list(_subscribers.get(event, ())):
+                post(lambda w=w: w.fire(event))
+
+        _handlers[event] = handler
+        getattr(bpy.app.handlers, event).append(handler)
+
+
+def _unsubscribe(event: str, waiter):
+    subscribers = _subscribers.get(event)
+    if subscribers is None:
+        return
+    subscribers.discard(waiter)
+
+    if not subscribers:
+        del _subscribers[event]
+        handler = _handlers.pop(event)
+        getattr(bpy.app.handlers, event).remove(handler)
+
+
+class Inotify:
+    '''Minimal inotify binding which wakes waiters when files in a watched directory change.'''
+
+    IN_MODIFY = 0x002
+    IN_CLOSE_WRITE = 0x008
+    IN_MOVED_TO = 0x080
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    HEADER = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+        self.lock = threading.Lock()
+        self.watches = {}  # wd -> set of waiters
+        self.paths = {}  # directory -> wd
+
+        threading.Thread(target=self.run, name="butler-inotify", daemon=True).start()
+
+    def add(self, directory: str, waiter):
+        with self.lock:
+            wd = self.paths.get(directory)
+            if wd is None:
+                wd = self.libc.inotify_add_watch(self.fd, os.fsencode(directory), self.MASK)
+                if wd < 0:
+                    return False
+                self.paths[directory] = wd
+            self.watches.setdefault(wd, set()).add(waiter)
+        return True
+
+    def remove(self, directory: str, waiter):
+        with self.lock:
+            wd = self.paths.get(directory)
+            if wd is None:
+                return
+            waiters = self.watches.get(wd, set())
+            waiters.discard(waiter)
+            if not waiters:
+                self.watches.pop(wd, None)
+                del self.paths[directory]
+                self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except OSError:
+                return
+
+            woken = set()
+            offset = 0
+            while offset < len(data):
+                wd, mask, cookie, length = self.HEADER.unpack_from(data, offset)
+                offset += self.HEADER.size + length
+                with self.lock:
+                    woken.update(self.watches.get(wd, ()))
+
+            for waiter in woken:
+                post(waiter.wake)
+
+
+_inotify = None
+_inotify_failed = False
+
+
+def inotify() -> Optional[Inotify]:
+    global _inotify, _inotify_failed
+    if _inotify is None and not _inotify_failed and sys.platform.startswith("linux"):
+        try:
+            _inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            print(f"inotify unavailable, falling back to polling ({e})")
+            _inotify_failed = True
+    return _inotify
+
+
+def watched_directory(path: str) -> Optional[str]:
+    '''Returns the closest existing directory that will see changes to `path`.'''
+    directory = path if os.path.isdir(path) else os.path.dirname(path)
+    while directory and not os.path.isdir(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    return directory or None
+
+
+class Waiter:
+    '''Calls `done` once `check` returns True or one of the subscribed events fires.'''
+
+    def __init__(self, done: Callable[[], Any], check: Optional[Callable[[], bool]],
+                 events: Iterable[str], paths: Iterable[str], interval: float, min_interval: float):
+        self.done = done
+        self.check = check
+        self.events = tuple(events)
+        self.directories = set()
+        self.paths = tuple(paths)
+        self.interval = min_interval
+        self.max_interval = interval
+        self.finished = False
+        # when `run_until` polls next, in background mode
+        self.next_poll = 0.0
+
+    def start(self):
+        _waiters.add(self)
+        _ensure_dispatch()
+
+        for event in self.events:
+            _subscribe(event, self)
+
+        watcher = inotify()
+        if watcher is not None:
+            for path in self.paths:
+                directory = watched_directory(bpy.path.abspath(path))
+                if directory is not None and watcher.add(directory, self):
+                    self.directories.add(directory)
+
+        if bpy.app.background:
+            self.next_poll = time.monotonic() + self.interval
+        else:
+            bpy.app.timers.register(self.poll, first_interval=self.interval)
+
+    def notify(self):
+        '''Re-evaluates the check soon. Safe to call from any thread.'''
+        post(self.wake)
+
+    def wake(self):
+        if not self.finished and (self.check is None or self.check()):
+            self.finish()
+
+    def fire(self, event: str):
+        if not self.finished:
+            print(f"Received {event}")
+            self.finish()
+
+    def poll(self):
+        if self.finished:
+            return None
+
+        if self.check is not None and self.check():
+            self.finish()
+            return None
+
+        self.interval = min(self.interval * 1.5, self.max_interval)
+        return self.interval
+
+    def cancel(self):
+        if self.finished:
+            return
+        self.finished = True
+        _waiters.discard(self)
+
+        for event in self.events:
+            _unsubscribe(event, self)
+
+        watcher = inotify()
+        if watcher is not None:
+            for directory in self.directories:
+                watcher.remove(directory, self)
+        self.directories.clear()
+
+    def finish(self):
+        self.cancel()
+        self.done()
+
+
+def wait(done: Callable[[], Any], check: Optional[Callable[[], bool]] = None,
+         events: Iterable[str] = (), paths: Iterable[str] = (), interval=0.5, min_interval=0.05) -> Waiter:
+    '''Calls `done` on the main thread as soon as `check` returns True or any of `events` fires.
+    The check is evaluated whenever a file in one of `paths` changes, and otherwise by polling
+    which starts at `min_interval` and backs off up to `interval` seconds.'''
+    waiter = Waiter(done, check, events, paths, interval, min_interval)
+    waiter.start()
+    return waiter
+
+
+def written_since(filepath: str, timestamp=None) -> Callable[[], bool]:
+    '''Returns a check for whether `filepath` has been written after `timestamp` (default: now).'''
+    if timestamp is None:
+        timestamp = datetime.datetime.now().timestamp()
+
+    def check():
+        try:
+            return os.stat(filepath).st_mtime >= timestamp
+        except OSError:
+            return False
+
+    return check
+
+
+def wait_for_file(filepath: str, done: Callable[[], Any], events: Iterable[str] = (), **kwargs) -> Waiter:
+    '''Calls `done` once `filepath` has been written (or one of `events` fires).'''
+    return wait(done, written_since(filepath), events=events, paths=[filepath], **kwargs)
+
+
+def run_until(predicate: Callable[[], bool], timeout: Optional[float] = None) -> bool:
+    '''Does the work of Blender's timers where they don't run (background mode): runs posted
+    callbacks and polls waiters until `predicate` returns True. Returns False on timeout, or once
+    nothing is left that could make the predicate come true.'''
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while not predicate():
+        _dispatch()
+        now = time.monotonic()
+        for waiter in list(_waiters):
+            if not waiter.finished and now >= waiter.next_poll:
+                interval = waiter.poll()
+                if interval is not None:
+                    waiter.next_poll = now + interval
+
+        if predicate():
+            break
+        if not _waiters and _posted.empty():
+            return False
+        if deadline is not None and now >= deadline:
+            return False
+
+        polls = [w.next_poll for w in _waiters if not w.finished]
+        wait = min(polls, default=now + DISPATCH_INTERVAL) - time.monotonic()
+        time.sleep(min(max(wait, 0.0), DISPATCH_INTERVAL))
+    return True
@@ -0,0 +1,85 @@
+# Exports flows to JSON and imports them again, e.g. to submit a flow to a render
+# node without opening the UI (see cli.py):
+#
+#   {"version": 1, "flows": [{"name": "Final", "concurrency": 2, "actions": [{"action_type": "RENDER", ...}]}]}
+#
+# Every property of a flow and its actions is written, properties missing from
+# the JSON keep their defaults.
+
+import json
+from typing import List
+
+VERSION = 1
+VALUE_TYPES = {"BOOLEAN", "INT", "FLOAT", "STRING", "ENUM"}
+
+
+def to_dict(group) -> dict:
+    '''Returns the properties of a PropertyGroup, with collections of groups as lists.'''
+    data = {}
+    for prop in group.bl_rna.properties:
+        key = prop.identifier
+        if key == "rna_type" or prop.is_readonly and prop.type != "COLLECTION":
+            continue
+        value = getattr(group, key)
+        if prop.type == "COLLECTION":
+            data[key] = [to_dict(item) for item in value]
+        elif prop.type in VALUE_TYPES:
+            if prop.type == "ENUM" and prop.is_enum_flag:
+                value = sorted(value)
+            elif getattr(prop, "is_array", False):
+                value = list(value)
+            data[key] = value
+    return data
+
+
+def from_dict(group, data: dict, path=""):
+    '''Sets the properties of a PropertyGroup from `to_dict` output. Returns warnings about values that didn't fit.'''
+    warnings = []
+    props = group.bl_rna.properties
+    # types first, the items of other enums can depend on them
+    for key in sorted(data, key=lambda k: not k.endswith("_type")):
+        value = data[key]
+        prop = props.get(key)
+        if prop is None or key == "rna_type":
+            warnings.append(f"{path}{key}: unknown property")
+            continue
+        try:
+            if prop.type == "COLLECTION":
+                collection = getattr(group, key)
+                collection.clear()
+                for i, item in enumerate(value):
+                    warnings += from_dict(collection.add(), item, f"{path}{key}[{i}].")
+            elif prop.type == "ENUM" and prop.is_enum_flag:
+                setattr(group, key, set(value))
+            else:
+                setattr(group, key, value)
+        except (TypeError, ValueError, AttributeError) as e:
+            warnings.append(f"{path}{key}: {e}")
+    return warnings
+
+
+def export_flows(flows) -> str:
+    return json.dumps({"version": VERSION, "flows": [to_dict(flow) for flow in flows]}, indent=2)
+
+
+def import_flows(settings, text: str) -> List[str]:
+    '''Adds the flows in `text` to `settings`, replacing flows with the same name.
+    Returns warnings, raises ValueError if `text` isn't a flow export.'''
+    data = json.loads(text)
+    if not isinstance(data, dict) or not isinstance(data.get("flows"), list):
+        raise ValueError("Not a Butler flow export")
+    version = data.get("version", VERSION)
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ValueError(f"Invalid flow export version {version!r}")
+    if version > VERSION:
+        raise ValueError(f"Flow export version {version} is newer than this addon")
+
+    warnings = []
+    for i, flow in enumerate(data["flows"]):
+        if not isinstance(flow, dict):
+            raise ValueError(f"Flow {i} isn't an object")
+        name = flow.get("name")
+        existing = next((f for f in settings.flows if f.name == name), None) if name else None
+        target = existing if existing is not None else settings.flows.add()
+        warnings += from_dict(target, flow, f"{name or i}: ")
+    return warnings
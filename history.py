@@ -0,0 +1,116 @@
+# Remembers how long actions took, so flows can be scheduled and reported on by
+# expected duration instead of by action count. Runs are appended to a JSON lines
+# file; durations are predicted per frame, from earlier runs of the same action
+# if there are any, otherwise from all runs of the same kind of action.
+
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+HISTORY_PATH = os.path.join(os.path.expanduser("~"), ".blender_butler", "history.jsonl")
+MAX_RUNS = 5000
+RECENT_RUNS = 10
+
+# seconds per frame (or per run for operators) when there's no history yet
+DEFAULT_RATES = {
+    "RENDER": 10.0,
+    "BAKE": 2.0,
+}
+DEFAULT_RATE = 1.0
+
+
+def base_kind(kind: str) -> str:
+    return kind.split(":", 1)[0]
+
+
+class RunHistory:
+    def __init__(self, path=HISTORY_PATH, max_runs=MAX_RUNS):
+        self.path = path
+        self.max_runs = max_runs
+        self.runs: List[dict] = []
+        self.by_action: Dict[str, List[dict]] = {}
+        self.by_kind: Dict[str, List[dict]] = {}
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self.add(json.loads(line))
+                    except (ValueError, KeyError):
+                        # torn write of the last line
+                        continue
+        except OSError:
+            pass
+
+    def add(self, run: dict):
+        self.runs.append(run)
+        self.by_action.setdefault(run["action"], []).append(run)
+        self.by_kind.setdefault(run["kind"], []).append(run)
+
+    def record(self, action: str, kind: str, seconds: float, frames: int, scale=1.0, params=None):
+        '''Stores a finished run. `scale` is how much work a single frame is (e.g. megapixel samples).'''
+        run = {
+            "action": action,
+            "kind": kind,
+            "seconds": round(seconds, 3),
+            "frames": frames,
+            "scale": scale,
+            "params": params or {},
+            "time": time.time(),
+        }
+        self.add(run)
+
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            if len(self.runs) > self.max_runs * 2:
+                self.compact()
+            else:
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(run) + "\n")
+        except OSError as e:
+            print(f"Couldn't save the run history ({e})")
+
+    def compact(self):
+        '''Drops all but the newest `max_runs` runs.'''
+        runs = self.runs[-self.max_runs:]
+        self.runs = []
+        self.by_action = {}
+        self.by_kind = {}
+        for run in runs:
+            self.add(run)
+
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            for run in runs:
+                f.write(json.dumps(run) + "\n")
+        os.replace(tmp, self.path)
+
+    @staticmethod
+    def rate(runs: List[dict], scaled: bool) -> Optional[float]:
+        '''Average seconds per frame (per unit of work if `scaled`) of the most recent runs.'''
+        seconds = 0.0
+        work = 0.0
+        for run in runs[-RECENT_RUNS:]:
+            frames = max(run["frames"], 1)
+            seconds += run["seconds"]
+            work += frames * run["scale"] if scaled else frames
+        return seconds / work if work else None
+
+    def predict(self, action: str, kind: str, frames: int, scale=1.0, params=None) -> float:
+        '''Expected duration in seconds of a run with `frames` frames.'''
+        frames = max(frames, 1)
+
+        # earlier runs of this very action with the same settings are the best guess
+        same = [r for r in self.by_action.get(action, ()) if r["kind"] == kind and r["params"] == (params or {})]
+        rate = self.rate(same, scaled=False)
+        if rate is not None:
+            return rate * frames
+
+        rate = self.rate(self.by_kind.get(kind, []), scaled=True)
+        if rate is not None:
+            return rate * frames * scale
+
+        return DEFAULT_RATES.get(base_kind(kind), DEFAULT_RATE) * frames
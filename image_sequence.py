@@ -0,0 +1,119 @@
+# Verifies the image sequences written by dynamic paint bakes frame by frame, so a
+# bake that crashed halfway (missing, empty or truncated files) isn't mistaken
+# for a finished one. Results are kept in a manifest next to the images and only
+# files whose size or mtime changed get checked again.
+
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set, Tuple
+
+from .manifest import to_ranges
+
+MANIFEST_NAME = ".butler_paint_manifest.json"
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_TRAILER = b"IEND\xaeB`\x82"
+EXR_MAGIC = b"\x76\x2f\x31\x01"
+
+MAX_THREADS = min(32, (os.cpu_count() or 1) * 4)
+
+
+def check_image(path: str, ext: str) -> bool:
+    '''Checks that the image at `path` exists and starts (and for PNG, ends) like one.'''
+    try:
+        with open(path, "rb") as f:
+            if ext == ".png":
+                if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+                    return False
+                # a truncated write is missing the closing IEND chunk
+                f.seek(-len(PNG_TRAILER), os.SEEK_END)
+                return f.read() == PNG_TRAILER
+            return f.read(len(EXR_MAGIC)) == EXR_MAGIC
+    except OSError:
+        return False
+
+
+class ImageSequence:
+    '''The frames `start` - `end` of the outputs `names` in `directory`.'''
+
+    def __init__(self, directory: str, names: List[str], ext: str, start: int, end: int):
+        self.directory = directory
+        self.names = names
+        self.ext = ext
+        self.start = start
+        self.end = end
+        self.path = os.path.join(directory, MANIFEST_NAME)
+
+    def frame_path(self, name: str, frame: int) -> str:
+        return os.path.join(self.directory, f"{name}{frame:04d}{self.ext}")
+
+    def load(self) -> Dict[str, list]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)["files"]
+        except (OSError, ValueError, KeyError):
+            return {}
+
+    def save(self, files: Dict[str, list]):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"files": files}, f)
+        os.replace(tmp, self.path)
+
+    def verify(self) -> Set[int]:
+        '''Returns the frames where at least one output is missing or broken.'''
+        known = self.load()
+        files = {}
+        invalid = set()
+        unchecked = []  # (frame, path, stat)
+
+        for frame in range(self.start, self.end + 1):
+            for name in self.names:
+                path = self.frame_path(name, frame)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    invalid.add(frame)
+                    continue
+                if st.st_size == 0:
+                    invalid.add(frame)
+                    continue
+
+                file = os.path.basename(path)
+                entry = known.get(file)
+                if entry is not None and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+                    files[file] = entry
+                    if not entry[2]:
+                        invalid.add(frame)
+                else:
+                    unchecked.append((frame, path, st))
+
+        if unchecked:
+            # reading headers is I/O bound, so threads pay off on network drives
+            with ThreadPoolExecutor(max_workers=MAX_THREADS) as pool:
+                results = pool.map(lambda u: check_image(u[1], self.ext), unchecked)
+                for (frame, path, st), valid in zip(unchecked, results):
+                    files[os.path.basename(path)] = [st.st_size, st.st_mtime_ns, valid]
+                    if not valid:
+                        invalid.add(frame)
+
+        if files != known:
+            try:
+                self.save(files)
+            except OSError as e:
+                print(f"Couldn't save the image sequence manifest ({e})")
+        return invalid
+
+    def invalid_ranges(self) -> List[Tuple[int, int]]:
+        return to_ranges(sorted(self.verify()))
+
+
+def from_surface(surface, abspath) -> ImageSequence:
+    '''The image sequence a dynamic paint surface in "Image Sequence" mode writes.'''
+    names = []
+    if surface.use_output_a: names.append(surface.output_name_a)
+    if surface.use_output_b: names.append(surface.output_name_b)
+    ext = ".png" if surface.image_fileformat == "PNG" else ".exr"
+    return ImageSequence(abspath(surface.image_output_path), names, ext, surface.frame_start, surface.frame_end)
@@ -1,29 +1,265 @@
-from os import path
+# Mails notifications (e.g. "flow finished") from a background thread, so sending
+# never blocks Blender's main thread or a running flow. Notifications arriving
+# within a few seconds of each other go out as one digest mail. The SMTP
+# connection is kept open between mails and re-established when the server
+# dropped it.
+#
+# Settings are read from ~/.blender_butler/mail.json, so credentials never end
+# up in .blend files:
+#
+#   {"host": "smtp.gmail.com", "port": 465, "security": "SSL",
+#    "username": "me@gmail.com", "password": "app password", "to": ["me@gmail.com"]}
+#
+# "security" is one of SSL, STARTTLS or NONE. Without a username there's no login,
+# e.g. for a local relay or a test server.
 
-from smtplib import SMTP_SSL as SMTP
+import html
+import json
+import os
+import smtplib
+import threading
+import time
 from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+from typing import List, Optional
+
+CONFIG_PATH = os.path.join(os.path.expanduser("~"), ".blender_butler", "mail.json")
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "mail.html")
 
 SMTPserver = "smtp.gmail.com"
 sender = "Blender Butler"
 
-def send_email(subject, content, username, password):
-    dir = path.dirname(__file__)
-    p = path.join(dir, "mail.html")
+_template = None
+
+
+def template() -> str:
+    '''mail.html, read once.'''
+    global _template
+    if _template is None:
+        with open(TEMPLATE_PATH) as f:
+            _template = f.read()
+    return _template
+
+
+def render(content: str) -> str:
+    return template().replace("$CONTENT", content, 1)
+
+
+class MailConfig:
+    def __init__(self, host=SMTPserver, port=None, security="SSL", username="", password="",
+                 sender=sender, to=None, timeout=10.0):
+        self.host = host
+        self.security = security.upper()
+        self.port = port or {"SSL": 465, "STARTTLS": 587}.get(self.security, 25)
+        self.username = username
+        self.password = password
+        self.sender = sender
+        self.to = to or ([username] if username else [])
+        self.timeout = timeout
+
+    @staticmethod
+    def load(path=CONFIG_PATH) -> Optional["MailConfig"]:
+        '''Returns the settings in `path`, or None if mails aren't set up.'''
+        try:
+            with open(path) as f:
+                config = json.load(f)
+            if isinstance(config.get("to"), str):
+                config["to"] = [config["to"]]
+            return MailConfig(**config)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Invalid mail settings in {path} ({e})")
+            return None
 
-    with open(p) as f:
-        html = f.read().replace("$CONTENT", content, 1)
+    @property
+    def address(self):
+        return self.username if "@" in self.username else (self.to[0] if self.to else "butler@localhost")
 
-    msg = MIMEText(html, "html")
+
+def message(config: MailConfig, subject: str, content: str) -> MIMEText:
+    msg = MIMEText(render(content), "html")
     msg["Subject"] = subject
-    msg["From"] = sender
+    msg["From"] = f"{config.sender} <{config.address}>"
+    msg["To"] = ", ".join(config.to)
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid(domain="blender-butler")
+    return msg
+
+
+class Notification:
+    def __init__(self, subject: str, content: str):
+        self.subject = subject
+        self.content = content
+        self.time = time.time()
+
+
+def digest(notifications: List[Notification]):
+    '''Returns (subject, content) of one mail covering every notification.'''
+    if len(notifications) == 1:
+        return notifications[0].subject, notifications[0].content
+
+    subject = f"{len(notifications)} Butler notifications"
+    items = "".join(
+        f"<li><b>{html.escape(n.subject)}</b> ({time.strftime('%H:%M', time.localtime(n.time))})<br>{n.content}</li>"
+        for n in notifications)
+    return subject, f"<ul style=\"padding-left: 20px;\">{items}</ul>"
+
+
+class Notifier:
+    '''Queues notifications and mails them in digests of everything that arrived within `digest_delay` seconds.'''
 
-    address = username + "@gmail.com"
+    def __init__(self, config: MailConfig, digest_delay=10.0, max_pending=100, idle_timeout=120.0,
+                 min_backoff=5.0, max_backoff=300.0, max_attempts=5):
+        self.config = config
+        self.digest_delay = digest_delay
+        self.max_pending = max_pending
+        # servers drop idle connections anyway, this closes them politely first
+        self.idle_timeout = idle_timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
 
-    conn = SMTP(SMTPserver)
-    conn.set_debuglevel(False)
-    conn.login(username, password)
+        self.lock = threading.Lock()
+        self.pending: List[Notification] = []
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.connection = None
+        self.last_used = 0.0
+        self.sent = 0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="butler-mail", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2.0):
+        '''Stops the sender, trying to deliver what's still pending within `timeout` seconds.'''
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def notify(self, subject: str, content: str):
+        '''Queues a notification. Never blocks.'''
+        with self.lock:
+            self.pending.append(Notification(subject, content))
+            if len(self.pending) > self.max_pending:
+                dropped = self.pending.pop(0)
+                print(f"Too many unsent notifications, dropped \"{dropped.subject}\"")
+        self.wake.set()
+
+    def take(self) -> List[Notification]:
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        return pending
+
+    def requeue(self, notifications: List[Notification]):
+        with self.lock:
+            self.pending[:0] = notifications
+            del self.pending[self.max_pending:]
+
+    def connect(self):
+        c = self.config
+        if c.security == "SSL":
+            connection = smtplib.SMTP_SSL(c.host, c.port, timeout=c.timeout)
+        else:
+            connection = smtplib.SMTP(c.host, c.port, timeout=c.timeout)
+            if c.security == "STARTTLS":
+                connection.starttls()
+        if c.username:
+            connection.login(c.username, c.password)
+        return connection
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.quit()
+            except (smtplib.SMTPException, OSError):
+                self.connection.close()
+            self.connection = None
+
+    def deliver(self, msg: MIMEText):
+        if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+            self.close()
+
+        # a kept connection may have been dropped by the server since, that's worth one retry
+        for reused in (self.connection is not None, False):
+            if self.connection is None:
+                self.connection = self.connect()
+            try:
+                self.connection.sendmail(self.config.address, self.config.to, msg.as_string())
+                self.last_used = time.monotonic()
+                return
+            except (smtplib.SMTPServerDisconnected, smtplib.SMTPSenderRefused, OSError):
+                self.connection.close()
+                self.connection = None
+                if not reused:
+                    raise
+
+    def send(self, notifications: List[Notification]) -> bool:
+        subject, content = digest(notifications)
+        try:
+            self.deliver(message(self.config, subject, content))
+        except (smtplib.SMTPException, OSError) as e:
+            print(f"Couldn't send mail \"{subject}\" ({e.__class__.__name__}: {e})")
+            return False
+        self.sent += 1
+        print(f"Sent mail \"{subject}\"")
+        return True
+
+    def run(self):
+        backoff = self.min_backoff
+        attempts = 0
+        try:
+            while True:
+                # idle connections get closed once they've timed out
+                self.wake.wait(self.idle_timeout if self.connection is not None else None)
+                self.wake.clear()
+                if self.connection is not None and time.monotonic() - self.last_used > self.idle_timeout:
+                    self.close()
+
+                if self.pending and not self.stopping.is_set():
+                    # collects notifications arriving shortly after the first one into one digest
+                    self.stopping.wait(self.digest_delay)
+
+                notifications = self.take()
+                if notifications:
+                    if self.send(notifications):
+                        backoff = self.min_backoff
+                        attempts = 0
+                    else:
+                        attempts += 1
+                        if attempts >= self.max_attempts:
+                            print(f"Giving up on {len(notifications)} notifications")
+                            attempts = 0
+                        else:
+                            self.requeue(notifications)
+                        if self.stopping.is_set():
+                            return
+                        self.stopping.wait(backoff)
+                        backoff = min(backoff * 2, self.max_backoff)
+                        self.wake.set()
+                        continue
+
+                if self.stopping.is_set():
+                    return
+        finally:
+            self.close()
+
+
+def send_email(subject, content, username, password):
+    '''Sends a single mail right away, blocking until it's sent. Prefer a Notifier.'''
+    config = MailConfig(username=username, password=password,
+                        to=[username if "@" in username else username + "@gmail.com"])
+    notifier = Notifier(config)
     try:
-        conn.sendmail(address, [address], msg.as_string())
-        print("sned")
+        notifier.send([Notification(subject, content)])
     finally:
-        conn.quit()
+        notifier.close()
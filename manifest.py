@@ -0,0 +1,152 @@
+# Keeps track of which frames of a render are already on disk, so a flow that
+# gets re-run (e.g. after a crash) only renders the frames that are missing.
+
+import datetime
+import hashlib
+import json
+import os
+from typing import List, Tuple
+
+import bpy
+
+MANIFEST_NAME = ".butler_manifest.json"
+
+
+def blend_state():
+    '''Size and mtime of the saved .blend, which change whenever the scene content does.
+    Unsaved changes don't show up here.'''
+    try:
+        st = os.stat(bpy.data.filepath)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def fingerprint(scene) -> str:
+    '''Hashes the settings and the saved file that influence what a rendered frame looks like.'''
+    r = scene.render
+    inputs = {
+        "blend": blend_state(),
+        "scene": scene.name,
+        "camera": scene.camera.name if scene.camera else None,
+        "engine": r.engine,
+        "resolution": [r.resolution_x, r.resolution_y, r.resolution_percentage],
+        "filepath": r.filepath,
+        "format": [r.image_settings.file_format, r.image_settings.color_mode, r.image_settings.color_depth],
+        "view_layers": [v.name for v in scene.view_layers if v.use],
+    }
+    if r.engine == "CYCLES":
+        inputs["samples"] = scene.cycles.samples
+    elif hasattr(scene, "eevee"):
+        inputs["samples"] = scene.eevee.taa_render_samples
+
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+def to_ranges(frames: List[int]) -> List[Tuple[int, int]]:
+    '''Groups sorted frame numbers into inclusive ranges.'''
+    ranges = []
+    for f in frames:
+        if ranges and ranges[-1][1] == f - 1:
+            ranges[-1] = (ranges[-1][0], f)
+        else:
+            ranges.append((f, f))
+    return ranges
+
+
+class RenderManifest:
+    '''Stores path, size, mtime and inputs fingerprint of every rendered frame
+    next to the render output.'''
+
+    def __init__(self, scene, start: int, end: int):
+        self.scene = scene
+        self.start = start
+        self.end = end
+        self.fingerprint = fingerprint(scene)
+        self.path = os.path.join(os.path.dirname(self.frame_path(start)), MANIFEST_NAME)
+        self.data = self.load()
+
+    def frame_path(self, frame: int) -> str:
+        return self.scene.render.frame_path(frame=frame)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"frames": {}}
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp, self.path)
+
+    def is_valid(self, frame: int) -> bool:
+        path = self.frame_path(frame)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return False
+
+        if st.st_size == 0:
+            return False
+
+        entry = self.data["frames"].get(path)
+        if entry is not None:
+            return entry["fingerprint"] == self.fingerprint and \
+                entry["size"] == st.st_size and entry["mtime"] == st.st_mtime
+
+        # frames written by a run that never got to record them (crashed or cancelled)
+        run = self.data.get("run")
+        return run is not None and run["fingerprint"] == self.fingerprint and st.st_mtime >= run["started"]
+
+    def missing_ranges(self) -> List[Tuple[int, int]]:
+        '''Returns the sub-ranges of frames which are missing or stale.'''
+        return to_ranges([f for f in range(self.start, self.end + 1) if not self.is_valid(f)])
+
+    def begin(self):
+        '''Remembers that a render with the current inputs has started.'''
+        started = datetime.datetime.now().timestamp()
+
+        # an interrupted run with the same inputs still vouches for its frames
+        run = self.data.get("run")
+        if run is not None and run["fingerprint"] == self.fingerprint:
+            started = min(started, run["started"])
+
+        self.data["run"] = {
+            "fingerprint": self.fingerprint,
+            "started": started,
+        }
+        self.save()
+
+    def record(self):
+        '''Stores every frame of the range that is on disk now.'''
+        frames = self.data["frames"]
+        started = self.data.get("run", {}).get("started", 0)
+
+        for frame in range(self.start, self.end + 1):
+            path = self.frame_path(frame)
+            try:
+                st = os.stat(path)
+            except OSError:
+                frames.pop(path, None)
+                continue
+
+            entry = frames.get(path)
+            if entry is not None and entry["size"] == st.st_size and entry["mtime"] == st.st_mtime:
+                continue
+            if st.st_mtime < started:
+                # left over from an older render, not written by this run
+                continue
+
+            frames[path] = {
+                "frame": frame,
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "fingerprint": self.fingerprint,
+            }
+
+        self.data.pop("run", None)
+        self.save()
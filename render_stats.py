@@ -0,0 +1,85 @@
+# Follows a render frame by frame, so its progress and slow frames show up on the
+# daemon while it's still running instead of only after the last frame is done.
+
+import collections
+import heapq
+import time
+from typing import Any, Callable, List, Tuple
+
+import bpy
+
+
+class FrameStats:
+    '''Rolling frame time statistics of a render of `total` frames.'''
+
+    def __init__(self, total: int, window=50, slowest=3):
+        self.total = total
+        self.done = 0
+        self.times = collections.deque(maxlen=window)
+        self.keep = slowest
+        self.slowest: List[Tuple[float, int]] = []  # min heap of (seconds, frame)
+
+    def add(self, frame: int, seconds: float):
+        self.done += 1
+        self.times.append(seconds)
+        if len(self.slowest) < self.keep:
+            heapq.heappush(self.slowest, (seconds, frame))
+        elif seconds > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (seconds, frame))
+
+    def skip(self):
+        '''Counts a frame that was done without being timed.'''
+        self.done += 1
+
+    @property
+    def mean(self):
+        return sum(self.times) / len(self.times) if self.times else 0.0
+
+    @property
+    def p95(self):
+        if not self.times:
+            return 0.0
+        ordered = sorted(self.times)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def progress(self):
+        return min(1.0, self.done / self.total) if self.total else 1.0
+
+    def summary(self):
+        text = f"Frame {self.done}/{self.total}"
+        if self.times:
+            text += f", {self.mean:.1f}s per frame (p95 {self.p95:.1f}s)"
+        if self.slowest:
+            slowest = sorted(self.slowest, reverse=True)
+            text += ", slowest: " + ", ".join(f"{frame} ({seconds:.1f}s)" for seconds, frame in slowest)
+        return text
+
+
+class RenderMonitor:
+    '''Times every frame rendered in this session through the render_pre/render_post handlers.
+    `report(stats)` is called after each frame, from the render thread.'''
+
+    def __init__(self, stats: FrameStats, report: Callable[[FrameStats], Any]):
+        self.stats = stats
+        self.report = report
+        self.frame_started = None
+
+    def on_render_pre(self, scene, *args):
+        self.frame_started = time.monotonic()
+
+    def on_render_post(self, scene, *args):
+        if self.frame_started is None:
+            return
+        self.stats.add(scene.frame_current, time.monotonic() - self.frame_started)
+        self.frame_started = None
+        self.report(self.stats)
+
+    def start(self):
+        bpy.app.handlers.render_pre.append(self.on_render_pre)
+        bpy.app.handlers.render_post.append(self.on_render_post)
+
+    def stop(self):
+        for handlers, fn in ((bpy.app.handlers.render_pre, self.on_render_pre),
+                             (bpy.app.handlers.render_post, self.on_render_post)):
+            if fn in handlers:
+                handlers.remove(fn)
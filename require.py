@@ -1,34 +1,103 @@
 # Allows you to "require"/install any pip module at runtime.
 # Fortunately, Blender comes with Python and pip, so this can be called by addons.
+#
+# Checking is cheap: modules are looked up without importing them, and once they
+# were all found, that's remembered in a stamp file until the Python installation
+# or sys.path changes. Installing blocks, so call `require` off the UI thread.
+# Wheels in the addon's "wheels" directory are preferred over the package index.
 
-
-import importlib
+import hashlib
+import importlib.util
+import json
+import os
 import subprocess
 import sys
 
+STAMP = os.path.join(os.path.expanduser("~"), ".blender_butler", "require-stamp.json")
+WHEELHOUSE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "wheels")
+
 def find_python():
     return sys.executable
 
 python = find_python()
 has_pip = False
 
+def environment_key():
+    '''Changes whenever modules could have been added to or removed from the import path.'''
+    entries = []
+    for path in sys.path:
+        try:
+            entries.append((path, os.stat(path).st_mtime_ns))
+        except OSError:
+            entries.append((path, None))
+    data = json.dumps([sys.version, python, entries])
+    return hashlib.sha1(data.encode()).hexdigest()
+
+def read_stamp():
+    try:
+        with open(STAMP) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def write_stamp(key, modules):
+    try:
+        os.makedirs(os.path.dirname(STAMP), exist_ok=True)
+        tmp = STAMP + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"key": key, "modules": sorted(modules)}, f)
+        os.replace(tmp, STAMP)
+    except OSError as e:
+        print(f"Couldn't write {STAMP} ({e})")
+
+def is_installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
+
 def ensure_pip():
     global has_pip
     if not has_pip:
-        print("Looking for pip")
-        subprocess.call([python, "-m", "ensurepip"], shell=True)
+        if not is_installed("pip"):
+            print("Looking for pip")
+            subprocess.run([python, "-m", "ensurepip"], stdout=sys.stdout, stderr=sys.stderr)
         has_pip = True
 
-def install(module):
-    print(f"Installing {module}")
-    ensure_pip()
-    subprocess.call([python, "-m", "pip", "install", module], shell=True, stdout=sys.stdout, stderr=sys.stderr)
+def install_command(*modules):
+    command = [python, "-m", "pip", "install", "--disable-pip-version-check"]
+    if os.path.isdir(WHEELHOUSE):
+        # offline, with the wheels shipped next to the addon
+        command += ["--no-index", "--find-links", WHEELHOUSE]
+    return command + list(modules)
+
+def install(*modules):
+    # one pip run resolves shared dependencies once, concurrent runs would race on site-packages
+    print("Installing " + ", ".join(modules))
+    result = subprocess.run(install_command(*modules), stdout=sys.stdout, stderr=sys.stderr)
+    return result.returncode == 0
 
 def require(modules):
-    for module in modules:
-        try:
-            importlib.import_module(module)
-            # print(f"Found module {module}")
-        except:
+    '''Installs the modules that are missing. Returns whether all of them are available.'''
+    key = environment_key()
+    stamp = read_stamp()
+    if stamp.get("key") == key and set(modules) <= set(stamp.get("modules", ())):
+        return True
+
+    missing = [module for module in modules if not is_installed(module)]
+    if missing:
+        for module in missing:
             print(f"{module} not installed!")
-            install(module)
+        ensure_pip()
+        install(*missing)
+        importlib.invalidate_caches()
+
+        missing = [module for module in missing if not is_installed(module)]
+        if missing:
+            print("Couldn't install " + ", ".join(missing))
+            return False
+        # installing touched site-packages
+        key = environment_key()
+
+    write_stamp(key, set(modules) | set(stamp.get("modules", ())) if stamp.get("key") == key else set(modules))
+    return True
@@ -0,0 +1,165 @@
+# Runs the actions of a flow as a dependency graph: every action starts as soon
+# as the actions it depends on are done, with up to `limit` actions running at once.
+
+import heapq
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+
+class Job:
+    def __init__(self, index: int, run: Callable[[Callable[[], Any]], Any], deps: Iterable[int] = (),
+                 cost=1.0, resource: Optional[str] = None):
+        self.index = index
+        self.run = run
+        self.deps = set(deps)
+        self.cost = cost
+        # jobs sharing a resource never run at the same time
+        self.resource = resource
+        self.rank = cost
+        self.state = "pending"
+        self.started = None
+
+
+class Scheduler:
+    '''Starts ready jobs (all dependencies finished, resource free) until `limit` jobs are running.
+    Dependencies must point at jobs with a lower index.'''
+
+    def __init__(self, jobs: List[Job], limit=1, on_progress: Callable[["Scheduler"], Any] = None,
+                 done: Callable[[], Any] = None):
+        self.jobs = jobs
+        self.limit = max(1, limit)
+        self.on_progress = on_progress
+        self.done = done
+        self.by_index: Dict[int, Job] = {job.index: job for job in jobs}
+        self.dependents: Dict[int, List[Job]] = {job.index: [] for job in jobs}
+        self.blockers: Dict[int, int] = {}
+        self.running = set()
+        self.locked = set()
+        self.finished = 0
+        self.pumping = False
+        self.dirty = False
+        self.complete = False
+        self.aborted = False
+
+        for job in jobs:
+            job.deps = {d for d in job.deps if d in self.by_index and d < job.index}
+            self.blockers[job.index] = len(job.deps)
+            for d in job.deps:
+                self.dependents[d].append(job)
+
+        # rank = cost of the longest chain starting at this job
+        for job in reversed(jobs):
+            job.rank = job.cost + max((j.rank for j in self.dependents[job.index]), default=0)
+
+        self.critical_path = max((job.rank for job in jobs), default=0)
+
+        # jobs whose dependencies are done, ordered by priority
+        self.ready = []
+        for job in jobs:
+            if not job.deps:
+                self.push(job)
+
+    def key(self, job: Job):
+        # with a single slot, keep the order of the flow
+        return (-job.rank, job.index) if self.limit > 1 else (job.index,)
+
+    def push(self, job: Job):
+        heapq.heappush(self.ready, (self.key(job), job.index))
+
+    def remaining(self, now: float = None) -> float:
+        '''Cost of the longest chain of jobs that still has to run, minus what running jobs got done.
+        With costs in seconds, this is the time left.'''
+        if now is None:
+            now = time.monotonic()
+
+        # the ready job with the longest chain (with a single slot, ranks fall with the index)
+        left = self.by_index[self.ready[0][1]].rank if self.ready else 0
+        for index in self.running:
+            job = self.by_index[index]
+            # a job taking longer than expected is assumed to be almost done
+            elapsed = min(now - job.started, job.cost * 0.95)
+            left = max(left, job.rank - elapsed)
+        return left
+
+    def progress(self) -> float:
+        if not self.critical_path:
+            return 1.0
+        return max(0.0, 1 - self.remaining() / self.critical_path)
+
+    def start(self):
+        self.pump()
+
+    def abort(self):
+        '''Starts no further jobs. Jobs already running still finish, but `done` is never called.'''
+        self.aborted = True
+        self.ready = []
+
+    def pump(self):
+        if self.aborted:
+            return
+        if self.pumping:
+            self.dirty = True
+            return
+
+        self.pumping = True
+        try:
+            self.dirty = True
+            while self.dirty:
+                self.dirty = False
+                self.start_ready()
+        finally:
+            self.pumping = False
+
+        if self.finished == len(self.jobs) and not self.complete:
+            self.complete = True
+            if self.done is not None:
+                self.done()
+
+    def start_ready(self):
+        blocked = []
+        while self.ready and len(self.running) < self.limit:
+            entry = heapq.heappop(self.ready)
+            job = self.by_index[entry[1]]
+            if job.resource is not None and job.resource in self.locked:
+                blocked.append(entry)
+                continue
+            self.launch(job)
+
+        for entry in blocked:
+            heapq.heappush(self.ready, entry)
+
+    def launch(self, job: Job):
+        job.state = "running"
+        job.started = time.monotonic()
+        self.running.add(job.index)
+        if job.resource is not None:
+            self.locked.add(job.resource)
+
+        if self.on_progress is not None:
+            self.on_progress(self)
+
+        called = False
+
+        def callback():
+            nonlocal called
+            if called:
+                return
+            called = True
+            self.finish(job)
+
+        job.run(callback)
+
+    def finish(self, job: Job):
+        job.state = "done"
+        self.running.discard(job.index)
+        self.locked.discard(job.resource)
+        self.finished += 1
+
+        for dependent in self.dependents[job.index]:
+            self.blockers[dependent.index] -= 1
+            if not self.blockers[dependent.index]:
+                self.push(dependent)
+
+        if self.on_progress is not None:
+            self.on_progress(self)
+        self.pump()
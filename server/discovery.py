@@ -0,0 +1,79 @@
+# Lets every Blender instance on a host find the one running daemon instead of
+# starting its own. The daemon announces itself in a lockfile with its pid and
+# port; clients confirm it's alive with a health check before attaching to it.
+
+import json
+import os
+import socket
+import sys
+
+LOCKFILE = os.path.join(os.path.expanduser("~"), ".blender_butler", "daemon.json")
+SERVICE = "blender-butler"
+
+
+def pid_alive(pid: int) -> bool:
+    if sys.platform == "win32":
+        # os.kill would terminate the process on Windows
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but belongs to someone else
+        return True
+    return True
+
+
+def read_lockfile(path=LOCKFILE):
+    '''Returns {"pid", "port", "socket"} of the running daemon, or None if there's none.
+    "socket" is the path of its Unix domain socket, None if it doesn't listen on one.'''
+    try:
+        with open(path) as f:
+            lock = json.load(f)
+        pid = int(lock["pid"])
+        port = int(lock["port"])
+        socket_path = lock.get("socket")
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        return None
+
+    if not pid_alive(pid) or not is_listening(port):
+        # left behind by a daemon that crashed (its pid might have been reused since)
+        return None
+    return {"pid": pid, "port": port, "socket": socket_path}
+
+
+def is_listening(port: int, timeout=0.5) -> bool:
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+def write_lockfile(port: int, socket_path=None, path=LOCKFILE):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w") as f:
+        json.dump({"pid": os.getpid(), "port": port, "socket": socket_path}, f)
+    os.replace(tmp, path)
+
+
+def remove_lockfile(path=LOCKFILE):
+    '''Removes the lockfile, unless another daemon has taken it over in the meantime.'''
+    try:
+        with open(path) as f:
+            if json.load(f).get("pid") != os.getpid():
+                return
+        os.remove(path)
+    except (OSError, ValueError, AttributeError):
+        pass
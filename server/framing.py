@@ -0,0 +1,44 @@
+# Message framing for the daemon's Unix domain socket: every message is a JSON
+# document prefixed with its length as a 4 byte big-endian integer. The daemon
+# answers every message with a frame of its own ({"ok": true} or an error).
+
+import json
+import struct
+
+HEADER = struct.Struct(">I")
+# progress updates are tiny, anything this big is garbage
+MAX_FRAME = 4 * 1024 * 1024
+
+
+def pack(obj) -> bytes:
+    data = json.dumps(obj, separators=(",", ":")).encode()
+    return HEADER.pack(len(data)) + data
+
+
+def unpack_length(header: bytes) -> int:
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME:
+        raise ValueError(f"Frame of {length} bytes is too large")
+    return length
+
+
+def recv_exactly(sock, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-frame")
+        data += chunk
+    return bytes(data)
+
+
+def read(sock):
+    '''Reads one frame from a blocking socket.'''
+    length = unpack_length(recv_exactly(sock, HEADER.size))
+    return json.loads(recv_exactly(sock, length))
+
+
+async def read_async(reader):
+    '''Reads one frame from an asyncio StreamReader.'''
+    length = unpack_length(await reader.readexactly(HEADER.size))
+    return json.loads(await reader.readexactly(length))
@@ -0,0 +1,210 @@
+# Work queue for distributed rendering. The addon submits the frame ranges of a
+# render as a batch of jobs; workers (server/worker.py, on this host or others)
+# lease one job at a time and keep the lease alive with heartbeats. A job whose
+# lease runs out is put back into the queue, so a worker that crashed or lost
+# its network only costs the frames it hadn't finished yet.
+
+import collections
+import itertools
+import time
+from typing import Dict, List, Optional, Tuple
+
+LEASE_TIME = 30.0
+
+
+def to_ranges(frames) -> List[Tuple[int, int]]:
+    ranges = []
+    for f in sorted(frames):
+        if ranges and ranges[-1][1] == f - 1:
+            ranges[-1] = (ranges[-1][0], f)
+        else:
+            ranges.append((f, f))
+    return ranges
+
+
+class Job:
+    def __init__(self, id: str, batch: "Batch", start: int, end: int):
+        self.id = id
+        self.batch = batch
+        self.start = start
+        self.end = end
+        self.done = set()
+        self.state = "queued"  # queued, leased, done, failed
+        self.worker = None
+        self.expires = None
+        self.attempts = 0
+        self.errors = []
+
+    @property
+    def frames(self):
+        return range(self.start, self.end + 1)
+
+    def remaining(self):
+        return [f for f in self.frames if f not in self.done]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "batch": self.batch.id,
+            "blendfile": self.batch.blendfile,
+            "scene": self.batch.scene,
+            "output": self.batch.output,
+            "ranges": to_ranges(self.remaining()),
+            "attempt": self.attempts,
+        }
+
+
+class Batch:
+    '''The jobs of one render, submitted together.'''
+
+    def __init__(self, id: str, blendfile: str, scene: str, output: str, title: str, task: str, max_attempts: int):
+        self.id = id
+        self.blendfile = blendfile
+        self.scene = scene
+        self.output = output
+        self.title = title
+        # id of the daemon task showing the progress
+        self.task = task
+        self.max_attempts = max_attempts
+        self.jobs: List[Job] = []
+
+    @property
+    def frames_total(self):
+        return sum(len(job.frames) for job in self.jobs)
+
+    @property
+    def frames_done(self):
+        return sum(len(job.done) for job in self.jobs)
+
+    @property
+    def finished(self):
+        return all(job.state in ("done", "failed") for job in self.jobs)
+
+    def status(self):
+        counts = collections.Counter(job.state for job in self.jobs)
+        return {
+            "id": self.id,
+            "title": self.title,
+            "jobs": {state: counts.get(state, 0) for state in ("queued", "leased", "done", "failed")},
+            "frames_total": self.frames_total,
+            "frames_done": self.frames_done,
+            "failed": [{"id": job.id, "frames": to_ranges(job.remaining()), "errors": job.errors}
+                       for job in self.jobs if job.state == "failed"],
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    '''Jobs are handed out first come, first served. Times are time.monotonic() seconds.'''
+
+    def __init__(self, lease_time=LEASE_TIME, clock=time.monotonic):
+        self.lease_time = lease_time
+        self.clock = clock
+        self.batches: Dict[str, Batch] = {}
+        self.jobs: Dict[str, Job] = {}
+        self.queue = collections.deque()  # queued job ids, oldest first
+        self.ids = itertools.count(1)
+        # called with a batch whenever its progress changes
+        self.on_change = lambda batch: None
+
+    def submit(self, blendfile: str, scene: str, output: str, chunks, title="", task="", max_attempts=3) -> Batch:
+        batch = Batch(f"b{next(self.ids)}", blendfile, scene, output, title, task, max(1, max_attempts))
+        for start, end in chunks:
+            job = Job(f"{batch.id}-j{next(self.ids)}", batch, int(start), int(end))
+            batch.jobs.append(job)
+            self.jobs[job.id] = job
+            self.queue.append(job.id)
+        self.batches[batch.id] = batch
+        self.on_change(batch)
+        return batch
+
+    def lease(self, worker: str, lease_time: Optional[float] = None) -> Optional[Job]:
+        '''Hands the oldest queued job to `worker`, or returns None if there's nothing to do.'''
+        while self.queue:
+            job = self.jobs.get(self.queue.popleft())
+            if job is None or job.state != "queued":
+                # cancelled in the meantime
+                continue
+            job.state = "leased"
+            job.worker = worker
+            job.attempts += 1
+            job.expires = self.clock() + (lease_time or self.lease_time)
+            self.on_change(job.batch)
+            return job
+        return None
+
+    def holder(self, job_id: str, worker: str) -> Optional[Job]:
+        '''Returns the job if `worker` still holds its lease.'''
+        job = self.jobs.get(job_id)
+        if job is None or job.state != "leased" or job.worker != worker:
+            return None
+        return job
+
+    def record(self, job: Job, frames):
+        frames = {int(f) for f in frames} & set(job.frames)
+        if not frames <= job.done:
+            job.done |= frames
+            self.on_change(job.batch)
+
+    def heartbeat(self, job_id: str, worker: str, frames=(), lease_time: Optional[float] = None) -> bool:
+        '''Extends the lease and records finished frames. False means the lease is lost, stop working on it.'''
+        job = self.holder(job_id, worker)
+        if job is None:
+            return False
+        job.expires = self.clock() + (lease_time or self.lease_time)
+        self.record(job, frames)
+        return True
+
+    def complete(self, job_id: str, worker: str, frames=()) -> bool:
+        job = self.holder(job_id, worker)
+        if job is None:
+            return False
+        self.record(job, frames)
+        if job.remaining():
+            return self.fail(job_id, worker, f"{len(job.remaining())} frames missing")
+        job.state = "done"
+        job.worker = None
+        self.on_change(job.batch)
+        return True
+
+    def fail(self, job_id: str, worker: str, error: str, frames=()) -> bool:
+        job = self.holder(job_id, worker)
+        if job is None:
+            return False
+        self.record(job, frames)
+        self.release(job, f"{worker}: {error}")
+        return True
+
+    def release(self, job: Job, error: str):
+        '''Requeues a job whose worker gave up on it, unless it's out of attempts.'''
+        job.errors.append(error)
+        job.worker = None
+        job.expires = None
+        if job.attempts >= job.batch.max_attempts:
+            job.state = "failed"
+        else:
+            job.state = "queued"
+            # the remaining frames go first, the rest of the batch is already waiting
+            self.queue.appendleft(job.id)
+        self.on_change(job.batch)
+
+    def expire(self) -> List[Job]:
+        '''Requeues the jobs whose lease ran out. Returns them.'''
+        now = self.clock()
+        expired = [job for job in self.jobs.values() if job.state == "leased" and job.expires < now]
+        for job in expired:
+            print(f"Lease of job {job.id} held by {job.worker} expired")
+            self.release(job, f"{job.worker}: lease expired")
+        return expired
+
+    def cancel(self, batch_id: str) -> bool:
+        batch = self.batches.pop(batch_id, None)
+        if batch is None:
+            return False
+        for job in batch.jobs:
+            # workers find out with their next heartbeat
+            del self.jobs[job.id]
+        return True
+
+    def counts(self):
+        return collections.Counter(job.state for job in self.jobs.values())
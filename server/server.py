@@ -1,16 +1,88 @@
 import aiohttp
 from aiohttp import web
+import argparse
 import asyncio
+import collections
 import json
+import os
+import signal
 import socket
+import sys
+import time
 
 from aiohttp.web_request import Request
 
-sockets = []
+import discovery
+import framing
+import jobs
+import metrics
+from store import TaskStore
+
+# outbound messages a client may lag behind before old ones get dropped
+CLIENT_QUEUE_SIZE = 16
+# a client that needs longer than this for a single message is evicted
+SEND_TIMEOUT = 5.0
+# same for a client that had this many messages dropped without catching up
+MAX_DROPPED = 64
+# deltas kept around for clients that reconnect
+CHANGELOG_SIZE = 1024
+# changes within one tick (seconds) go out as a single delta
+TICK = 0.05
+# how often attached Blender instances are checked for having exited
+REAP_INTERVAL = 5.0
+# a shared daemon without attached instances for this long exits, even if none ever attached
+IDLE_TIMEOUT = 60.0
+# how often leases of render jobs are checked for having run out
+LEASE_CHECK_INTERVAL = 1.0
+# bounds for the lease time a worker asks for
+MIN_LEASE, MAX_LEASE = 5.0, 600.0
+
+clients = {}
 tasks = {}
 
+# Protocol: a client gets {"type": "snapshot", "seq", "tasks"} on connect and
+# {"type": "delta", "seq", "tasks": {id: {changed fields}}} after that.
+# Reconnecting to /ws?since=<seq> only sends what was missed, if it's still in the changelog.
+seq = 0
+changelog = collections.deque(maxlen=CHANGELOG_SIZE)
+
+request_count = metrics.Counter("butler_http_requests_total", "HTTP requests handled", ["route", "method", "status"])
+request_latency = metrics.Histogram("butler_http_request_duration_seconds", "HTTP request latency", ["route"])
+broadcast_duration = metrics.Histogram("butler_broadcast_duration_seconds", "Time to serialize a delta and queue it for every client")
+broadcast_bytes = metrics.Histogram("butler_broadcast_payload_bytes", "Size of serialized broadcast payloads", buckets=metrics.BYTE_BUCKETS)
+dropped_messages = metrics.Counter("butler_dropped_messages_total", "Messages dropped for clients that couldn't keep up")
+evicted_clients = metrics.Counter("butler_evicted_clients_total", "Clients disconnected for being too slow")
+expired_leases = metrics.Counter("butler_expired_leases_total", "Render jobs requeued because their lease ran out")
+metrics.Gauge("butler_websocket_clients", "Connected websocket clients", lambda: len(clients))
+metrics.Gauge("butler_client_queue_depth", "Messages waiting in a client's send queue",
+              lambda: {(c.id,): c.queue.qsize() for c in clients.values()}, ["client"])
+metrics.Gauge("butler_tasks", "Known tasks", lambda: len(tasks))
+metrics.Gauge("butler_seq", "Sequence number of the last published delta", lambda: seq)
+metrics.Gauge("butler_attached_instances", "Blender instances attached to this daemon", lambda: len(attached))
+metrics.Gauge("butler_render_jobs", "Render jobs in the work queue",
+              lambda: {(state,): queue.counts().get(state, 0) for state in ("queued", "leased", "done", "failed")}, ["state"])
+
+# pids of the Blender instances using this daemon. A shared daemon exits once the last one is gone.
+attached = set()
+shared = False
+# the pending loop stop of a shared daemon that lost its last instance, an attach cancels it
+stop_handle = None
+# the Unix domain socket this daemon listens on, if any
+socket_file = None
+
+# journal + snapshots of the task state, None when running without persistence
+store = None
+
+# frame ranges of RENDER actions waiting for workers (see jobs.py, worker.py)
+queue = jobs.JobQueue()
+
+# changes since the last tick, per task
+pending = {}
+pending_event = None
+
 def update(id, title=None, description=None, progress=None):
-    if not id in tasks:
+    created = not id in tasks
+    if created:
         tasks[id] = {
             "title": "",
             "description": "",
@@ -19,43 +91,348 @@ def update(id, title=None, description=None, progress=None):
         }
     
     task = tasks[id]
-    if title: task["title"] = title
-    if description: task["description"] = description
-    if progress: task["progress"] = float(progress)
+    fields = {}
+    if title: fields["title"] = title
+    if description: fields["description"] = description
+    if progress is not None: fields["progress"] = float(progress)
+
+    changes = {k: v for k, v in fields.items() if task[k] != v}
+    task.update(changes)
+    if created:
+        changes = dict(task)
+    if not changes:
+        return
+
+    pending.setdefault(id, {}).update(changes)
+    if pending_event is not None:
+        pending_event.set()
 
     # print(f"Updated task {id}")
 
+def flush():
+    '''Publishes everything that changed since the last tick as one delta.'''
+    global seq, pending
+    if not pending:
+        return
+
+    start = time.perf_counter()
+    changes = pending
+    pending = {}
+    seq += 1
+    changelog.append((seq, changes))
+    if store is not None:
+        store.append(seq, changes, tasks)
+
+    payload = delta_message(seq, changes)
+    broadcast(payload)
+    broadcast_bytes.observe(len(payload))
+    broadcast_duration.observe(time.perf_counter() - start)
+
+async def broadcaster(tick):
+    global pending_event
+    pending_event = asyncio.Event()
+    while True:
+        await pending_event.wait()
+        # let the rest of the burst arrive
+        await asyncio.sleep(tick)
+        pending_event.clear()
+        flush()
+
+def delta_message(seq, changes):
+    return json.dumps({"type": "delta", "seq": seq, "tasks": changes})
+
+def snapshot_message():
+    return json.dumps({"type": "snapshot", "seq": seq, "tasks": tasks})
+
+def missed_message(since):
+    '''Returns one delta with everything after `since`, or a snapshot if the changelog doesn't reach back that far.'''
+    if since > seq:
+        # the client has seen a different server
+        return snapshot_message()
+    if since < seq and (not changelog or changelog[0][0] > since + 1):
+        return snapshot_message()
+
+    merged = {}
+    for entry_seq, changes in changelog:
+        if entry_seq > since:
+            for id, fields in changes.items():
+                merged.setdefault(id, {}).update(fields)
+    return delta_message(seq, merged)
+
+
+class Client:
+    '''A connected websocket with its own bounded send queue and writer task,
+    so a slow client never holds up the others.'''
 
-async def send_tasks():
-    for socket in sockets:
-        await socket.send_json(tasks)
+    count = 0
+
+    def __init__(self, websocket):
+        Client.count += 1
+        self.id = Client.count
+        self.websocket = websocket
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+        self.dropped = 0
+        self.writer = asyncio.ensure_future(self.write())
+
+    def send(self, payload):
+        if self.queue.full():
+            # drop to latest: skipped deltas are replaced by a snapshot taken when it's sent
+            self.dropped += self.queue.qsize()
+            dropped_messages.inc(amount=self.queue.qsize())
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.dropped > MAX_DROPPED:
+                print("Evicting client that can't keep up")
+                self.evict()
+                return
+            self.queue.put_nowait(None)
+            return
+        self.queue.put_nowait(payload)
+
+    async def write(self):
+        while True:
+            payload = await self.queue.get()
+            if payload is None:
+                payload = snapshot_message()
+            try:
+                await asyncio.wait_for(self.websocket.send_str(payload), SEND_TIMEOUT)
+            except asyncio.TimeoutError:
+                print("Evicting client that timed out")
+                self.evict()
+                return
+            except (ConnectionError, RuntimeError):
+                unregister(self.websocket)
+                return
+
+            if self.queue.empty():
+                self.dropped = 0
+
+    def evict(self):
+        evicted_clients.inc()
+        unregister(self.websocket)
+        asyncio.ensure_future(self.websocket.close())
+
+    def close(self):
+        if not self.writer.done() and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+
+def broadcast(payload):
+    for client in list(clients.values()):
+        client.send(payload)
 
 def register(websocket):
-    sockets.append(websocket)
+    client = clients[websocket] = Client(websocket)
     print("Registered")
+    return client
 
 def unregister(websocket):
-    sockets.remove(websocket)
-    print("Unregistered")
-
-async def json_update(data):
-    obj = json.loads(data)
-    for id in obj:
-        title = obj[id].get("title")
-        desc = obj[id].get("description")
-        progress = obj[id].get("progress")
+    client = clients.pop(websocket, None)
+    if client is not None:
+        client.close()
+        print("Unregistered")
+
+def update_all(obj):
+    # either {id: {fields}} or a batch [{"id": id, fields}]
+    if isinstance(obj, list):
+        items = [(item["id"], item) for item in obj]
+    else:
+        items = obj.items()
+
+    for id, fields in items:
+        title = fields.get("title")
+        desc = fields.get("description")
+        progress = fields.get("progress")
         update(id, title=title, description=desc, progress=progress)
-    await send_tasks()
+
+def json_update(data):
+    update_all(json.loads(data))
+
+@web.middleware
+async def metrics_middleware(request: Request, handler):
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else "unmatched"
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await handler(request)
+        status = response.status
+        return response
+    except web.HTTPException as e:
+        status = e.status
+        raise
+    finally:
+        request_count.inc(route, request.method, str(status))
+        request_latency.observe(time.perf_counter() - start, route)
+
+async def metrics_handler(request):
+    return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8",
+                        headers={"X-Prometheus-Format": "0.0.4"})
 
 async def http_handler(request):
     return web.Response(text="Hello, world")
 
 async def info_handler(request):
     content = {
-        "name": socket.gethostname()
+        "name": socket.gethostname(),
+        "service": discovery.SERVICE,
+        "pid": os.getpid(),
+        "attached": len(attached),
     }
     return web.Response(text=json.dumps(content))
 
+async def read_pid(request: Request):
+    try:
+        return int((await request.json())["pid"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+async def attach_handler(request: Request):
+    global stop_handle
+    pid = await read_pid(request)
+    if pid is None:
+        return web.Response(status=400, text="Invalid pid")
+
+    if stop_handle is not None:
+        stop_handle.cancel()
+        stop_handle = None
+        print("Shutdown cancelled")
+
+    attached.add(pid)
+    print(f"Blender instance {pid} attached ({len(attached)} in total)")
+    return web.json_response({"attached": len(attached)})
+
+async def detach_handler(request: Request):
+    pid = await read_pid(request)
+    if pid is None:
+        return web.Response(status=400, text="Invalid pid")
+
+    attached.discard(pid)
+    print(f"Blender instance {pid} detached ({len(attached)} left)")
+    stopping = shared and not attached
+    if stopping:
+        stop_soon()
+    return web.json_response({"attached": len(attached), "stopping": stopping})
+
+def stop_soon(reason="Last Blender instance left"):
+    global stop_handle
+    if stop_handle is not None:
+        return
+    print(f"{reason}, shutting down")
+    # lets the response to the last detach go out first
+    loop = asyncio.get_event_loop()
+    stop_handle = loop.call_later(0.2, loop.stop)
+
+async def reap_instances(interval):
+    '''Forgets Blender instances that exited without detaching (e.g. crashed), and stops
+    a shared daemon that has been without instances for IDLE_TIMEOUT seconds.'''
+    idle_since = time.monotonic()
+    while True:
+        await asyncio.sleep(interval)
+        dead = {pid for pid in attached if not discovery.pid_alive(pid)}
+        if dead:
+            attached.difference_update(dead)
+            print(f"Forgot exited Blender instances {sorted(dead)} ({len(attached)} left)")
+            if shared and not attached:
+                stop_soon()
+
+        if attached:
+            idle_since = time.monotonic()
+        elif shared and time.monotonic() - idle_since > IDLE_TIMEOUT:
+            stop_soon(f"No Blender instance attached for {IDLE_TIMEOUT:.0f}s")
+
+def publish_batch(batch: jobs.Batch):
+    '''Shows the progress of a queued render as the submitter's task.'''
+    if not batch.task:
+        return
+    counts = collections.Counter(job.state for job in batch.jobs)
+    description = f"{batch.frames_done} / {batch.frames_total} frames, {counts['leased']} workers busy"
+    if counts["failed"]:
+        description += f", {counts['failed']} jobs failed"
+    update(batch.task, title=batch.title, description=description,
+           progress=batch.frames_done / max(1, batch.frames_total))
+
+async def read_json(request: Request):
+    try:
+        body = await request.json()
+    except ValueError:
+        return None
+    return body if isinstance(body, dict) else None
+
+def lease_time(body):
+    try:
+        return min(max(float(body.get("lease", queue.lease_time)), MIN_LEASE), MAX_LEASE)
+    except (TypeError, ValueError):
+        return queue.lease_time
+
+async def submit_handler(request: Request):
+    body = await read_json(request)
+    try:
+        chunks = [(int(s), int(e)) for s, e in body["chunks"]]
+        batch = queue.submit(str(body["blendfile"]), str(body["scene"]), str(body["output"]), chunks,
+                             title=str(body.get("title", "")), task=str(body.get("task", "")),
+                             max_attempts=int(body.get("max_attempts", 3)))
+    except (TypeError, KeyError, ValueError):
+        return web.Response(status=400, text="Invalid batch")
+
+    print(f"Queued {len(batch.jobs)} render jobs of {batch.title or batch.id}")
+    return web.json_response({"batch": batch.id})
+
+async def batches_handler(request: Request):
+    return web.json_response([batch.status() for batch in queue.batches.values()])
+
+async def batch_handler(request: Request):
+    batch = queue.batches.get(request.match_info["id"])
+    if batch is None:
+        return web.Response(status=404, text="Unknown batch")
+    return web.json_response(batch.status())
+
+async def cancel_handler(request: Request):
+    if not queue.cancel(request.match_info["id"]):
+        return web.Response(status=404, text="Unknown batch")
+    return web.json_response({"ok": True})
+
+async def lease_handler(request: Request):
+    body = await read_json(request)
+    if body is None or not body.get("worker"):
+        return web.Response(status=400, text="Missing worker")
+
+    job = queue.lease(str(body["worker"]), lease_time(body))
+    if job is None:
+        return web.Response(status=204)
+    print(f"Leased {job.id} to {job.worker}")
+    return web.json_response(job.to_dict())
+
+def job_handler(method):
+    '''Handlers for the requests of the worker holding a job's lease. 409 tells it the lease is gone.'''
+    async def handler(request: Request):
+        body = await read_json(request)
+        if body is None or not body.get("worker"):
+            return web.Response(status=400, text="Missing worker")
+        try:
+            frames = [int(f) for f in body.get("frames", ())]
+        except (TypeError, ValueError):
+            return web.Response(status=400, text="Invalid frames")
+
+        id, worker = request.match_info["id"], str(body["worker"])
+        if method == "heartbeat":
+            held = queue.heartbeat(id, worker, frames, lease_time(body))
+        elif method == "complete":
+            held = queue.complete(id, worker, frames)
+        else:
+            held = queue.fail(id, worker, str(body.get("error", "")), frames)
+        if not held:
+            return web.Response(status=409, text="Lease lost")
+        return web.json_response({"ok": True})
+    return handler
+
+async def expire_leases(interval):
+    while True:
+        await asyncio.sleep(interval)
+        expired = queue.expire()
+        if expired:
+            expired_leases.inc(amount=len(expired))
+
 async def update_handler(request: Request):
     id = request.match_info["id"]
 
@@ -64,22 +441,38 @@ async def update_handler(request: Request):
         return value
     
     update(id, esc("title"), esc("description"), esc("progress"))
-    await send_tasks()
+    return web.Response(text="OK")
+
+async def bulk_update_handler(request: Request):
+    try:
+        update_all(await request.json())
+    except (ValueError, KeyError, AttributeError, TypeError):
+        return web.Response(status=400, text="Invalid update")
+
     return web.Response(text="OK")
 
 
 async def websocket_handler(request):
     ws = web.WebSocketResponse()
     await ws.prepare(request)
-    register(ws)
-    await ws.send_json(tasks)
+    client = register(ws)
+
+    try:
+        since = int(request.query["since"])
+    except (KeyError, ValueError):
+        client.send(snapshot_message())
+    else:
+        client.send(missed_message(since))
 
     async for msg in ws:
         if msg.type == aiohttp.WSMsgType.TEXT:
             if msg.data == "close":
                 await ws.close()
             else:
-                json_update(msg.data)
+                try:
+                    json_update(msg.data)
+                except (ValueError, KeyError, AttributeError, TypeError):
+                    print("Ignoring invalid update from websocket")
         elif msg.type == aiohttp.WSMsgType.ERROR:
             print("ws connection closed with exception %s" % ws.exception())
 
@@ -87,29 +480,155 @@ async def websocket_handler(request):
     return ws
 
 
+async def stream_handler(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    '''Takes framed bulk updates (see framing.py) from a local client over the Unix socket.'''
+    try:
+        while True:
+            try:
+                payload = await framing.read_async(reader)
+            except (asyncio.IncompleteReadError, ConnectionError):
+                break
+            except ValueError:
+                print("Closing socket connection that sent an invalid frame")
+                break
+
+            start = time.perf_counter()
+            try:
+                update_all(payload)
+                reply, status = {"ok": True}, 200
+            except (ValueError, KeyError, AttributeError, TypeError):
+                reply, status = {"ok": False, "error": "Invalid update"}, 400
+
+            writer.write(framing.pack(reply))
+            request_count.inc("unix", "FRAME", str(status))
+            request_latency.observe(time.perf_counter() - start, "unix")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
 def create_runner():
-    app = web.Application()
+    app = web.Application(middlewares=[metrics_middleware])
     app.add_routes([
         web.get("/",   http_handler),
         web.get("/info", info_handler),
         web.get("/update/{id}", update_handler),
+        web.post("/update", bulk_update_handler),
+        web.post("/attach", attach_handler),
+        web.post("/detach", detach_handler),
         web.get("/ws", websocket_handler),
+        web.get("/metrics", metrics_handler),
+        web.post("/batches", submit_handler),
+        web.get("/batches", batches_handler),
+        web.get("/batches/{id}", batch_handler),
+        web.delete("/batches/{id}", cancel_handler),
+        web.post("/jobs/lease", lease_handler),
+        web.post("/jobs/{id}/heartbeat", job_handler("heartbeat")),
+        web.post("/jobs/{id}/complete", job_handler("complete")),
+        web.post("/jobs/{id}/fail", job_handler("fail")),
     ])
     return web.AppRunner(app)
 
 
-async def start_server(port=2048):
+async def start_server(port=2048, tick=TICK, socket_path=None):
+    asyncio.ensure_future(broadcaster(tick))
+    asyncio.ensure_future(reap_instances(REAP_INTERVAL))
+    asyncio.ensure_future(expire_leases(LEASE_CHECK_INTERVAL))
     runner = create_runner()
     await runner.setup()
     site = web.TCPSite(runner, port=port)
     await site.start()
     print(f"Server listening on port {port}")
 
+    global socket_file
+    if socket_path is not None:
+        socket_file = await start_socket(socket_path)
+    discovery.write_lockfile(port, socket_file)
+
+
+async def start_socket(path):
+    '''Listens on a Unix domain socket as well. Returns its path, or None if that's not possible.'''
+    if not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        # left behind by a daemon that crashed, the lockfile check made sure it's not in use
+        os.remove(path)
+    except OSError:
+        pass
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        await asyncio.start_unix_server(stream_handler, path)
+        os.chmod(path, 0o600)
+    except (OSError, NotImplementedError) as e:
+        print(f"Couldn't listen on {path} ({e}), only serving TCP")
+        return None
+    print(f"Server listening on {path}")
+    return path
+
+
+def restore(directory):
+    global store, seq, tasks
+    store = TaskStore(directory)
+    seq, tasks, entries = store.load()
+    changelog.extend(entries[-CHANGELOG_SIZE:])
+    store.open(seq)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Blender Butler daemon")
+    parser.add_argument("--port", type=int, default=2048)
+    parser.add_argument("--data-dir", default=os.path.join(os.path.expanduser("~"), ".blender_butler"),
+                        help="Where the task journal and snapshots are kept")
+    parser.add_argument("--no-persist", action="store_true", help="Keep tasks in memory only")
+    parser.add_argument("--tick", type=float, default=TICK, help="Seconds of updates to coalesce into one broadcast")
+    parser.add_argument("--socket", help="Unix domain socket for local clients (default: daemon.sock in the data dir)")
+    parser.add_argument("--no-socket", action="store_true", help="Only listen on TCP")
+    parser.add_argument("--lease", type=float, default=jobs.LEASE_TIME,
+                        help="Seconds a render job stays leased when the worker doesn't ask for a lease time")
+    parser.add_argument("--shared", action="store_true",
+                        help="Exit once the last attached Blender instance has detached or exited")
+    return parser.parse_args()
+
 
 def start():
+    global shared
+    args = parse_args()
     loop = asyncio.get_event_loop()
-    loop.run_until_complete(start_server())
-    loop.run_forever()
+    shared = args.shared
+    queue.lease_time = args.lease
+    queue.on_change = publish_batch
+
+    running = discovery.read_lockfile()
+    if running is not None:
+        # two daemons would also write to the same journal
+        print(f"Butler daemon already running (pid {running['pid']}, port {running['port']})")
+        sys.exit(1)
+
+    if not args.no_persist:
+        restore(args.data_dir)
+
+    socket_path = None if args.no_socket else args.socket or os.path.join(args.data_dir, "daemon.sock")
+
+    try:
+        loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    except (NotImplementedError, AttributeError):
+        # no signal handlers on Windows
+        pass
+
+    try:
+        try:
+            loop.run_until_complete(start_server(args.port, args.tick, socket_path))
+        except OSError as e:
+            print(f"Couldn't listen on port {args.port} ({e})")
+            sys.exit(1)
+        loop.run_forever()
+    finally:
+        discovery.remove_lockfile()
+        if socket_file is not None and os.path.exists(socket_file):
+            os.remove(socket_file)
+        if store is not None:
+            store.close()
 
 
 if __name__ == "__main__":
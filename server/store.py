@@ -0,0 +1,138 @@
+# Keeps the task state of the daemon on disk, so it survives restarts.
+# Every update is appended to a journal, fsynced in batches. Every now and then
+# the state is compacted into a snapshot and older journal segments are deleted.
+# Recovery loads the snapshot and only replays the journal entries after it.
+
+import asyncio
+import glob
+import json
+import os
+
+SNAPSHOT = "snapshot.json"
+SEGMENT = "journal-{:012d}.jsonl"
+
+
+def fsync(fd):
+    try:
+        os.fsync(fd)
+    except OSError:
+        # the segment got closed by a compaction in the meantime
+        pass
+
+
+class TaskStore:
+    def __init__(self, directory, fsync_interval=0.2, compact_every=2000):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.journal = None
+        self.appended = 0
+        self.dirty = False
+        self.compacting = False
+        self.flusher = None
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def segments(self):
+        return sorted(glob.glob(self.path("journal-*.jsonl")))
+
+    def load(self):
+        '''Returns (seq, tasks, entries) with the journal entries replayed on top of the snapshot.'''
+        seq = 0
+        tasks = {}
+        try:
+            with open(self.path(SNAPSHOT)) as f:
+                snapshot = json.load(f)
+            seq = snapshot["seq"]
+            tasks = snapshot["tasks"]
+        except (OSError, ValueError, KeyError):
+            pass
+
+        entries = []
+        for segment in self.segments():
+            with open(segment) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # torn write at the end of the journal
+                        break
+                    if entry["seq"] <= seq:
+                        continue
+                    for id, fields in entry["tasks"].items():
+                        tasks.setdefault(id, {}).update(fields)
+                    seq = entry["seq"]
+                    entries.append((seq, entry["tasks"]))
+
+        print(f"Restored {len(tasks)} tasks at seq {seq} ({len(entries)} journal entries replayed)")
+        return seq, tasks, entries
+
+    def open(self, seq):
+        self.journal = open(self.path(SEGMENT.format(seq + 1)), "a", buffering=1)
+        self.flusher = asyncio.ensure_future(self.flush_periodically())
+
+    def append(self, seq, changes, tasks):
+        # line buffered, so an entry reaches the OS right away and only fsync is batched
+        self.journal.write(json.dumps({"seq": seq, "tasks": changes}) + "\n")
+        self.dirty = True
+        self.appended += 1
+
+        if self.appended >= self.compact_every and not self.compacting:
+            self.compact(seq, tasks)
+
+    def fsync(self):
+        if self.dirty and self.journal is not None:
+            self.dirty = False
+            self.journal.flush()
+            return asyncio.get_event_loop().run_in_executor(None, fsync, self.journal.fileno())
+        return None
+
+    async def flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.fsync_interval)
+            pending = self.fsync()
+            if pending is not None:
+                await pending
+
+    def compact(self, seq, tasks):
+        '''Snapshots the state at `seq` and drops the journal segments it covers.'''
+        self.compacting = True
+        self.appended = 0
+        old = self.segments()
+
+        # new updates go to a fresh segment while the snapshot is written
+        previous = self.journal
+        previous.flush()
+        fsync(previous.fileno())
+        previous.close()
+        self.journal = open(self.path(SEGMENT.format(seq + 1)), "a", buffering=1)
+
+        data = json.dumps({"seq": seq, "tasks": tasks})
+        asyncio.ensure_future(self.finish_compaction(data, old))
+
+    async def finish_compaction(self, data, old):
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, self.write_snapshot, data)
+            for segment in old:
+                os.remove(segment)
+        finally:
+            self.compacting = False
+
+    def write_snapshot(self, data):
+        tmp = self.path(SNAPSHOT + ".tmp")
+        with open(tmp, "w") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path(SNAPSHOT))
+
+    def close(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+        if self.journal is not None:
+            self.journal.flush()
+            fsync(self.journal.fileno())
+            self.journal.close()
+            self.journal = None
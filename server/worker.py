@@ -0,0 +1,234 @@
+# Render node for the daemon's work queue. Leases one job (a frame range of a
+# render) at a time from a coordinator, renders it with "blender -b" and keeps
+# the lease alive with heartbeats that report the frames saved so far:
+#
+#   python worker.py --coordinator http://render-host:2048 --blender /opt/blender/blender
+#
+# Several workers can run on one machine, e.g. with --threads to split its cores.
+# The .blend snapshot and the output directory have to be reachable under the same
+# paths as on the submitting host, or be translated with --map.
+# Only uses the standard library, so it runs on nodes without the addon.
+
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+LEASE_TIME = 60.0
+POLL_INTERVAL = 5.0
+# lines of Blender's output sent along when a job fails
+LOG_TAIL = 20
+
+
+def call(coordinator: str, route: str, body=None, timeout=10):
+    '''POSTs `body` (GETs without one). Returns (status, decoded JSON or None).'''
+    data = json.dumps(body).encode() if body is not None else None
+    request = urllib.request.Request(coordinator.rstrip("/") + route, data=data,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            return response.status, json.loads(data) if data else None
+    except urllib.error.HTTPError as e:
+        return e.code, None
+
+
+def translate(path: str, mappings):
+    for old, new in mappings:
+        if path.startswith(old):
+            return new + path[len(old):]
+    return path
+
+
+class Job:
+    '''A leased job and the Blender process rendering it.'''
+
+    def __init__(self, worker: "Worker", job: dict):
+        self.worker = worker
+        self.id = job["id"]
+        self.job = job
+        self.frames = set()
+        self.reported = set()
+        self.current = None
+        self.log = []
+        self.lost = False
+        self.lock = threading.Lock()
+        self.process = None
+        # when the lease was last renewed, it runs out lease_time seconds later
+        self.renewed = time.monotonic()
+
+    def command(self):
+        w = self.worker
+        command = [
+            w.blender, "-b", translate(self.job["blendfile"], w.mappings),
+            "-S", self.job["scene"],
+            "-o", translate(self.job["output"], w.mappings),
+        ]
+        if w.threads:
+            command += ["-t", str(w.threads)]
+        # Blender handles its arguments in order, so one process renders every range
+        for start, end in self.job["ranges"]:
+            command += ["-s", str(start), "-e", str(end), "-a"]
+        return command
+
+    def read_output(self):
+        for line in self.process.stdout:
+            line = line.rstrip()
+            with self.lock:
+                self.log.append(line)
+                del self.log[:-LOG_TAIL]
+                # "Fra:12 Mem:..." while rendering frame 12, "Saved: '...'" once it's written
+                if line.startswith("Fra:"):
+                    try:
+                        self.current = int(line[4:].split(maxsplit=1)[0])
+                    except ValueError:
+                        pass
+                elif line.startswith("Saved:") and self.current is not None:
+                    self.frames.add(self.current)
+
+    def heartbeats(self):
+        interval = self.worker.lease_time / 3
+        while self.process.poll() is None:
+            time.sleep(interval)
+            if self.process.poll() is not None:
+                break
+            with self.lock:
+                frames = sorted(self.frames - self.reported)
+            try:
+                status, _ = self.worker.call(f"/jobs/{self.id}/heartbeat",
+                                             {"frames": frames, "lease": self.worker.lease_time})
+            except OSError as e:
+                # the lease survives a few missed heartbeats
+                print(f"Heartbeat failed ({e})")
+                continue
+            if status == 409:
+                print(f"Lost the lease on {self.id}, stopping")
+                self.lost = True
+                self.process.terminate()
+                return
+            if status == 200:
+                self.renewed = time.monotonic()
+                self.reported.update(frames)
+
+    def report(self, route: str, body: dict):
+        '''Sends the result, retrying while the coordinator is unreachable and the lease
+        hasn't run out. Returns the status, None if the coordinator couldn't be reached.'''
+        while True:
+            try:
+                status, _ = self.worker.call(f"/jobs/{self.id}/{route}", body)
+                return status
+            except OSError as e:
+                left = self.renewed + self.worker.lease_time - time.monotonic()
+                if left <= 0:
+                    print(f"Couldn't report {self.id} before its lease ran out ({e})")
+                    return None
+                print(f"Couldn't report {self.id} ({e}), retrying")
+                time.sleep(min(self.worker.poll_interval, left))
+
+    def run(self):
+        ranges = ", ".join(f"{s} - {e}" for s, e in self.job["ranges"])
+        print(f"Rendering {self.id} (frames {ranges}, attempt {self.job['attempt']})")
+        self.process = subprocess.Popen(self.command(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        stdin=subprocess.DEVNULL, text=True, errors="replace")
+        self.worker.process = self.process
+        reader = threading.Thread(target=self.read_output, daemon=True)
+        reader.start()
+        heartbeats = threading.Thread(target=self.heartbeats, daemon=True)
+        heartbeats.start()
+
+        code = self.process.wait()
+        reader.join()
+        self.worker.process = None
+        if self.lost:
+            return
+
+        body = {"frames": sorted(self.frames)}
+        if code == 0:
+            status = self.report("complete", body)
+            print(f"Finished {self.id}" if status == 200 else f"Finished {self.id}, but the lease was lost")
+        else:
+            body["error"] = f"Blender exited with code {code}: " + "\n".join(self.log[-LOG_TAIL:])
+            self.report("fail", body)
+            print(f"Failed {self.id} (exit code {code})")
+
+
+class Worker:
+    def __init__(self, args):
+        self.coordinator = args.coordinator
+        self.blender = args.blender
+        self.name = args.name or f"{socket.gethostname()}-{os.getpid()}"
+        self.threads = args.threads
+        self.lease_time = args.lease
+        self.poll_interval = args.poll
+        self.exit_when_idle = args.exit_when_idle
+        self.mappings = [tuple(m.split("=", 1)) for m in args.map]
+        self.process = None
+        self.stopping = False
+
+    def call(self, route: str, body: dict):
+        return call(self.coordinator, route, {**body, "worker": self.name})
+
+    def idle(self):
+        '''Whether every batch is finished, not just waiting for jobs leased by other workers.'''
+        try:
+            status, batches = call(self.coordinator, "/batches")
+        except OSError:
+            return False
+        return status == 200 and all(batch["finished"] for batch in batches)
+
+    def lease(self):
+        try:
+            status, job = self.call("/jobs/lease", {"lease": self.lease_time})
+        except OSError as e:
+            print(f"Couldn't reach {self.coordinator} ({e})")
+            return None
+        return job if status == 200 else None
+
+    def run(self):
+        print(f"Worker {self.name} taking jobs from {self.coordinator}")
+        while not self.stopping:
+            job = self.lease()
+            if job is None:
+                if self.exit_when_idle and self.idle():
+                    break
+                time.sleep(self.poll_interval)
+                continue
+            Job(self, job).run()
+
+    def stop(self, *args):
+        # the coordinator hands the job to someone else once its lease runs out
+        self.stopping = True
+        if self.process is not None:
+            self.process.terminate()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Blender Butler render worker")
+    parser.add_argument("--coordinator", default="http://127.0.0.1:2048", help="URL of the Butler daemon")
+    parser.add_argument("--blender", default="blender", help="Blender executable")
+    parser.add_argument("--name", help="Worker name (default: <hostname>-<pid>)")
+    parser.add_argument("--threads", type=int, default=0, help="Render threads per job (0 uses every core)")
+    parser.add_argument("--lease", type=float, default=LEASE_TIME, help="Seconds a job stays leased without a heartbeat")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL, help="Seconds to wait when there's nothing to do")
+    parser.add_argument("--map", action="append", default=[], metavar="OLD=NEW",
+                        help="Replace the path prefix OLD of the .blend and output with NEW (repeatable)")
+    parser.add_argument("--exit-when-idle", action="store_true", help="Exit once every queued render is finished")
+    return parser.parse_args()
+
+
+def main():
+    worker = Worker(parse_args())
+    signal.signal(signal.SIGINT, worker.stop)
+    signal.signal(signal.SIGTERM, worker.stop)
+    worker.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,306 @@
+# Finds runs of frames in which nothing visible changes (held shots), so only the
+# first frame of a run has to be rendered. The others become hardlinks (or copies,
+# where the file system can't link) of its output.
+#
+# Before rendering, every frame of the range is evaluated once and fingerprinted:
+# the transforms of everything the depsgraph instances, evaluated geometry with all
+# of its attributes (UVs, colours, whatever geometry nodes write), the active camera
+# and the values of every animated or driven property. Anything that changes the
+# image without showing up there (animated noise seeds, movie textures, burnt-in
+# frame numbers, ...) disables the detection instead of risking wrong frames.
+
+import array
+import hashlib
+import os
+import shutil
+from typing import Dict, List, Optional
+
+import bpy
+
+# geometry that can be hashed from its evaluated mesh
+MESH_TYPES = {"MESH", "CURVE", "SURFACE", "FONT", "META"}
+# geometry without a mesh to hash, objects of these types make every frame unique
+OPAQUE_TYPES = {"VOLUME", "POINTCLOUD", "CURVES", "GPENCIL", "GREASEPENCIL"}
+# compositor nodes whose output depends on the frame by themselves
+TIME_NODES = {"CompositorNodeTime", "CompositorNodeSceneTime", "CompositorNodeMovieClip",
+              "CompositorNodeMovieDistortion", "CompositorNodeStabilize", "CompositorNodeTrackPos"}
+# attribute data type -> (property, values per element, array typecode or None for booleans)
+ATTRIBUTE_LAYOUTS = {
+    "FLOAT": ("value", 1, "f"),
+    "INT": ("value", 1, "i"),
+    "INT8": ("value", 1, "i"),
+    "BOOLEAN": ("value", 1, None),
+    "FLOAT2": ("vector", 2, "f"),
+    "FLOAT_VECTOR": ("vector", 3, "f"),
+    "INT32_2D": ("value", 2, "i"),
+    "QUATERNION": ("value", 4, "f"),
+    "FLOAT4X4": ("value", 16, "f"),
+    "FLOAT_COLOR": ("color", 4, "f"),
+    "BYTE_COLOR": ("color", 4, "f"),
+}
+ANIMATED_DATA = ("objects", "meshes", "curves", "materials", "worlds", "cameras", "lights",
+                 "shape_keys", "node_groups", "textures", "particles", "scenes")
+
+
+def unsupported(scene) -> Optional[str]:
+    '''Returns why frames of this scene can't be compared, or None if they can.'''
+    r = scene.render
+    if r.engine == "CYCLES" and scene.cycles.use_animated_seed:
+        return "the Cycles seed is animated"
+    if r.use_stamp:
+        return "metadata is burnt into the frames"
+    if r.use_sequencer and scene.sequence_editor is not None and len(scene.sequence_editor.sequences_all):
+        return "the sequencer has strips"
+    if r.use_compositing and scene.use_nodes and scene.node_tree is not None:
+        if any(node.bl_idname in TIME_NODES for node in scene.node_tree.nodes):
+            return "the compositor uses time dependent nodes"
+    for image in bpy.data.images:
+        if image.users and image.source in ("SEQUENCE", "MOVIE"):
+            return f"image {image.name} is a sequence or movie"
+    if any(clip.users for clip in bpy.data.movieclips):
+        return "the file uses movie clips"
+    return None
+
+
+def rendered_objects(scene):
+    '''Objects in collections that the enabled view layers render.'''
+    objects = set()
+
+    def visit(layer_collection):
+        if layer_collection.exclude or layer_collection.collection.hide_render:
+            return
+        objects.update(obj for obj in layer_collection.collection.objects if not obj.hide_render)
+        for child in layer_collection.children:
+            visit(child)
+
+    for view_layer in scene.view_layers:
+        if view_layer.use:
+            visit(view_layer.layer_collection)
+    return objects
+
+
+def hidden_objects(scene, depsgraph) -> List[str]:
+    '''Objects that are rendered but not evaluated in the viewport, so they can't be fingerprinted.'''
+    evaluated = {obj.original.name for obj in depsgraph.objects}
+    return sorted(obj.name for obj in rendered_objects(scene)
+                  if obj.name not in evaluated and obj.type not in ("EMPTY", "ARMATURE"))
+
+
+def animated_paths():
+    '''Returns (ID, data path, array index) of every animated or driven property.'''
+    paths = []
+    for collection in ANIMATED_DATA:
+        for id in getattr(bpy.data, collection, ()):
+            # node trees of materials, worlds, lights and scenes are animated on their own
+            owners = [(id, "")]
+            node_tree = getattr(id, "node_tree", None)
+            if node_tree is not None:
+                owners.append((node_tree, "node_tree."))
+
+            for owner, prefix in owners:
+                anim = owner.animation_data
+                if anim is None:
+                    continue
+                fcurves = list(anim.drivers)
+                if anim.action is not None:
+                    fcurves += list(anim.action.fcurves)
+                for track in anim.nla_tracks:
+                    for strip in track.strips:
+                        if strip.action is not None:
+                            fcurves += list(strip.action.fcurves)
+                paths.extend((id, prefix + fc.data_path, fc.array_index) for fc in fcurves)
+    return paths
+
+
+def update_floats(h, collection, attr: str, size: int):
+    values = array.array("f", [0.0]) * (len(collection) * size)
+    collection.foreach_get(attr, values)
+    h.update(values.tobytes())
+
+
+def update_matrix(h, matrix):
+    h.update(array.array("f", [v for row in matrix for v in row]).tobytes())
+
+
+def hash_attribute(h, attribute) -> bool:
+    '''Hashes the values of a generic attribute layer. Returns False for types it can't read.'''
+    layout = ATTRIBUTE_LAYOUTS.get(attribute.data_type)
+    if layout is None:
+        return False
+    prop, size, typecode = layout
+    h.update(f"{attribute.name}:{attribute.domain}:{attribute.data_type}".encode())
+    count = len(attribute.data) * size
+    if typecode is None:
+        # booleans don't fit an array buffer
+        values = [False] * count
+        attribute.data.foreach_get(prop, values)
+        h.update(bytes(values))
+    else:
+        values = array.array(typecode, [0]) * count
+        attribute.data.foreach_get(prop, values)
+        h.update(values.tobytes())
+    return True
+
+
+def hash_mesh(h, mesh) -> bool:
+    '''Hashes topology, positions and every attribute shaders can read (UVs, colours, custom
+    attributes, smooth shading). Returns False if some of it couldn't be hashed.'''
+    h.update(f"{len(mesh.vertices)}:{len(mesh.edges)}:{len(mesh.polygons)}:{len(mesh.loops)}".encode())
+    update_floats(h, mesh.vertices, "co", 3)
+    material_indices = array.array("i", [0]) * len(mesh.polygons)
+    mesh.polygons.foreach_get("material_index", material_indices)
+    h.update(material_indices.tobytes())
+    smooth = [False] * len(mesh.polygons)
+    mesh.polygons.foreach_get("use_smooth", smooth)
+    h.update(bytes(smooth))
+    # before Blender 3.5, UV maps aren't generic attributes
+    for layer in mesh.uv_layers:
+        h.update(layer.name.encode())
+        update_floats(h, layer.data, "uv", 2)
+
+    complete = True
+    for attribute in mesh.attributes:
+        complete = hash_attribute(h, attribute) and complete
+    return complete
+
+
+class Fingerprinter:
+    def __init__(self, scene, depsgraph):
+        self.scene = scene
+        self.depsgraph = depsgraph
+        self.paths = animated_paths()
+
+    def geometry(self, h, obj):
+        h.update(obj.name.encode())
+        h.update("|".join(slot.material.name if slot.material else "" for slot in obj.material_slots).encode())
+        if obj.type in OPAQUE_TYPES:
+            h.update(str(self.scene.frame_current).encode())
+        elif obj.type in MESH_TYPES:
+            mesh = obj.to_mesh()
+            try:
+                if mesh is not None and not hash_mesh(h, mesh):
+                    # attributes that can't be compared make the frame unique
+                    h.update(str(self.scene.frame_current).encode())
+            finally:
+                obj.to_mesh_clear()
+
+        for psys in getattr(obj, "particle_systems", ()):
+            if psys.settings.type == "HAIR" and psys.use_hair_dynamics:
+                h.update(str(self.scene.frame_current).encode())
+            update_floats(h, psys.particles, "location", 3)
+            update_floats(h, psys.particles, "rotation", 4)
+
+    def camera(self, h):
+        camera = self.scene.camera
+        if camera is None:
+            return
+        # markers can switch cameras
+        h.update(camera.name.encode())
+        data = camera.evaluated_get(self.depsgraph).data
+        if camera.type == "CAMERA":
+            values = [data.lens, data.ortho_scale, data.shift_x, data.shift_y, data.sensor_width,
+                      data.clip_start, data.clip_end, data.dof.use_dof, data.dof.focus_distance, data.dof.aperture_fstop]
+            h.update(repr(values).encode())
+
+    def properties(self, h):
+        for id, path, index in self.paths:
+            try:
+                value = id.evaluated_get(self.depsgraph).path_resolve(path)
+            except (ValueError, AttributeError, TypeError, RuntimeError):
+                continue
+            if hasattr(value, "__len__") and not isinstance(value, str):
+                try:
+                    value = value[index]
+                except (IndexError, TypeError):
+                    value = tuple(value)
+            h.update(repr((id.name, path, index, value)).encode())
+
+    def fingerprint(self) -> str:
+        '''Fingerprints the evaluated state of the current frame.'''
+        h = hashlib.blake2b(digest_size=20)
+        for obj in self.depsgraph.objects:
+            self.geometry(h, obj)
+        for instance in self.depsgraph.object_instances:
+            obj = instance.object
+            h.update(obj.original.name.encode())
+            update_matrix(h, instance.matrix_world)
+            if instance.is_instance and obj.type == "MESH" and obj.data is not None:
+                # geometry generated for the instance itself, e.g. by geometry nodes
+                if not hash_mesh(h, obj.data):
+                    h.update(str(self.scene.frame_current).encode())
+        self.camera(h)
+        self.properties(h)
+        return h.hexdigest()
+
+
+def find_copies(ctx, frames: List[int]) -> Dict[int, int]:
+    '''Returns {frame: frame rendered in its place} for every frame which looks exactly
+    like the one before it. Leaves the scene at the frame it was on.'''
+    scene = ctx.scene
+    frames = sorted(frames)
+    if len(frames) < 2:
+        return {}
+
+    # with motion blur, a frame also shows a bit of its neighbours
+    blur = scene.render.use_motion_blur
+    current = scene.frame_current
+    depsgraph = ctx.evaluated_depsgraph_get()
+    hidden = hidden_objects(scene, depsgraph)
+    if hidden:
+        print(f"Not looking for static frames, {', '.join(hidden)} is hidden in the viewport but rendered")
+        return {}
+    fingerprinter = Fingerprinter(scene, depsgraph)
+    prints = {}
+    try:
+        needed = sorted({n for f in frames for n in ((f - 1, f, f + 1) if blur else (f,))})
+        for f in needed:
+            scene.frame_set(f)
+            prints[f] = fingerprinter.fingerprint()
+    finally:
+        scene.frame_set(current)
+
+    def key(f):
+        return (prints[f - 1], prints[f], prints[f + 1]) if blur else prints[f]
+
+    copies = {}
+    source = frames[0]
+    for previous, f in zip(frames, frames[1:]):
+        if f == previous + 1 and key(f) == key(previous):
+            copies[f] = source
+        else:
+            source = f
+    return copies
+
+
+def unlink_shared(scene, frames):
+    '''Deletes outputs of `frames` that are linked to other frames. Blender overwrites files
+    in place, so rendering into them would change every frame sharing the file.'''
+    for frame in frames:
+        path = scene.render.frame_path(frame=frame)
+        try:
+            if os.stat(path).st_nlink > 1:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def fill(scene, copies: Dict[int, int]) -> int:
+    '''Links (or copies) the output of each source frame to the frames it stands in for.
+    Returns the number of frames filled in.'''
+    filled = 0
+    for frame, source in sorted(copies.items()):
+        src = scene.render.frame_path(frame=source)
+        dst = scene.render.frame_path(frame=frame)
+        if not os.path.exists(src):
+            # the source frame failed to render
+            continue
+        try:
+            os.remove(dst)
+        except OSError:
+            pass
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)
+        filled += 1
+    return filled
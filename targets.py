@@ -0,0 +1,71 @@
+# Reverse index from object names to the flow actions that target them, so edits
+# only touch the entries they change instead of rescanning every flow.
+
+
+class TargetIndex:
+    '''Maps object names to the uids of the actions targeting them.'''
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.targets = {}  # action uid -> (object name, is bake action)
+        self.by_name = {}  # object name -> set of action uids
+        self.bake_counts = {}  # object name -> number of bake actions targeting it
+        self.pointers = {}  # object pointer -> object name, to recognize renamed objects
+
+    @property
+    def bake_objects(self):
+        return self.bake_counts.keys()
+
+    def set(self, uid: str, name: str, bake: bool, pointer=None):
+        '''Points action `uid` at object `name`. Returns True if `name` just became a bake object.'''
+        self.remove(uid)
+        if not name:
+            return False
+
+        self.targets[uid] = (name, bake)
+        self.by_name.setdefault(name, set()).add(uid)
+        if pointer is not None:
+            self.pointers[pointer] = name
+
+        if bake:
+            count = self.bake_counts.get(name, 0)
+            self.bake_counts[name] = count + 1
+            return count == 0
+        return False
+
+    def remove(self, uid: str):
+        '''Forgets action `uid`. Returns the object name it targeted, if any.'''
+        entry = self.targets.pop(uid, None)
+        if entry is None:
+            return None
+
+        name, bake = entry
+        uids = self.by_name[name]
+        uids.discard(uid)
+        if not uids:
+            del self.by_name[name]
+
+        if bake:
+            count = self.bake_counts[name] - 1
+            if count:
+                self.bake_counts[name] = count
+            else:
+                del self.bake_counts[name]
+        return name
+
+    def actions(self, name: str):
+        return self.by_name.get(name, ())
+
+    def renamed_from(self, pointer, name: str):
+        '''Returns the old name of an indexed object that is now called `name`.'''
+        old = self.pointers.get(pointer)
+        if old is None or old == name or old not in self.by_name:
+            return None
+        return old
+
+    def forget_pointer(self, name: str):
+        for pointer, n in list(self.pointers.items()):
+            if n == name:
+                del self.pointers[pointer]
@@ -0,0 +1,179 @@
+# Sends task updates to the Butler daemon from a background thread, so reporting
+# progress never blocks Blender's main thread. Updates of the same task are
+# coalesced and everything pending goes out in a single request.
+# A daemon on the same host is reached through its Unix domain socket if it has
+# one, which skips connection setup and HTTP for every batch. HTTP is the fallback.
+
+import collections
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .server import framing
+
+# after the socket failed, batches go over HTTP for this many seconds
+SOCKET_RETRY = 30.0
+
+
+class TelemetryClient:
+    '''Queues task updates and posts them to `url` in batches.'''
+
+    def __init__(self, url: str, max_pending=32, flush_interval=0.1, timeout=(1.0, 5.0),
+                 min_backoff=0.5, max_backoff=30.0):
+        self.url = url
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = threading.Lock()
+        self.pending = collections.OrderedDict()  # task id -> deque of updates
+        self.wake = threading.Event()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.session = None
+        # set once the daemon is known to listen on a Unix domain socket
+        self.socket_path = None
+        self.connection = None
+        self.socket_retry_at = 0.0
+
+    def start(self):
+        if self.thread is not None:
+            return
+        self.stopping.clear()
+        self.thread = threading.Thread(target=self.run, name="butler-telemetry", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1.0):
+        '''Stops the sender, trying to deliver what's still pending within `timeout` seconds.'''
+        if self.thread is None:
+            return
+        self.stopping.set()
+        self.wake.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+    def update(self, id: str, **fields):
+        '''Queues an update for task `id`. Cheap enough to call on every frame.'''
+        fields = {k: v for k, v in fields.items() if v is not None}
+        if not fields:
+            return
+
+        with self.lock:
+            queue = self.pending.get(id)
+            if queue is None:
+                queue = self.pending[id] = collections.deque()
+
+            if queue and fields.keys() == {"progress"}:
+                # superseded progress values are never sent
+                queue[-1]["progress"] = fields["progress"]
+            else:
+                queue.append(fields)
+                if len(queue) > self.max_pending:
+                    oldest = queue.popleft()
+                    queue[0] = {**oldest, **queue[0]}
+
+        self.wake.set()
+
+    def take(self):
+        '''Removes everything pending, merged into one update per task.'''
+        with self.lock:
+            pending = self.pending
+            self.pending = collections.OrderedDict()
+
+        batch = []
+        for id, queue in pending.items():
+            merged = {"id": id}
+            for fields in queue:
+                merged.update(fields)
+            batch.append(merged)
+        return batch
+
+    def requeue(self, batch):
+        '''Puts a batch that couldn't be sent back in front of newer updates.'''
+        with self.lock:
+            for update in reversed(batch):
+                fields = {k: v for k, v in update.items() if k != "id"}
+                queue = self.pending.get(update["id"])
+                if queue is None:
+                    queue = self.pending[update["id"]] = collections.deque()
+                    self.pending.move_to_end(update["id"], last=False)
+                queue.appendleft(fields)
+
+    def send_socket(self, batch):
+        if self.connection is None:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout[0])
+            try:
+                connection.connect(self.socket_path)
+            except OSError:
+                connection.close()
+                raise
+            connection.settimeout(self.timeout[1])
+            self.connection = connection
+
+        self.connection.sendall(framing.pack(batch))
+        reply = framing.read(self.connection)
+        if not reply.get("ok"):
+            raise ValueError(reply.get("error"))
+
+    def close_socket(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def send(self, batch) -> bool:
+        if self.socket_path is not None and hasattr(socket, "AF_UNIX") and time.monotonic() >= self.socket_retry_at:
+            try:
+                self.send_socket(batch)
+                return True
+            except (OSError, ValueError) as e:
+                self.close_socket()
+                self.socket_retry_at = time.monotonic() + SOCKET_RETRY
+                print(f"Couldn't use the Butler daemon's socket ({e.__class__.__name__}), falling back to HTTP")
+
+        try:
+            response = self.session.post(self.url, json=batch, timeout=self.timeout)
+            response.raise_for_status()
+            return True
+        except requests.RequestException as e:
+            print(f"Couldn't reach the Butler daemon ({e.__class__.__name__})")
+            return False
+
+    def run(self):
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+
+        backoff = self.min_backoff
+        try:
+            while True:
+                self.wake.wait()
+                self.wake.clear()
+
+                batch = self.take()
+                if batch:
+                    if self.send(batch):
+                        backoff = self.min_backoff
+                    else:
+                        self.requeue(batch)
+                        if self.stopping.is_set():
+                            return
+                        # don't hammer a daemon that's down, new updates just pile up meanwhile
+                        self.stopping.wait(backoff)
+                        backoff = min(backoff * 2, self.max_backoff)
+                        self.wake.set()
+                        continue
+
+                if self.stopping.is_set():
+                    return
+
+                # gives a burst of updates the chance to end up in the same request
+                self.stopping.wait(self.flush_interval)
+        finally:
+            self.close_socket()
+            self.session.close()
@@ -0,0 +1,314 @@
+# Renders an animation in background Blender processes ("blender -b").
+# The frame range gets cut into chunks which are handed to a pool of workers,
+# so a render can make use of every core instead of just one interactive session.
+# Chunks can also go to the daemon's work queue, to be rendered by other machines.
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from typing import List, Tuple
+
+import bpy
+import requests
+
+
+def split_ranges(ranges: List[Tuple[int, int]], workers: int, chunk_size=0) -> List[Tuple[int, int]]:
+    '''Cuts the inclusive frame ranges into chunks.
+    A chunk size of 0 splits the frames evenly across all workers.'''
+    frames = sum(end - start + 1 for start, end in ranges)
+    if frames <= 0:
+        return []
+
+    if chunk_size <= 0:
+        chunk_size = -(-frames // max(1, workers))
+
+    return [(s, min(s + chunk_size - 1, end))
+            for start, end in ranges
+            for s in range(start, end + 1, chunk_size)]
+
+
+def save_snapshot(directory: str) -> str:
+    '''Saves a copy of the current state of the .blend file which workers can open.'''
+    name = bpy.path.basename(bpy.data.filepath) or "untitled.blend"
+    path = os.path.join(directory, name)
+    bpy.ops.wm.save_as_mainfile(filepath=path, copy=True)
+    return path
+
+
+class RenderChunk:
+    def __init__(self, start: int, end: int):
+        self.start = start
+        self.end = end
+        self.attempts = 0
+        self.failed_on = set()
+        self.process = None
+        self.worker = None
+        self.log = None
+        # first frame of the chunk not seen on disk yet, and when the one before it was written
+        self.next_frame = start
+        self.launched = None
+        self.last_write = None
+
+    def __str__(self):
+        return f"{self.start} - {self.end}"
+
+
+class RenderPool:
+    '''Runs every chunk in its own `blender -b` process, at most `workers` at a time.
+    Failed chunks are retried up to `retries` times, preferably on another worker slot.'''
+
+    def __init__(self, scene, chunks: List[Tuple[int, int]], workers=4, retries=2):
+        self.scene = scene
+        self.pending = [RenderChunk(s, e) for s, e in chunks]
+        self.running: List[RenderChunk] = []
+        self.finished: List[RenderChunk] = []
+        self.failed: List[RenderChunk] = []
+        self.workers = max(1, workers)
+        self.retries = retries
+        self.threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self.output = bpy.path.abspath(scene.render.filepath)
+        # without overwrite, Blender skips frames that are already on disk
+        self.overwrite = scene.render.use_overwrite
+        self.directory = None
+        self.blendfile = None
+        self.started = None
+        # called from a worker thread whenever a process exits
+        self.notify = lambda: None
+        # called with (frame, seconds) for each frame a worker finishes, seconds is None if untimed
+        self.on_frame = lambda frame, seconds: None
+
+    def start(self):
+        self.started = time.time()
+        self.directory = tempfile.mkdtemp(prefix="butler_render_")
+        self.blendfile = save_snapshot(self.directory)
+        print(f"Rendering {len(self.pending)} chunks on {self.workers} workers")
+        self.fill()
+
+    def command(self, chunk: RenderChunk):
+        return [
+            bpy.app.binary_path, "-b", self.blendfile,
+            "-S", self.scene.name,
+            "-o", self.output,
+            "-t", str(self.threads),
+            "-s", str(chunk.start),
+            "-e", str(chunk.end),
+            "-a",
+        ]
+
+    def free_worker(self, chunk: RenderChunk):
+        busy = {c.worker for c in self.running}
+        free = [w for w in range(self.workers) if w not in busy]
+        fresh = [w for w in free if w not in chunk.failed_on]
+        return (fresh or free)[0]
+
+    def launch(self, chunk: RenderChunk):
+        chunk.attempts += 1
+        chunk.worker = self.free_worker(chunk)
+        chunk.log = os.path.join(self.directory, f"chunk_{chunk.start}_{chunk.end}_{chunk.attempts}.log")
+
+        print(f"Worker {chunk.worker}: rendering frames {chunk}")
+        chunk.launched = time.time()
+        # a retry renders the frames seen before again, so its first new frame can't be timed
+        chunk.last_write = chunk.launched if chunk.next_frame == chunk.start else None
+        with open(chunk.log, "w") as log:
+            chunk.process = subprocess.Popen(self.command(chunk), stdout=log, stderr=subprocess.STDOUT)
+        self.running.append(chunk)
+
+        process = chunk.process
+        def wait():
+            process.wait()
+            self.notify()
+        threading.Thread(target=wait, daemon=True).start()
+
+    def fill(self):
+        while self.pending and len(self.running) < self.workers:
+            self.launch(self.pending.pop(0))
+
+    def is_written(self, frame: int) -> bool:
+        try:
+            return os.stat(self.scene.render.frame_path(frame=frame)).st_mtime >= self.started or not self.overwrite
+        except OSError:
+            return False
+
+    def track(self, chunk: RenderChunk):
+        '''Reports the frames a worker has written since the last poll. Workers render their
+        chunk in order, so only the next frame has to be looked at.'''
+        while chunk.next_frame <= chunk.end:
+            try:
+                mtime = os.stat(self.scene.render.frame_path(frame=chunk.next_frame)).st_mtime
+            except OSError:
+                return
+            if mtime < self.started and self.overwrite:
+                return
+
+            if mtime >= chunk.launched and chunk.last_write is not None:
+                self.on_frame(chunk.next_frame, mtime - chunk.last_write)
+            else:
+                self.on_frame(chunk.next_frame, None)
+            if mtime >= chunk.launched:
+                chunk.last_write = mtime
+            chunk.next_frame += 1
+
+    def missing_frames(self, chunk: RenderChunk):
+        return [f for f in range(chunk.start, chunk.end + 1) if not self.is_written(f)]
+
+    def reap(self, chunk: RenderChunk):
+        code = chunk.process.returncode
+        self.running.remove(chunk)
+        chunk.process = None
+
+        missing = self.missing_frames(chunk)
+        if code == 0 and not missing:
+            self.finished.append(chunk)
+            return
+
+        print(f"Worker {chunk.worker}: chunk {chunk} failed (exit code {code}, {len(missing)} frames missing), see {chunk.log}")
+        chunk.failed_on.add(chunk.worker)
+
+        if chunk.attempts <= self.retries:
+            self.pending.append(chunk)
+        else:
+            self.failed.append(chunk)
+
+    def poll(self) -> bool:
+        '''Reaps finished workers and starts new ones. Returns True once every chunk is done.'''
+        for chunk in list(self.running):
+            self.track(chunk)
+            if chunk.process.poll() is not None:
+                self.reap(chunk)
+
+        self.fill()
+
+        if self.running or self.pending:
+            return False
+
+        self.cleanup()
+        return True
+
+    def cancel(self):
+        for chunk in self.running:
+            chunk.process.terminate()
+        self.running.clear()
+        self.pending.clear()
+        self.cleanup()
+
+    def cleanup(self):
+        if self.failed:
+            # keep the logs of failed chunks around
+            return
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+
+class QueuedRender:
+    '''Submits the chunks as jobs to the daemon's work queue, where render workers
+    (server/worker.py, on this host or others) pick them up. The snapshot is saved
+    next to the .blend, so workers that share the project directory can open it.'''
+
+    STATUS_INTERVAL = 1.0
+
+    def __init__(self, scene, chunks: List[Tuple[int, int]], url: str, title="", task="", retries=2):
+        self.scene = scene
+        self.chunks = chunks
+        self.url = url
+        self.title = title
+        self.task = task
+        self.retries = retries
+        self.output = bpy.path.abspath(scene.render.filepath)
+        self.directory = None
+        self.batch = None
+        self.status = None
+        self.error = None
+        self.stopped = threading.Event()
+        # called from the status thread whenever the batch has finished
+        self.notify = lambda: None
+
+    def snapshot_directory(self):
+        if bpy.data.filepath:
+            parent = os.path.join(os.path.dirname(bpy.data.filepath), ".butler_queue")
+            os.makedirs(parent, exist_ok=True)
+            return tempfile.mkdtemp(prefix="render_", dir=parent)
+        return tempfile.mkdtemp(prefix="butler_queue_")
+
+    def start(self):
+        self.directory = self.snapshot_directory()
+        blendfile = save_snapshot(self.directory)
+        try:
+            response = requests.post(f"{self.url}/batches", json={
+                "blendfile": blendfile,
+                "scene": self.scene.name,
+                "output": self.output,
+                "chunks": self.chunks,
+                "title": self.title,
+                "task": self.task,
+                "max_attempts": self.retries + 1,
+            }, timeout=5.0)
+            response.raise_for_status()
+            self.batch = response.json()["batch"]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"Couldn't queue the render ({e.__class__.__name__})")
+            self.error = e
+            self.cleanup()
+            return False
+
+        print(f"Queued {len(self.chunks)} chunks as {self.batch}, waiting for workers")
+        threading.Thread(target=self.watch, name="butler-queue", daemon=True).start()
+        return True
+
+    def watch(self):
+        while not self.stopped.wait(self.STATUS_INTERVAL):
+            try:
+                response = requests.get(f"{self.url}/batches/{self.batch}", timeout=5.0)
+            except requests.RequestException:
+                continue
+            if response.status_code == 404:
+                # cancelled, or the daemon restarted
+                self.error = "gone"
+                break
+            if response.ok:
+                self.status = response.json()
+                if self.status["finished"]:
+                    break
+        self.notify()
+
+    def poll(self) -> bool:
+        '''Returns True once every job is done or has failed.'''
+        finished = self.error is not None or (self.status is not None and self.status["finished"])
+        if finished:
+            self.cleanup()
+        return finished
+
+    @property
+    def failed(self):
+        if self.error is not None:
+            return [f"{s} - {e}" for s, e in self.chunks]
+        return [f"{s} - {e}" for job in self.status["failed"] for s, e in job["frames"]]
+
+    def cancel(self):
+        '''Takes the batch off the queue, workers lose their leases on its jobs.'''
+        self.stopped.set()
+        if self.batch is not None:
+            try:
+                requests.delete(f"{self.url}/batches/{self.batch}", timeout=1.0)
+            except requests.RequestException:
+                pass
+            self.batch = None
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None
+
+    def cleanup(self):
+        self.stopped.set()
+        if self.batch is not None and self.error is None:
+            try:
+                # the result has been seen, the daemon can forget the batch
+                requests.delete(f"{self.url}/batches/{self.batch}", timeout=1.0)
+            except requests.RequestException:
+                pass
+        if self.directory is not None:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self.directory = None